@@ -3,5 +3,8 @@ import setuptools
 setuptools.setup(
     name='sim_web_app',
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': ['sim-study = sim_app.cli:main'],
+    },
 )
 
@@ -0,0 +1,313 @@
+"""
+Versioned JSON API for programmatic study submission (Flask blueprint on
+the Dash server, prefix /api/v1).
+
+POST /api/v1/jobs
+    Submit one study {"settings": {...}, "study": {...}} or a batch
+    {"jobs": [{"settings": ..., "study": ...}, ...]}. "settings" is a
+    complete settings dict (default: config.SETTINGS_FILE), "study" is
+    {"table": [{"Parameter": ..., "Variation Type": ..., "Values": ...}],
+     "mode": "single", "samples": null, "seed": 0, "curve": false}
+    with the records of the GUI study table. Returns the job handles
+    (202).
+GET /api/v1/jobs/<id>
+    Job status: queued, running, finished or failed (also if the server
+    process of the job stopped, see config.API_JOB_STALE_AFTER)
+GET /api/v1/jobs/<id>/results?offset=0&limit=1000
+    Page of the columnar result table (see df.flat_results):
+    {"columns": [...], "data": {column: [values]}, "units": {...},
+     "offset": ..., "limit": ..., "total": ..., "next": url or null}
+
+Jobs run in a thread pool of the serving process, each in one of the
+study slots of the submitting client (see StudySlot); job records and
+results are kept in the caching backend, so any worker can answer status
+and result requests. All requests need the bearer token config.API_TOKEN.
+"""
+import hmac
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify, request, url_for
+
+from sim_app import config
+from sim_app import dash_functions as df
+from sim_app.dash_app import caching_backend, client_address, \
+    result_warehouse
+from sim_app.study_functions import plan_study, run_study, StudySlot, \
+    CURRENT_DENSITY
+
+blueprint = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+STUDY_MODES = ['single', 'full', 'sensitivity'] + list(df.SAMPLING_MODES)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Queued and running jobs of this process, record updates of this process
+_active_jobs = set()
+_jobs_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.API_MAX_RUNNING_JOBS,
+                thread_name_prefix='api-job')
+            threading.Thread(target=heartbeat, name='api-job-heartbeat',
+                             daemon=True).start()
+        return _executor
+
+
+def heartbeat():
+    """
+    Refresh the records of the active jobs of this process (see stale)
+    """
+    while True:
+        time.sleep(config.API_JOB_HEARTBEAT)
+        with _jobs_lock:
+            job_ids = list(_active_jobs)
+        for job_id in job_ids:
+            update_job(job_id, heartbeat=time.time())
+
+
+def job_key(job_id):
+    return f'api-job-{job_id}'
+
+
+def result_key(job_id):
+    return f'api-result-{job_id}'
+
+
+def error(status, message):
+    return jsonify({'error': message}), status
+
+
+@blueprint.before_request
+def authorize():
+    if not config.API_TOKEN:
+        return error(401, 'API disabled, no API_TOKEN configured')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''),
+                               f'Bearer {config.API_TOKEN}'):
+        return error(401, 'Missing or invalid API token')
+
+
+# Jobs
+# --------------------------------------
+def parse_job(definition) -> dict:
+    """
+    Validated job definition, raises ValueError
+    """
+    if not isinstance(definition, dict):
+        raise ValueError('Job definition must be an object')
+    settings = definition.get('settings', df.base_settings())
+    if not isinstance(settings, dict) or not settings:
+        raise ValueError('"settings" must be a non-empty object')
+    study = definition.get('study')
+    if not isinstance(study, dict):
+        raise ValueError('"study" must be an object')
+    table = study.get('table')
+    if not isinstance(table, list) or not table \
+            or not all(isinstance(row, dict) for row in table):
+        raise ValueError('"study.table" must be a non-empty list of '
+                         'study table records (objects)')
+    mode = study.get('mode', 'single')
+    if mode not in STUDY_MODES:
+        raise ValueError(f'"study.mode" must be one of {STUDY_MODES}')
+    samples = study.get('samples')
+    if samples is not None and (not isinstance(samples, int)
+                                or isinstance(samples, bool)
+                                or samples < 1):
+        raise ValueError('"study.samples" must be a positive integer')
+    if mode in df.SAMPLING_MODES and not samples:
+        raise ValueError(f'Study mode {mode} needs "study.samples"')
+    seed = study.get('seed', 0)
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        raise ValueError('"study.seed" must be an integer')
+    table = [{'Parameter': row.get('Parameter'),
+              'Variation Type': row.get('Variation Type'),
+              'Values': row.get('Values')} for row in table]
+    curve = bool(study.get('curve')) and mode != 'sensitivity'
+
+    plan = plan_study(table, mode, samples, curve)
+    if plan['sets'] == 0:
+        raise ValueError('No parameter is varied in "study.table"')
+    if plan['runs'] > config.STUDY_MAX_RUNS:
+        raise ValueError(f"{plan['runs']} runs exceed the limit of "
+                         f"{config.STUDY_MAX_RUNS} runs per study")
+    return {'settings': settings, 'table': table, 'mode': mode,
+            'samples': samples, 'seed': seed,
+            'curve': curve, 'runs': plan['runs']}
+
+
+def update_job(job_id, **values):
+    with _jobs_lock:
+        record = caching_backend.get(job_key(job_id)) or {}
+        record.update(values)
+        caching_backend.set(job_key(job_id), record,
+                            timeout=config.API_RESULT_TIMEOUT)
+    return record
+
+
+def read_job(job_id):
+    """
+    Job record, None if unknown. Queued or running jobs without heartbeat
+    for config.API_JOB_STALE_AFTER seconds are marked as failed.
+    """
+    record = caching_backend.get(job_key(job_id))
+    if record is not None and record.get('status') in ('queued', 'running') \
+            and time.time() - record.get('heartbeat', record['created']) \
+            > config.API_JOB_STALE_AFTER:
+        record = update_job(job_id, status='failed', finished=time.time(),
+                            error='Job stalled, its server process stopped')
+    return record
+
+
+def run_job(job_id, job):
+    record = read_job(job_id)
+    if record is None or record.get('status') != 'queued':
+        # Expired or marked as stale while waiting
+        with _jobs_lock:
+            _active_jobs.discard(job_id)
+        return
+    with StudySlot(caching_backend, job['user']) as slot:
+        if not slot.acquired:
+            # All study slots of the client taken, stays queued
+            retry = threading.Timer(config.API_SLOT_RETRY, executor().submit,
+                                    (run_job, job_id, job))
+            retry.daemon = True
+            retry.start()
+            return
+        execute_job(job_id, job)
+
+
+def execute_job(job_id, job):
+    update_job(job_id, status='running', started=time.time(),
+               heartbeat=time.time())
+    try:
+        df_input = df.nominal_inputs(job['settings'])
+        data = df.variation_parameter(
+            df_input, job['table'], mode=job['mode'],
+            n_samples=job['samples'], seed=job['seed'])
+        checkpoint = df.StudyCheckpoint(df.StudyCheckpoint.study_id(
+            job['settings'], data, curve_calculation=job['curve']))
+        result_stores = [checkpoint]
+        if result_warehouse is not None:
+            result_stores.append(result_warehouse)
+        results = run_study(data, df_input, job['settings'], job['curve'],
+                            result_stores=result_stores,
+                            timings=df.RunTimings(caching_backend),
+                            max_workers=config.SIMULATION_MAX_WORKERS)
+        checkpoint.complete()
+        columns = list(df_input.columns)
+        if job['curve'] and CURRENT_DENSITY not in columns:
+            columns.append(CURRENT_DENSITY)
+        if result_warehouse is not None:
+            result_warehouse.index_parameters(results, columns)
+        table = df.flat_results(results, columns)
+        caching_backend.set(result_key(job_id), table,
+                            timeout=config.API_RESULT_TIMEOUT)
+        update_job(job_id, status='finished', finished=time.time(),
+                   n_runs=len(table),
+                   n_successful=int(table["successful_run"].sum()))
+    except Exception as E:
+        traceback.print_exc()
+        update_job(job_id, status='failed', finished=time.time(),
+                   error=repr(E))
+    finally:
+        with _jobs_lock:
+            _active_jobs.discard(job_id)
+
+
+def job_handle(job_id, record) -> dict:
+    handle = {'id': job_id,
+              'url': url_for('api_v1.get_job', job_id=job_id,
+                             _external=True)}
+    handle.update(record)
+    if record.get('status') == 'finished':
+        handle['results'] = url_for('api_v1.get_results', job_id=job_id,
+                                    _external=True)
+    return handle
+
+
+@blueprint.route('/jobs', methods=['POST'])
+def submit_jobs():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return error(400, 'Request body must be a json object')
+    batch = 'jobs' in body
+    definitions = body['jobs'] if batch else [body]
+    if not isinstance(definitions, list) or not definitions:
+        return error(400, '"jobs" must be a non-empty list')
+    if len(definitions) > config.API_MAX_BATCH:
+        return error(400, f'At most {config.API_MAX_BATCH} jobs per '
+                          f'request')
+    # Validate all jobs before submitting any of them
+    jobs = []
+    for n, definition in enumerate(definitions):
+        try:
+            jobs.append(parse_job(definition))
+        except (ValueError, SyntaxError, TypeError, AttributeError,
+                KeyError, IndexError) as E:
+            return error(400, f'Job {n}: {E}' if batch else str(E))
+
+    handles = []
+    user = client_address()
+    for job in jobs:
+        job['user'] = user
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        record = update_job(job_id, status='queued', created=now,
+                            heartbeat=now, planned_runs=job['runs'])
+        with _jobs_lock:
+            _active_jobs.add(job_id)
+        executor().submit(run_job, job_id, job)
+        handles.append(job_handle(job_id, record))
+    if batch:
+        return jsonify({'jobs': handles}), 202
+    return jsonify(handles[0]), 202
+
+
+@blueprint.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    record = read_job(job_id)
+    if record is None:
+        return error(404, f'Unknown or expired job {job_id}')
+    return jsonify(job_handle(job_id, record))
+
+
+@blueprint.route('/jobs/<job_id>/results', methods=['GET'])
+def get_results(job_id):
+    record = read_job(job_id)
+    if record is None:
+        return error(404, f'Unknown or expired job {job_id}')
+    if record.get('status') != 'finished':
+        return error(409, f"Job {job_id} is {record.get('status')}")
+    table = caching_backend.get(result_key(job_id))
+    if table is None:
+        return error(404, f'Results of job {job_id} expired')
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', config.API_PAGE_SIZE)),
+                        1), config.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return error(400, '"offset" and "limit" must be integers')
+
+    page = table.iloc[offset:offset + limit]
+    data = {}
+    for name in page.columns:
+        # NaN is no valid json (float and object columns)
+        data[name] = [None if missing else value for value, missing
+                      in zip(page[name].to_numpy().tolist(),
+                             page[name].isna())]
+    end = offset + len(page)
+    return jsonify({
+        'columns': list(page.columns), 'data': data,
+        'units': table.attrs.get("global_units", {}),
+        'offset': offset, 'limit': limit, 'total': len(table),
+        'next': url_for('api_v1.get_results', job_id=job_id, offset=end,
+                        limit=limit, _external=True)
+        if end < len(table) else None})
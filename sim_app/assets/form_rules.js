@@ -0,0 +1,37 @@
+// Clientside form rules (show/hide and enable/disable of inputs).
+// The rules are compiled from parameters_layout.json by
+// dash_layout.form_rules() and passed in the 'form_rules' store.
+if (!window.dash_clientside) {
+  window.dash_clientside = {};
+}
+
+function selectedValues(values, ids) {
+  var selected = {};
+  ids.forEach(function(id, i) {
+    selected[id.id] = values[i];
+  });
+  return selected;
+}
+
+window.dash_clientside.form = {
+  visibility: function(values, dropdownIds, containerIds, rules) {
+    var selected = selectedValues(values, dropdownIds);
+    return containerIds.map(function(id) {
+      var rule = rules.visibility[id.id];
+      if (!rule || selected[rule[0]] === rule[1]) {
+        return null;
+      }
+      return {display: 'none'};
+    });
+  },
+  disabled: function(values, dropdownIds, inputIds, rules) {
+    var selected = selectedValues(values, dropdownIds);
+    return inputIds.map(function(id) {
+      var rule = rules.enable[id.id];
+      if (!rule) {
+        return false;
+      }
+      return selected[rule[0]] !== rule[1];
+    });
+  }
+};
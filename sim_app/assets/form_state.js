@@ -0,0 +1,67 @@
+// Server-side form state: only changed input fields are sent to the
+// server (store 'form_delta'), where they are merged into the session's
+// form record (dash_functions.FormState).
+// Changes are kept until the server acknowledges their version
+// (store 'form_ack'), so 'form_delta' always holds every change the server
+// might not know yet. On 'resync' (server record lost), the complete form
+// is sent again.
+if (!window.dash_clientside) {
+  window.dash_clientside = {};
+}
+
+window.dash_clientside.form_state = {
+  state: {snapshot: {}, pending: {}, version: 0, full: true, fullVersion: 0},
+
+  delta: function(values, multivalues, ack, ids, multiids) {
+    var state = window.dash_clientside.form_state.state;
+    var noUpdate = window.dash_clientside.no_update;
+    var triggered = window.dash_clientside.callback_context.triggered.map(
+      function(t) { return t.prop_id; });
+
+    var resync = false;
+    if (triggered.indexOf('form_ack.data') >= 0 && ack) {
+      if (ack.resync) {
+        state.snapshot = {};
+        state.pending = {};
+        state.full = true;
+        resync = true;
+      } else {
+        Object.keys(state.pending).forEach(function(id) {
+          if (state.pending[id].version <= ack.version) {
+            delete state.pending[id];
+          }
+        });
+        if (ack.version >= state.fullVersion) {
+          state.full = false;
+        }
+      }
+    }
+
+    var allIds = ids.concat(multiids);
+    var allValues = values.concat(multivalues);
+    var changed = false;
+    allIds.forEach(function(id, i) {
+      var value = JSON.stringify(allValues[i]);
+      if (state.snapshot[id.id] !== value) {
+        if (!changed) {
+          state.version += 1;
+          changed = true;
+        }
+        state.snapshot[id.id] = value;
+        state.pending[id.id] = {value: allValues[i], version: state.version};
+      }
+    });
+    if (!changed && !resync) {
+      return noUpdate;
+    }
+    if (state.full && resync) {
+      state.fullVersion = state.version;
+    }
+
+    var changes = {};
+    Object.keys(state.pending).forEach(function(id) {
+      changes[id] = state.pending[id].value;
+    });
+    return {version: state.version, full: state.full, changes: changes};
+  }
+};
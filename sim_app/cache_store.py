@@ -0,0 +1,290 @@
+"""
+Size-bounded file system store for serverside outputs.
+
+Replacement for dash_extensions' FileSystemStore, which grows without bound
+between restarts. Entries are evicted least-recently-used once the byte
+budget is exceeded and after their time-to-live has passed.
+Every entry file starts with its expiry time, so reads only open the file
+and touch its access time; they never lock or rewrite the index. Writes
+and evictions go through a small json index of size and expiry of all
+entries, guarded by a file lock, so several worker processes can share one
+cache directory.
+
+File locking needs fcntl, which is not available on Windows. There, only
+the threads of one process are synchronized: run a single worker process
+per cache directory, or use the Redis store for several workers.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from dash_extensions.enrich import FileSystemStore
+
+try:
+    import fcntl
+except ImportError:  # Windows, see module docstring
+    fcntl = None
+
+
+class BoundedFileSystemStore(FileSystemStore):
+    """
+    File system store with byte budget and LRU plus TTL eviction.
+
+    :param cache_dir: Directory of the cache files
+    :param size_limit: Maximum total size of all cache files in bytes
+    :param default_timeout: Lifetime of an entry in seconds, 0 for no expiry
+    """
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'index.lock'
+    TMP_PREFIX = '.tmp-'
+    SUFFIX = '.pkl'
+
+    def __init__(self, cache_dir, size_limit=2 * 1024 ** 3,
+                 default_timeout=900):
+        os.makedirs(cache_dir, exist_ok=True)
+        super().__init__(cache_dir=cache_dir, threshold=0,
+                         default_timeout=default_timeout)
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        self.ttl = default_timeout
+        self._thread_lock = threading.Lock()
+        # Remove expired entries left over from previous runs, but keep live
+        # entries of other workers sharing the directory
+        with self._locked_index() as index:
+            self._evict(index)
+
+    def _file_path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    @staticmethod
+    def _file_name(key):
+        return hashlib.sha1(str(key).encode('utf-8')).hexdigest() \
+            + BoundedFileSystemStore.SUFFIX
+
+    @staticmethod
+    def _expired(expires):
+        return bool(expires) and expires < time.time()
+
+    @contextmanager
+    def _locked_index(self):
+        """
+        Yield the index dictionary {file name: {'size', 'atime', 'expires'}}
+        under an exclusive lock and write it back afterwards. 'atime' is the
+        time of writing, later reads only update the file access time.
+        """
+        with self._thread_lock, \
+                open(self._file_path(self.LOCK_FILE), 'a+') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                self._write_index(index)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self._file_path(self.INDEX_FILE), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return self._rebuild_index()
+
+    def _rebuild_index(self):
+        """
+        Index is missing or corrupt: recover it from the cache directory
+        """
+        index = {}
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = self._file_path(name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(self.TMP_PREFIX):
+                # Leftover of an interrupted write
+                if now - stat.st_mtime > 3600:
+                    self._remove_file(name)
+            elif name.endswith(self.SUFFIX):
+                try:
+                    with open(path, 'rb') as file:
+                        expires = pickle.load(file)
+                except (OSError, pickle.PickleError, EOFError):
+                    expires = None
+                if not isinstance(expires, (int, float)):
+                    self._remove_file(name)
+                    continue
+                index[name] = {'size': stat.st_size, 'atime': stat.st_mtime,
+                               'expires': expires}
+        return index
+
+    def _write_index(self, index):
+        tmp_path = self._write_temp(json.dumps(index).encode('utf-8'))
+        self._replace(tmp_path, self.INDEX_FILE)
+
+    def _write_temp(self, data):
+        fd, tmp_path = tempfile.mkstemp(prefix=self.TMP_PREFIX,
+                                        dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def _replace(self, tmp_path, name):
+        try:
+            os.replace(tmp_path, self._file_path(name))
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remove_file(self, name):
+        self._unlink(self._file_path(name))
+
+    def _last_access(self, name, entry):
+        try:
+            return max(entry['atime'],
+                       os.stat(self._file_path(name)).st_atime)
+        except OSError:
+            return entry['atime']
+
+    def _evict(self, index, keep=None):
+        """
+        Remove expired entries, then least recently used entries until the
+        byte budget is met. Entry 'keep' (just written) is never evicted.
+        """
+        for name, entry in list(index.items()):
+            if self._expired(entry['expires']):
+                del index[name]
+                self._remove_file(name)
+
+        total = sum(entry['size'] for entry in index.values())
+        if total <= self.size_limit:
+            return
+        access = {name: self._last_access(name, entry)
+                  for name, entry in index.items() if name != keep}
+        for name in sorted(access, key=access.get):
+            if total <= self.size_limit:
+                break
+            total -= index.pop(name)['size']
+            self._remove_file(name)
+
+    def _open_entry(self, name, ignore_expired=False):
+        """
+        Entry file positioned after its expiry time, None if the entry is
+        missing or expired
+        """
+        try:
+            file = open(self._file_path(name), 'rb')
+        except OSError:
+            return None
+        try:
+            expires = pickle.load(file)
+            if isinstance(expires, (int, float)) \
+                    and (ignore_expired or not self._expired(expires)):
+                return file
+        except (pickle.PickleError, EOFError):
+            pass
+        file.close()
+        return None
+
+    def _prepare(self, value, timeout):
+        """
+        Temporary file of a new entry and its index entry
+        """
+        if timeout is None:
+            timeout = self.ttl
+        now = time.time()
+        expires = now + timeout if timeout else 0
+        data = pickle.dumps(expires) \
+            + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._write_temp(data), \
+            {'size': len(data), 'atime': now, 'expires': expires}
+
+    def _publish(self, index, name, tmp_path, entry):
+        # File and index entry are published together under the index lock,
+        # so a concurrent eviction of a previous version cannot remove the
+        # new file
+        self._replace(tmp_path, name)
+        index[name] = entry
+        self._evict(index, keep=name)
+
+    def set(self, key, value, timeout=None):
+        name = self._file_name(key)
+        tmp_path, entry = self._prepare(value, timeout)
+        with self._locked_index() as index:
+            self._publish(index, name, tmp_path, entry)
+        return True
+
+    def add(self, key, value, timeout=None):
+        """
+        Atomic (for all processes sharing the directory): the value is only
+        written if the key is missing or expired
+        """
+        name = self._file_name(key)
+        tmp_path, entry = self._prepare(value, timeout)
+        with self._locked_index() as index:
+            current = index.get(name)
+            if current is not None and not self._expired(current['expires']):
+                self._unlink(tmp_path)
+                return False
+            self._publish(index, name, tmp_path, entry)
+        return True
+
+    def get(self, key, ignore_expired=False):
+        if key is None:
+            return None
+        name = self._file_name(key)
+        file = self._open_entry(name, ignore_expired)
+        if file is None:
+            return None
+        with file:
+            try:
+                value = pickle.load(file)
+            except (pickle.PickleError, EOFError):
+                return None
+            # Access time for the LRU order, independent of the noatime
+            # and relatime mount options
+            try:
+                os.utime(file.name,
+                         (time.time(), os.fstat(file.fileno()).st_mtime))
+            except OSError:
+                pass
+        return value
+
+    def has(self, key):
+        file = self._open_entry(self._file_name(key))
+        if file is None:
+            return False
+        file.close()
+        return True
+
+    def delete(self, key):
+        name = self._file_name(key)
+        with self._locked_index() as index:
+            found = index.pop(name, None) is not None
+            self._remove_file(name)
+        return found
+
+    def clear(self):
+        with self._locked_index() as index:
+            for name in list(index):
+                self._remove_file(name)
+            index.clear()
+        return True
@@ -0,0 +1,160 @@
+"""
+Headless batch runner for parameter studies (no Dash server).
+
+Runs a study defined by a settings json file and a study table (csv or
+xlsx, same format as the table export/upload of the GUI) with the same
+parameter variation, settings and polarization curve logic as the GUI, on
+all local cores.
+
+Example:
+    sim-study settings/settings.json study.xlsx -o results.csv --mode full
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+from sim_app import dash_functions as df, dash_layout as dl
+from sim_app.result_warehouse import ResultWarehouse
+from sim_app.study_functions import run_study, CURRENT_DENSITY
+
+STUDY_MODES = ['single', 'full', 'sensitivity'] + list(df.SAMPLING_MODES)
+OUTPUT_FORMATS = ('.csv', '.parquet', '.npz')
+
+
+def read_study_table(path) -> list:
+    """
+    Study table records as used by df.variation_parameter (empty cells are
+    None)
+    """
+    if path.endswith('.csv'):
+        table = pd.read_csv(path)
+    elif path.endswith(('.xls', '.xlsx')):
+        table = pd.read_excel(path)
+    else:
+        raise ValueError('Only csv or xls(x) study tables can be read')
+    table = table.astype(object).where(table.notna(), None)
+    return table.to_dict('records')
+
+
+def form_inputs(settings: dict, layout_path) -> pd.DataFrame:
+    """
+    Nominal input values (one row "nominal"), as shown in the GUI form after
+    loading 'settings'
+    """
+    with open(layout_path) as file:
+        dl.tab_container(json.load(file))
+    return df.nominal_inputs(settings)
+
+
+def write_results(table: pd.DataFrame, path):
+    """
+    Write a columnar result table (see df.flat_results) as csv, parquet
+    (requires pyarrow or fastparquet) or numpy .npz (one array per column)
+    """
+    if path.endswith('.csv'):
+        table.to_csv(path, index=False)
+    elif path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    elif path.endswith('.npz'):
+        np.savez_compressed(path, **{
+            name: table[name].to_numpy(
+                dtype=None if table[name].dtype.kind in 'fiub' else str)
+            for name in table.columns})
+    else:
+        raise ValueError(f'Output format must be one of {OUTPUT_FORMATS}')
+    with open(os.path.splitext(path)[0] + '_units.json', 'w') as file:
+        json.dump(table.attrs.get("global_units", {}), file, indent=2)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Run a parameter study without the web application.')
+    parser.add_argument('settings', help='settings json file')
+    parser.add_argument('study_table', help='study table (csv, xls, xlsx)')
+    parser.add_argument('-o', '--output', default='results.csv',
+                        help='columnar results (.csv, .parquet or .npz)')
+    parser.add_argument('--mode', choices=STUDY_MODES, default='single',
+                        help='study mode (default: single)')
+    parser.add_argument('--samples', type=int,
+                        help='number of runs of sampling modes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of sampling modes')
+    parser.add_argument('--curve', action='store_true',
+                        help='calculate a polarization curve per parameter '
+                             'set')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of local simulation processes '
+                             '(default: all cores)')
+    parser.add_argument('--layout',
+                        default=os.path.join('settings',
+                                             'parameters_layout.json'),
+                        help='GUI layout file defining the input parameters')
+    parser.add_argument('--full-results',
+                        help='additionally pickle the complete result table '
+                             '(incl. local data) to this file')
+    parser.add_argument('--checkpoint-dir',
+                        help='directory of the study checkpoint logs, '
+                             'a restarted study continues from its log '
+                             '(default: next to the output)')
+    parser.add_argument('--warehouse',
+                        help='sqlite results warehouse to query and fill '
+                             '(see result_warehouse.py)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    if not args.output.endswith(OUTPUT_FORMATS):
+        sys.exit(f'Output format must be one of {OUTPUT_FORMATS}')
+    if args.mode in df.SAMPLING_MODES and not args.samples:
+        sys.exit(f'Study mode {args.mode} needs --samples')
+
+    with open(args.settings) as file:
+        settings = json.load(file)
+    df_input = form_inputs(settings, args.layout)
+    table_input = read_study_table(args.study_table)
+    data = df.variation_parameter(
+        df_input, table_input, mode=args.mode, n_samples=args.samples,
+        seed=args.seed)
+    curve_calculation = args.curve and args.mode != 'sensitivity'
+    print(f'{len(data)} parameter sets, mode {args.mode}'
+          + (', polarization curves' if curve_calculation else ''))
+
+    checkpoint_dir = args.checkpoint_dir or os.path.join(
+        os.path.dirname(os.path.abspath(args.output)), 'checkpoints')
+    checkpoint = df.StudyCheckpoint(
+        df.StudyCheckpoint.study_id(settings, data,
+                                    curve_calculation=curve_calculation),
+        directory=checkpoint_dir)
+    result_stores = [checkpoint]
+    if args.warehouse:
+        warehouse = ResultWarehouse(args.warehouse)
+        result_stores.append(warehouse)
+
+    results = run_study(data, df_input, settings, curve_calculation,
+                        result_stores=result_stores,
+                        max_workers=args.workers, parallel_curves=True)
+    checkpoint.complete()
+    columns = list(df_input.columns)
+    if curve_calculation and CURRENT_DENSITY not in columns:
+        columns.append(CURRENT_DENSITY)
+    if args.warehouse:
+        warehouse.index_parameters(results, columns)
+
+    table = df.flat_results(results, columns)
+    write_results(table, args.output)
+    if args.full_results:
+        with open(args.full_results, 'wb') as file:
+            pickle.dump(results, file)
+    n_ok = int(table["successful_run"].astype(bool).sum())
+    print(f'{n_ok} of {len(table)} runs successful, results written to '
+          f'{args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Application configuration.
+Every value can be overridden by an environment variable of the same name,
+e.g. in docker-compose.yml or the uwsgi index.ini.
+"""
+import os
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return cast(value)
+
+
+# Default simulation settings, parsed once per process and reloaded when
+# the file changes (see dash_functions.base_settings)
+SETTINGS_FILE = _env('SETTINGS_FILE', os.path.join('settings',
+                                                   'settings.json'))
+# Number of translated settings (input values applied to the base
+# settings) kept in memory for rows with equal inputs
+SETTINGS_MEMO_SIZE = _env('SETTINGS_MEMO_SIZE', 4096, int)
+
+# Serverside cache (file system fallback, if no redis server is available)
+# --------------------------------------
+CACHE_DIR = _env('CACHE_DIR', '/temp/file_system_store')
+# Byte budget of the file system cache directory
+CACHE_SIZE_LIMIT = _env('CACHE_SIZE_LIMIT', 2 * 1024 ** 3, int)
+# Lifetime of cached entries in seconds (same as redis default_timeout)
+CACHE_TIMEOUT = _env('CACHE_TIMEOUT', 900, int)
+
+# Lifetime of the server-side form state of a session in seconds
+FORM_STATE_TIMEOUT = _env('FORM_STATE_TIMEOUT', 24 * 3600, int)
+# Lifetime of the results of the previous study of a session, reused by
+# the next study (default: session lifetime)
+STUDY_RESULTS_TIMEOUT = _env('STUDY_RESULTS_TIMEOUT', FORM_STATE_TIMEOUT,
+                             int)
+# Lifetime of serverside store data (settings, inputs and results of a
+# session) in seconds
+SERVERSIDE_TIMEOUT = _env('SERVERSIDE_TIMEOUT', 24 * 3600, int)
+# Callback requests or responses larger than this number of bytes are
+# logged with their largest items (0: audit disabled)
+PAYLOAD_AUDIT_BYTES = _env('PAYLOAD_AUDIT_BYTES', 0, int)
+
+# Number of local simulation processes of study batches per server worker
+# process (1: sequential). Several server workers may run studies at the
+# same time, so the total is up to WORKERS * SIMULATION_MAX_WORKERS.
+SIMULATION_MAX_WORKERS = _env('SIMULATION_MAX_WORKERS', 1, int)
+
+# Remote simulation service (simulation_client.py)
+# --------------------------------------
+# If set, simulations are sent to this url instead of running locally
+SIMULATION_API_URL = _env('SIMULATION_API_URL', '')
+SIMULATION_API_MAX_CONNECTIONS = _env('SIMULATION_API_MAX_CONNECTIONS', 32, int)
+SIMULATION_API_TIMEOUT = _env('SIMULATION_API_TIMEOUT', 600., float)
+SIMULATION_API_RETRIES = _env('SIMULATION_API_RETRIES', 3, int)
+
+# Parameter studies (admission control per user, identified by the client
+# address)
+# --------------------------------------
+# Maximum number of simulation runs of a study
+STUDY_MAX_RUNS = _env('STUDY_MAX_RUNS', 5000, int)
+# Maximum estimated duration of a study in seconds
+STUDY_MAX_DURATION = _env('STUDY_MAX_DURATION', 4 * 3600, int)
+# Maximum number of studies running at the same time per user
+STUDY_MAX_CONCURRENT = _env('STUDY_MAX_CONCURRENT', 1, int)
+# Number of reverse proxies in front of the app whose X-Forwarded-For
+# header is trusted for the client address (0: direct connections)
+TRUSTED_PROXIES = _env('TRUSTED_PROXIES', 0, int)
+
+# Results warehouse (sqlite database of all runs, shared by all sessions,
+# see result_warehouse.py), empty string to disable
+# --------------------------------------
+WAREHOUSE_PATH = _env('WAREHOUSE_PATH', '/temp/results.sqlite')
+
+# Study checkpoints (append-only result log per study, see
+# dash_functions.StudyCheckpoint)
+# --------------------------------------
+CHECKPOINT_DIR = _env('CHECKPOINT_DIR', '/temp/study_checkpoints')
+# Logs not written to for this number of seconds are deleted
+CHECKPOINT_MAX_AGE = _env('CHECKPOINT_MAX_AGE', 7 * 24 * 3600, int)
+# Byte budget of all logs, the least recently written ones are deleted
+# first (logs of finished studies are deleted right away)
+CHECKPOINT_SIZE_LIMIT = _env('CHECKPOINT_SIZE_LIMIT', 1024 ** 3, int)
+
+# JSON API (api.py)
+# --------------------------------------
+# Requests need the header "Authorization: Bearer <API_TOKEN>", the API is
+# disabled (401) without a token
+API_TOKEN = _env('API_TOKEN', '')
+# Jobs running at the same time per server process
+API_MAX_RUNNING_JOBS = _env('API_MAX_RUNNING_JOBS', 2, int)
+# Maximum number of jobs per submission
+API_MAX_BATCH = _env('API_MAX_BATCH', 500, int)
+# Default and maximum number of result rows per page
+API_PAGE_SIZE = _env('API_PAGE_SIZE', 1000, int)
+API_MAX_PAGE_SIZE = _env('API_MAX_PAGE_SIZE', 10000, int)
+# Lifetime of job records and results in seconds
+API_RESULT_TIMEOUT = _env('API_RESULT_TIMEOUT', 7 * 24 * 3600, int)
+# Queued and running jobs are refreshed every API_JOB_HEARTBEAT seconds by
+# their server process; jobs without refresh for API_JOB_STALE_AFTER
+# seconds (process stopped) are reported as failed
+API_JOB_HEARTBEAT = _env('API_JOB_HEARTBEAT', 30, int)
+API_JOB_STALE_AFTER = _env('API_JOB_STALE_AFTER', 300, int)
+# Jobs share the STUDY_MAX_CONCURRENT study slots of their client address
+# with the GUI; jobs without free slot stay queued and try again after
+# API_SLOT_RETRY seconds
+API_SLOT_RETRY = _env('API_SLOT_RETRY', 2., float)
+
+# Polarization curves
+# --------------------------------------
+# Memory budget in bytes for converged solver states (warm starts)
+SOLUTION_CACHE_SIZE = _env('SOLUTION_CACHE_SIZE', 256 * 1024 ** 2, int)
@@ -2,36 +2,87 @@
 # import dash_bootstrap_components as dbc
 # from dash.long_callback import CeleryLongCallbackManager, \
 #     DiskcacheLongCallbackManager
+import json
+import logging
 import os
 import redis
-import shutil
+from flask import has_request_context, request
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dash_extensions.enrich import DashProxy, MultiplexerTransform, \
-    ServersideOutputTransform, RedisStore, FileSystemStore
+    ServersideOutput, ServersideOutputTransform, RedisStore
 
+from sim_app import config
+from sim_app.cache_store import BoundedFileSystemStore
+from sim_app.result_warehouse import ResultWarehouse
 
-def clear_cache(path):
-    if os.path.exists(path):
-        shutil.rmtree(path)
-    os.makedirs(path)
 
+def file_system_store(default_timeout=config.CACHE_TIMEOUT):
+    # Shared by all workers; expired and least recently used entries are
+    # evicted by the store itself, so the directory must not be wiped here
+    tmpdir = os.path.join(os.getcwd(), config.CACHE_DIR)
+    return BoundedFileSystemStore(cache_dir=tmpdir,
+                                  size_limit=config.CACHE_SIZE_LIMIT,
+                                  default_timeout=default_timeout)
 
-try:
-    import sim_app.redis_credentials as rc
-    caching_backend = RedisStore(
+
+def store(default_timeout=config.CACHE_TIMEOUT):
+    """
+    Redis store if credentials are given and the server is reachable,
+    file system store otherwise
+    """
+    try:
+        import sim_app.redis_credentials as rc
+    except ImportError:
+        return file_system_store(default_timeout)
+    backend = RedisStore(
         host=rc.HOST_NAME,
         password=rc.PASSWORD,
         port=rc.PORT,
-        default_timeout=900)
+        default_timeout=default_timeout)
     try:
-        caching_backend.delete('test')
+        backend.delete('test')
     except (redis.exceptions.ConnectionError, ConnectionRefusedError) as E:
-        caching_backend = FileSystemStore(cache_dir='/temp/file_system_store')
+        return file_system_store(default_timeout)
     except (redis.exceptions.ResponseError, redis.exceptions.RedisError):
         pass
-except ImportError:
-    tmpdir = os.path.join(os.getcwd(), '/temp/file_system_store')
-    clear_cache(tmpdir)
-    caching_backend = FileSystemStore(cache_dir=tmpdir)
+    return backend
+
+
+caching_backend = store()
+# Data of ServersideOutputs (stores of a session, only their keys are sent
+# to the browser)
+serverside_backend = store(config.SERVERSIDE_TIMEOUT)
+
+
+class ServersideMultiplexerTransform(MultiplexerTransform):
+    """
+    MultiplexerTransform which keeps multiplexed ServersideOutputs server
+    side (the plain proxy outputs of the base class would send the complete
+    data to the browser again)
+    """
+
+    def _apply_multiplexer(self, output, callbacks):
+        positions = [callback.outputs.index(output) for callback in callbacks]
+        originals = [callback.outputs[i]
+                     for callback, i in zip(callbacks, positions)]
+        super()._apply_multiplexer(output, callbacks)
+        for callback, i, original in zip(callbacks, positions, originals):
+            if isinstance(original, ServersideOutput):
+                proxy = callback.outputs[i]
+                callback.outputs[i] = ServersideOutput(
+                    proxy.component_id, proxy.component_property,
+                    backend=original.backend,
+                    session_check=original.session_check,
+                    arg_check=original.arg_check)
+
+
+# Persistent results of all sessions, queried before simulating
+if config.WAREHOUSE_PATH:
+    warehouse_path = os.path.join(os.getcwd(), config.WAREHOUSE_PATH)
+    os.makedirs(os.path.dirname(warehouse_path), exist_ok=True)
+    result_warehouse = ResultWarehouse(warehouse_path)
+else:
+    result_warehouse = None
 
 
 # from celery import Celery
@@ -55,8 +106,69 @@ bs_5_css = ('https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/css/bootstrap.min
 external_stylesheets = [bs_5_css]
 app = DashProxy(__name__, external_stylesheets=external_stylesheets,
                 suppress_callback_exceptions=True,
-                transforms=[MultiplexerTransform(),
-                            ServersideOutputTransform(backend=caching_backend)])
+                transforms=[ServersideMultiplexerTransform(),
+                            ServersideOutputTransform(
+                                backend=serverside_backend,
+                                # Safe without session: no callback uses
+                                # memoize, and the key is a hash of the
+                                # callback and all its arguments (incl. the
+                                # session id where data is session-scoped),
+                                # so a key is only shared by calls with
+                                # identical payloads. A session check would
+                                # also need a Flask secret key.
+                                session_check=False)])
+if config.TRUSTED_PROXIES:
+    app.server.wsgi_app = ProxyFix(app.server.wsgi_app,
+                                   x_for=config.TRUSTED_PROXIES)
+
+
+def client_address() -> str:
+    """
+    Address of the client of the current request (forwarded address behind
+    TRUSTED_PROXIES reverse proxies), 'local' outside of requests
+    """
+    if not has_request_context():
+        return 'local'
+    return request.remote_addr or 'unknown'
+
+
+# Payload audit
+# --------------------------------------
+def _item_sizes(items) -> list:
+    """
+    (id, size in bytes) of callback input/state items, largest first
+    """
+    sizes = []
+    for item in items:
+        for entry in item if isinstance(item, list) else [item]:
+            size = len(json.dumps(entry.get('value'), default=str))
+            sizes.append((f"{entry.get('id')}.{entry.get('property')}", size))
+    return sorted(sizes, key=lambda x: -x[1])
+
+
+if config.PAYLOAD_AUDIT_BYTES:
+    @app.server.after_request
+    def audit_payload(response):
+        """
+        Log callbacks whose request or response exceeds
+        config.PAYLOAD_AUDIT_BYTES
+        """
+        if not request.path.endswith('_dash-update-component') \
+                or response.direct_passthrough:
+            return response
+        request_size = request.content_length or 0
+        response_size = len(response.get_data())
+        if max(request_size, response_size) > config.PAYLOAD_AUDIT_BYTES:
+            body = request.get_json(silent=True) or {}
+            largest = _item_sizes(body.get('inputs', [])
+                                  + body.get('state', []))[:3]
+            logging.getLogger(__name__).warning(
+                'Callback payload above %d bytes: output %s, request %d '
+                'bytes (largest items: %s), response %d bytes',
+                config.PAYLOAD_AUDIT_BYTES, body.get('output'), request_size,
+                ', '.join(f'{name} {size}' for name, size in largest),
+                response_size)
+        return response
 
 # app = dash.Dash(__name__, external_stylesheets=external_stylesheets,
 #                 long_callback_manager=long_callback_manager,
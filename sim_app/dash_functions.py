@@ -1,39 +1,629 @@
+from contextlib import contextmanager
 from functools import wraps
 import data_transfer
 import base64
 import io
+import os
 import json
 import pickle
 import jsonpickle
 import collections
 import ast
+import hashlib
+import threading
+import time
+import warnings
 from itertools import product
 from glom import glom
 import pandas as pd
 import numpy as np
+from scipy.stats import qmc
+from tqdm import tqdm
+from . import config
 from . import simulation_api as sim_api
 from . import dash_layout as dl
 
 
-def run_simulation(input_table: pd.DataFrame, return_unsuccessful=True) \
-        -> (pd.DataFrame, bool):
+class ProgressReporter:
     """
-    - Run input_table rows, catch exceptions of single calculations
-      https://stackoverflow.com/questions/22847304/exception-handling-in-pandas-apply-function
+    Session-scoped progress (in percent) of running simulations.
+    Stored in the caching backend, so the progress bar callback can read it
+    from any worker process or thread.
+    """
+
+    def __init__(self, backend, session_id):
+        self.backend = backend
+        self.key = self.backend_key(session_id)
+        self.percent = None
+
+    @staticmethod
+    def backend_key(session_id):
+        return f'progress-{session_id}'
+
+    @classmethod
+    def read(cls, backend, session_id) -> float:
+        percent = backend.get(cls.backend_key(session_id))
+        return 0 if percent is None else percent
+
+    def __call__(self, percent):
+        # Write only on change of the integer percentage
+        percent = int(percent)
+        if percent != self.percent:
+            self.percent = percent
+            self.backend.set(self.key, percent)
+
+
+class RunTimings:
+    """
+    Durations of recent simulation runs (seconds per run), shared by all
+    sessions via the caching backend. Used to estimate the duration of
+    studies before they are started.
+    """
+    KEY = 'run-timings'
+    MAX_RECORDS = 200
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def record(self, duration, n_runs):
+        if n_runs < 1:
+            return
+        timings = self.backend.get(self.KEY) or []
+        timings = (timings + [duration / n_runs])[-self.MAX_RECORDS:]
+        self.backend.set(self.KEY, timings, timeout=0)
+
+    def per_run(self) -> float:
+        """
+        Median duration of a run in seconds, None without records
+        """
+        timings = self.backend.get(self.KEY)
+        return float(np.median(timings)) if timings else None
+
+
+def fingerprint(data) -> str:
+    """
+    Hash of json-serializable data (e.g. settings dicts), independent of
+    the order of dictionary keys
+    """
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+# Base settings (parsed once per process)
+# --------------------------------------
+class FrozenDict(dict):
+    """
+    Immutable dict (see freeze), shared between sessions and threads.
+    Serializes like a dict (json, pickle), use thaw() for a mutable copy.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenDict is immutable, use thaw() for a copy')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(data):
+    """
+    Immutable copy of nested json data (dicts to FrozenDict, lists to
+    tuples)
+    """
+    if isinstance(data, dict):
+        return FrozenDict((k, freeze(v)) for k, v in data.items())
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(v) for v in data)
+    return data
+
+
+def thaw(data):
+    """
+    Mutable copy of nested (frozen) json data
+    """
+    if isinstance(data, dict):
+        return {k: thaw(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [thaw(v) for v in data]
+    return data
+
+
+class SettingsCache:
+    """
+    Parsed settings files of this process by path, shared by all sessions.
+    A file is parsed again only if its modification time changed and its
+    content hash differs from the cached one.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path) -> FrozenDict:
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['mtime'] == mtime:
+                return entry['settings']
+            with open(path, 'rb') as file:
+                content = file.read()
+            digest = hashlib.sha1(content).hexdigest()
+            if entry is None or entry['hash'] != digest:
+                entry = {'hash': digest,
+                         'settings': freeze(json.loads(content))}
+            entry['mtime'] = mtime
+            self._entries[path] = entry
+            return entry['settings']
+
+
+settings_cache = SettingsCache()
+
+
+def base_settings(path=None) -> FrozenDict:
+    """
+    Default simulation settings (config.SETTINGS_FILE), immutable
+    """
+    return settings_cache.get(path or config.SETTINGS_FILE)
+
+
+class SettingsTransferMemo:
+    """
+    Bounded (least recently used) memo of data_transfer.dict_transfer by
+    fingerprint of the input data and the base settings. Entries are
+    frozen; transfer_settings hands out thaw() copies, so callers and
+    simulation backends get plain mutable settings and cannot corrupt
+    cached entries.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def transfer(self, input_data: dict, settings, settings_key=None) \
+            -> FrozenDict:
+        """
+        Complete settings of 'input_data' ({id: {'sim_name': ...,
+        'value': ...}}) based on 'settings' (not modified).
+        settings_key: fingerprint of 'settings', if known
+        """
+        key = fingerprint({'input_data': input_data,
+                           'settings': settings_key or fingerprint(settings)})
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                return result
+        result = freeze(data_transfer.dict_transfer(input_data, settings)[0])
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+
+settings_transfers = SettingsTransferMemo(config.SETTINGS_MEMO_SIZE)
+
+
+def transfer_settings(input_data: dict, settings, settings_key=None) \
+        -> dict:
+    """
+    Memoized data_transfer.dict_transfer (see SettingsTransferMemo),
+    returns a mutable copy
+    """
+    return thaw(settings_transfers.transfer(input_data, settings,
+                                            settings_key))
+
+
+class SessionResultStore:
+    """
+    Results of the previous study of a session, by settings hash.
+    Used as result store in run_simulation: unchanged runs are taken from
+    the previous study instead of being simulated again. All results of
+    the current study are kept for the next one by save().
+
+    Result stores implement lookup(hashes) -> {hash: result} and
+    record({hash: result}), result being the tuple returned by the
+    simulation api.
+
+    :param timeout: Lifetime of the saved results in seconds (default:
+        STUDY_RESULTS_TIMEOUT, independent of the backend default)
+    """
+
+    def __init__(self, backend, session_id, timeout=None):
+        self.backend = backend
+        self.key = f'study-results-{session_id}'
+        self.timeout = config.STUDY_RESULTS_TIMEOUT if timeout is None \
+            else timeout
+        self.previous = backend.get(self.key) or {}
+        self.current = {}
+
+    def lookup(self, hashes) -> dict:
+        return {h: self.previous[h] for h in hashes if h in self.previous}
+
+    def record(self, results: dict):
+        self.current.update(results)
+
+    def save(self):
+        self.backend.set(self.key, self.current, timeout=self.timeout)
+
+
+class StudyCheckpoint:
+    """
+    Durable, append-only log of the completed runs of a study
+    ({CHECKPOINT_DIR}/{study_id}.log, pickled {hash: result} records).
+    Used as result store in run_simulation, which records every run as
+    soon as it is completed. If a study is restarted after a crash with
+    the same design (same study_id), completed runs are read from the log
+    instead of being simulated again. The log is deleted by complete() once
+    the study has finished.
+    """
+
+    def __init__(self, study_id, directory=None):
+        directory = directory or config.CHECKPOINT_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{study_id}.log')
+        self.prune(directory, keep=self.path)
+        self.completed = self.read(self.path)
+
+    @staticmethod
+    def study_id(settings, design: pd.DataFrame, **options) -> str:
+        """
+        Hash of the base settings, the parameter sets of the study and
+        further options (e.g. curve calculation)
+        """
+        return fingerprint({'settings': settings,
+                            'design': design.to_dict('records'),
+                            'options': options})
+
+    @staticmethod
+    def read(path) -> dict:
+        completed = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, 'rb') as file:
+            while True:
+                try:
+                    completed.update(pickle.load(file))
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError,
+                        AttributeError, IndexError):
+                    # Record truncated by a crash while writing
+                    break
+        return completed
+
+    @staticmethod
+    def prune(directory, keep=None):
+        """
+        Delete logs not written to within CHECKPOINT_MAX_AGE, then the least
+        recently written ones until the rest fits in CHECKPOINT_SIZE_LIMIT
+        (log 'keep' is never deleted)
+        """
+        limit = time.time() - config.CHECKPOINT_MAX_AGE
+        logs = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.endswith('.log'):
+                continue
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < limit:
+                    os.remove(path)
+                else:
+                    logs.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                # Removed by another worker
+                pass
+        total = sum(size for _, size, _ in logs)
+        for _, size, path in sorted(logs):
+            if total <= config.CHECKPOINT_SIZE_LIMIT:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def complete(self):
+        """
+        Delete the log of a finished study
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def lookup(self, hashes) -> dict:
+        return {h: self.completed[h] for h in hashes if h in self.completed}
+
+    def record(self, results: dict):
+        results = {h: r for h, r in results.items()
+                   if h not in self.completed}
+        if not results:
+            return
+        # Single write per record, flushed to disk before returning
+        data = pickle.dumps(results)
+        with open(self.path, 'ab') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        self.completed.update(results)
+
+
+@contextmanager
+def backend_lock(backend, key, timeout=10.):
+    """
+    Exclusive lock on 'key' for all workers sharing the caching backend,
+    taken with the atomic add of the backend. Expires after 'timeout'
+    seconds in case the holder dies.
+    """
+    lock_key = f'lock-{key}'
+    while not backend.add(lock_key, True, timeout=int(timeout) or 1):
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        backend.delete(lock_key)
+
+
+class FormState:
+    """
+    Session-scoped canonical record {input id: value} of all form inputs.
+    The browser sends only changed fields (store 'form_delta', see
+    assets/form_state.js), which are merged into the record in the caching
+    backend. Run callbacks read the inputs from here instead of receiving
+    the whole form with every request.
+    The record is stored as {'version': int, 'values': {id: value}} with the
+    version of the last merged delta.
+
+    form_delta: {'version': int, 'full': bool, 'changes': {id: value}},
+        all changes not yet acknowledged by the server; 'full' if the
+        changes cover the complete form
+    """
+
+    def __init__(self, backend, session_id):
+        self.backend = backend
+        self.key = f'form-{session_id}'
+
+    def merge(self, form_delta):
+        """
+        Merge changes into the record, unless it holds a newer version
+        already: every delta contains all changes not yet acknowledged, so
+        a delta handled late by another worker must not overwrite newer
+        values. Atomic for all workers (backend_lock).
+        Returns the version of the stored record (to be acknowledged), None
+        if the record is lost (e.g. expired) and the changes are not a
+        complete form.
+        """
+        with backend_lock(self.backend, self.key):
+            record = self.backend.get(self.key)
+            if record is None:
+                if not form_delta['full']:
+                    return None
+                record = {'version': -1, 'values': {}}
+            if form_delta['version'] > record['version']:
+                record = {'version': form_delta['version'],
+                          'values': dict(record['values'],
+                                         **form_delta['changes'])}
+                self.backend.set(self.key, record,
+                                 timeout=config.FORM_STATE_TIMEOUT)
+        return record['version']
+
+    def values(self, form_delta=None) -> dict:
+        """
+        Current form values, including the changes of form_delta which
+        might not be merged yet
+        """
+        record = self.backend.get(self.key)
+        if record is None and not (form_delta and form_delta['full']):
+            raise LookupError('Form state of this session is not available, '
+                              'please reload the page')
+        record = dict(record['values'] if record else {})
+        if form_delta:
+            record.update(form_delta['changes'])
+        return record
+
+    def inputs(self, form_delta=None) -> (list, list, list, list):
+        """
+        Values and ids of all 'input' and 'multiinput' components in layout
+        order, i.e. the arguments of process_inputs
+        """
+        values = self.values(form_delta)
+        ids = [i for i in dl.ID_LIST if i['type'] == 'input']
+        ids_multi = [i for i in dl.ID_LIST if i['type'] == 'multiinput']
+        return [values.get(i['id']) for i in ids], \
+            [values.get(i['id']) for i in ids_multi], ids, ids_multi
+
+
+# Prefix of the flat global result columns, one float64 column per quantity
+GLOBAL_PREFIX = "global: "
+
+
+def global_column(name: str) -> str:
+    return GLOBAL_PREFIX + name
+
+
+def global_results_table(global_data: pd.Series) -> pd.DataFrame:
+    """
+    Flat float64 table of global results (one column per quantity) from the
+    per-row result dicts {'Stack Voltage': {'value': ..., 'units': ...}}.
+    Units are kept as metadata in table.attrs["units"].
+    """
+    units = {}
+    rows = []
+    for x in global_data:
+        if isinstance(x, dict):
+            for k, v in x.items():
+                units.setdefault(k, v.get('units'))
+            rows.append({k: v['value'] for k, v in x.items()})
+        else:
+            rows.append({})
+    table = pd.DataFrame.from_records(
+        rows, index=global_data.index, columns=list(units))
+    table = table.apply(pd.to_numeric, errors='coerce').astype('float64')
+    table.attrs["units"] = units
+    return table
+
+
+def global_results(results: pd.DataFrame) -> (pd.DataFrame, dict):
+    """
+    Global results of a result table as float64 table with plain quantity
+    names as columns, and their units.
+    Results without flat global columns (e.g. loaded from older files) are
+    converted from the "global_data" column.
+    """
+    columns = [c for c in results.columns
+               if isinstance(c, str) and c.startswith(GLOBAL_PREFIX)]
+    if not columns:
+        table = global_results_table(results["global_data"])
+        return table, table.attrs["units"]
+    table = results.loc[:, columns].astype('float64')
+    table.columns = [c[len(GLOBAL_PREFIX):] for c in columns]
+    units = results.attrs.get("global_units")
+    if not units:
+        # Metadata is lost in concatenations with other tables
+        units = global_results_table(
+            results["global_data"].dropna().iloc[:1]).attrs["units"]
+    return table, units
+
+
+def _is_number(value):
+    return isinstance(value, (bool, int, float, np.number)) \
+        and not isinstance(value, complex)
+
+
+def _is_integer(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+
+def numeric_features(inputs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Numeric feature table of the input columns. Scalar numbers are used
+    directly, lists of numbers are split into one feature per element,
+    all other columns are skipped.
+    """
+    features = {}
+    for name in inputs.columns:
+        values = inputs[name].to_list()
+        if all(_is_number(v) for v in values):
+            features[name] = np.asarray(values, dtype=float)
+        elif all(isinstance(v, (list, tuple)) and len(v) == len(values[0])
+                 and all(_is_number(e) for e in v) for v in values):
+            array = np.asarray(values, dtype=float).reshape(len(values), -1)
+            for j in range(array.shape[1]):
+                features[f'{name}_{j}'] = array[:, j]
+    return pd.DataFrame(features, index=inputs.index)
+
+
+def flat_results(results: pd.DataFrame, input_cols) -> pd.DataFrame:
+    """
+    Columnar result table for export: one column per input parameter
+    (numeric lists split per element, see numeric_features, other values
+    as string), study information, run status and one float64 column per
+    global quantity (see global_column). Units are kept in
+    attrs["global_units"]. Integer parameters (all values int) stay int64.
+    """
+    inputs = results.loc[:, list(input_cols)]
+    features = numeric_features(inputs)
+    columns = {}
+    for name in inputs.columns:
+        values = inputs[name].to_list()
+        if name in features.columns:
+            integer = all(_is_integer(v) for v in values)
+            columns[name] = features[name].astype(
+                'int64' if integer else float)
+        elif f'{name}_0' in features.columns:
+            integer = all(_is_integer(e) for v in values for e in v)
+            columns.update({col: features[col].astype(
+                                'int64' if integer else float)
+                            for col in features.columns
+                            if col.rsplit('_', 1)[0] == name})
+        else:
+            columns[name] = inputs[name].astype(str)
+    for name in ("variation_parameter", SENSITIVITY_STEP, "settings_hash",
+                 "successful_run"):
+        if name in results.columns:
+            columns[name] = results[name]
+    table = pd.DataFrame(columns, index=results.index)
+    global_table, units = global_results(results)
+    table = table.join(global_table.add_prefix(GLOBAL_PREFIX))
+    table.attrs["global_units"] = units
+    return table.reset_index(drop=True)
+
+
+def run_simulation(input_table: pd.DataFrame, return_unsuccessful=True,
+                   progress=None, max_workers=1, initial_states=None,
+                   result_stores=(), timings=None) -> (pd.DataFrame, bool):
+    """
+    - Run input_table rows as one batch, exceptions of single calculations
+      are caught by the simulation api
+    - Rows with identical settings (same "settings_hash") are simulated
+      only once, the result is fanned out to all of them
+    - Results found in one of the result_stores are not simulated again,
+      all successful results are recorded in the result_stores (each as
+      soon as it is completed)
     - Append result columns to input_table
     - Return DataFrame
+
+    progress: optional callable, called with the progress in percent
+    max_workers: number of parallel processes for backends without native
+        batch support
+    initial_states: optional list of solver states per row used as initial
+        guess (warm start); if given, the converged states are returned in
+        the additional column "solver_state"
+    timings: optional RunTimings, records the duration of the batch
     """
+    hashes = input_table["settings"].apply(fingerprint).to_list()
+    input_table["settings_hash"] = hashes
 
-    def func(settings):
-        try:
-            return sim_api.run_external_simulation(settings)
-        except Exception as E:
-            return repr(E)
+    # Unique settings (first occurrence), known results
+    unique = {}
+    for pos, settings_hash in enumerate(hashes):
+        unique.setdefault(settings_hash, pos)
+    results = {}
+    for store in result_stores:
+        results.update(store.lookup([h for h in unique if h not in results]))
 
-    result_table = input_table["settings"].progress_apply(func)
-    # result_table = input_table["settings"].map(func)
-    # result_table = input_table["settings"].parallel_apply(func)
-    # result_table = input_table["settings"].apply_parallel(func, num_processes=4)
+    # Simulate the remaining ones
+    to_run = [h for h in unique if h not in results]
+    settings_list = input_table["settings"].to_list()
+    if initial_states is not None:
+        initial_states = [initial_states[unique[h]] for h in to_run]
+    n_total = len(to_run)
+    batch = sim_api.run_external_simulation_batch(
+        [settings_list[unique[h]] for h in to_run],
+        initial_states=initial_states, max_workers=max_workers)
+    start = time.perf_counter()
+    with tqdm(total=n_total) as pbar:
+        for n, (pos, result) in enumerate(batch, 1):
+            results[to_run[pos]] = result
+            if isinstance(result, tuple):
+                # Solver states (additional data) are not recorded
+                for store in result_stores:
+                    store.record({to_run[pos]: (result[0], result[1], None)})
+            pbar.update()
+            if progress is not None:
+                progress(100 * n / n_total)
+    if timings is not None:
+        timings.record(time.perf_counter() - start, n_total)
+
+    # Results taken from one store are kept in the others as well
+    simulated = set(to_run)
+    known = {h: (x[0], x[1], None) for h, x in results.items()
+             if isinstance(x, tuple) and h not in simulated}
+    for store in result_stores:
+        store.record(known)
+
+    result_table = pd.Series([results[h] for h in hashes],
+                             index=input_table.index, dtype=object)
 
     input_table["global_data"] = result_table.apply(
         lambda x: x[0][0] if (isinstance(x, tuple)) else None)
@@ -42,6 +632,16 @@ def run_simulation(input_table: pd.DataFrame, return_unsuccessful=True) \
     input_table["successful_run"] = result_table.apply(
         lambda x: True if (isinstance(x[0], list)) else False)
 
+    # Flat global results, built once per batch
+    global_table = global_results_table(input_table["global_data"])
+    for name in global_table.columns:
+        input_table[global_column(name)] = global_table[name]
+    input_table.attrs["global_units"] = global_table.attrs["units"]
+    if initial_states is not None:
+        input_table["solver_state"] = result_table.apply(
+            lambda x: x[2].get('solver_state')
+            if isinstance(x, tuple) and isinstance(x[2], dict) else None)
+
     all_successfull = True if input_table["successful_run"].all() else False
 
     if not return_unsuccessful:
@@ -100,6 +700,10 @@ def create_settings(df_data: pd.DataFrame, settings,
     df_temp['input_data'] = df_temp['input_data'].astype(object)
     df_temp['settings'] = df_temp['input_data'].astype(object)
 
+    # Shared base settings are immutable (see base_settings)
+    settings = thaw(settings)
+    settings_key = fingerprint(settings)
+
     if input_cols is not None:
         df_data_red = df_data.loc[:, input_cols]
     else:
@@ -111,7 +715,7 @@ def create_settings(df_data: pd.DataFrame, settings,
                      for i, v in zip(row.index, row.values)}, axis=1)
 
     df_temp['settings'] = df_temp['input_data'].apply(
-        lambda x: data_transfer.dict_transfer(x, settings)[0])
+        lambda x: transfer_settings(x, settings, settings_key))
     data = df_data.join(df_temp)
 
     return data
@@ -214,6 +818,8 @@ def settings_to_dash_gui(settings: dict) -> (dict, list):
     input: settings_dict = {'stack': {'cathode': {'channel': {'length': 0.5}}}}
     return: gui_dict = {'stack-cathode-channel-length': 0.5}
     """
+    # Form values are plain lists (base settings are frozen, see freeze)
+    settings = thaw(settings)
     name_lists = [ids['id'].split('-') if ids['id'][-1:].isnumeric() is False
                   else ids['id'][:-2].split('-') for ids in dl.ID_LIST]
     error_list = []
@@ -243,7 +849,7 @@ def update_gui_lists(id_value_dict: dict,
 
     for k, v in id_value_dict.items():
         if k in id_match:
-            if isinstance(v, list):
+            if isinstance(v, (list, tuple)):
                 for num, val in enumerate(v):
                     dict_ids_multival[k + f'_{num}'] = check_ifbool(val)
             else:
@@ -320,14 +926,119 @@ def process_inputs(inputs, multiinputs, id_inputs, id_multiinputs,
         return df_data
 
 
+def nominal_inputs(settings: dict) -> pd.DataFrame:
+    """
+    Input values (one row "nominal") as shown in the form after loading
+    'settings': initial values of the layout updated by the settings.
+    Requires the layout (dl.tab_container) to be built in this process.
+    """
+    ids = [i for i in dl.ID_LIST if i['type'] == 'input']
+    ids_multi = [i for i in dl.ID_LIST if i['type'] == 'multiinput']
+    gui_values, _ = settings_to_dash_gui(settings)
+    inputs, multiinputs = update_gui_lists(
+        gui_values, [dl.INITIAL_VALUES.get(i['id']) for i in ids],
+        [dl.INITIAL_VALUES.get(i['id']) for i in ids_multi], ids, ids_multi)
+    return process_inputs(inputs, multiinputs, ids, ids_multi,
+                          dtype=pd.DataFrame)
+
+
+# Sensitivity studies: central difference step of a run
+# (-1: lower value, 0: nominal run, 1: upper value)
+SENSITIVITY_STEP = "sensitivity_step"
+
+# Space-filling sampling modes of variation_parameter (scipy.stats.qmc)
+SAMPLING_MODES = {'lhs': 'Latin Hypercube', 'sobol': 'Sobol',
+                  'halton': 'Halton'}
+
+
+def sample_design(mode: str, n_dims: int, n_samples: int, seed=None) \
+        -> np.ndarray:
+    """
+    Space-filling sample of n_samples points in the unit hypercube
+    [0, 1)^n_dims, mode one of SAMPLING_MODES. Sobol and Halton sequences
+    are scrambled, same seed gives the same design.
+    """
+    if mode == 'lhs':
+        sampler = qmc.LatinHypercube(d=n_dims, seed=seed)
+    elif mode == 'sobol':
+        sampler = qmc.Sobol(d=n_dims, scramble=True, seed=seed)
+    elif mode == 'halton':
+        sampler = qmc.Halton(d=n_dims, scramble=True, seed=seed)
+    else:
+        raise NotImplementedError(f'Sampling mode {mode} not implemented')
+    with warnings.catch_warnings():
+        # Sobol: balance properties need powers of 2, any budget is allowed
+        warnings.simplefilter('ignore', UserWarning)
+        return sampler.random(n_samples)
+
+
+def _scale_sample(u: np.ndarray, values: list, vartype: str, nominal):
+    """
+    Map unit samples u of one parameter to its values: uniform in between
+    both limits for ranges ("Range", "Percent (+/-)"), uniform choice
+    of the given values otherwise. Integer parameters stay integers.
+    """
+    if vartype in ("Range", "Percent (+/-)"):
+        lower = np.asarray(values[0], dtype=float)
+        upper = np.asarray(values[1], dtype=float)
+        scaled = lower + np.multiply.outer(u, upper - lower)
+        nominal = nominal if isinstance(nominal, list) else [nominal]
+        integer = all(isinstance(v, (int, np.integer))
+                      and not isinstance(v, bool) for v in nominal)
+        if integer:
+            scaled = np.rint(scaled).astype(int)
+        return [v.tolist() for v in scaled]
+    index = np.minimum((u * len(values)).astype(int), len(values) - 1)
+    return [values[i] for i in index]
+
+
+def count_parameter_sets(table_input, mode="single", n_samples=None) -> int:
+    """
+    Number of parameter sets variation_parameter creates for the study
+    table 'table_input' (identical sets included)
+    """
+    counts = []
+    for le in table_input:
+        if le.get("Variation Type") is None:
+            continue
+        values = ast.literal_eval(str(le["Values"]))
+        if le["Variation Type"] in ("Percent (+/-)", "Range"):
+            counts.append(2)
+        elif isinstance(values, (tuple, list)):
+            counts.append(len(values))
+        else:
+            counts.append(1)
+    if not counts:
+        return 0
+    if mode == "single":
+        return sum(counts)
+    elif mode == "sensitivity":
+        return 2 * len(counts) + 1
+    elif mode == "full":
+        return int(np.prod(counts))
+    elif mode in SAMPLING_MODES:
+        return int(n_samples or 0)
+    raise NotImplementedError(f'Study mode {mode} not implemented')
+
+
 def variation_parameter(df_input: pd.DataFrame, table_input,
-                        keep_nominal=False, mode="single") -> pd.DataFrame:
+                        keep_nominal=False, mode="single", n_samples=None,
+                        seed=None) -> pd.DataFrame:
     """
     Function to create parameter sets.
     - variation of single parameter - ok
     - (single) variation of multiple parameters - ok
     - combined variation of multiple parameters
         - full factorial - ok
+        - space-filling samples (SAMPLING_MODES) of n_samples runs,
+          drawn with 'seed' - ok
+    - sensitivity: nominal run and first and last value of every
+      parameter (all others nominal) for central differences, marked in
+      column SENSITIVITY_STEP - ok
+
+    Variation types: "Values" (list of values), "Percent (+/-)" and
+    "Range" (lower, upper). Single and full factorial studies use both
+    limits of ranges as values.
 
     Important: Change casting_func to int(),float(),... accordingly!
     """
@@ -363,6 +1074,13 @@ def variation_parameter(df_input: pd.DataFrame, table_input,
             le_type = type(le[0])
         var_par_cast.append(le_type)
 
+    for name, vls, vartype in zip(var_par_names, var_par_values,
+                                  var_par_variationtype):
+        if vartype == "Range" and \
+                not (isinstance(vls, tuple) and len(vls) == 2):
+            raise ValueError(f'Range of {name} needs two values: '
+                             f'lower, upper')
+
     # Caluclation of values for percent definitions
     processed_var_par_values = []
     for name, vls, vartype \
@@ -385,8 +1103,9 @@ def variation_parameter(df_input: pd.DataFrame, table_input,
             processed_var_par_values.append(list(vls))
 
     var_parameter = \
-        {name: {"values": val} for name, val in
-         zip(var_par_names, processed_var_par_values)}
+        {name: {"values": val, "type": vartype} for name, val, vartype in
+         zip(var_par_names, processed_var_par_values,
+             var_par_variationtype)}
 
     # Add informational column "variation_parameter"
     clms = list(df_input.columns)
@@ -403,6 +1122,20 @@ def variation_parameter(df_input: pd.DataFrame, table_input,
                 inp.loc["nominal", "variation_parameter"] = parname
                 data = pd.concat([data, inp], ignore_index=True)
 
+    elif mode == "sensitivity":
+        inp = df_input.copy()
+        inp.loc["nominal", "variation_parameter"] = "nominal"
+        inp.loc["nominal", SENSITIVITY_STEP] = 0
+        data = pd.concat([data, inp], ignore_index=True)
+        for parname, attr in var_parameter.items():
+            for step, val in ((-1, attr["values"][0]),
+                              (1, attr["values"][-1])):
+                inp = df_input.copy()
+                inp.at["nominal", parname] = val
+                inp.loc["nominal", "variation_parameter"] = parname
+                inp.loc["nominal", SENSITIVITY_STEP] = step
+                data = pd.concat([data, inp], ignore_index=True)
+
     elif mode == "full":
         # see https://docs.python.org/3/library/itertools.html
 
@@ -419,6 +1152,20 @@ def variation_parameter(df_input: pd.DataFrame, table_input,
                 inp.at["nominal", par] = val
             data = pd.concat([data, inp], ignore_index=True)
 
+    elif mode in SAMPLING_MODES:
+        if not n_samples:
+            raise ValueError('Sampling studies need a number of runs')
+        parameter_names = list(var_parameter)
+        sample = sample_design(mode, len(parameter_names), int(n_samples),
+                               seed=seed)
+        data = pd.concat([df_input] * int(n_samples), ignore_index=True)
+        data["variation_parameter"] = ",".join(parameter_names)
+        for col, (par, attr) in enumerate(var_parameter.items()):
+            values = _scale_sample(sample[:, col], attr["values"],
+                                   attr["type"],
+                                   df_input.loc["nominal", par])
+            data[par] = pd.Series(values, index=data.index, dtype=object)
+
     if keep_nominal:
         data = pd.concat([data, df_input])
 
@@ -5,8 +5,12 @@ import copy
 
 ID_LIST = []  # Keep track with generated IDs
 CONTAINER_LIST = []
+# Initial values {id: value} of the generated input components
+INITIAL_VALUES = {}
 
 # Keep track with generated container IDs (generated at  frame level)
+# The lists are filled once per process while building the layout at import
+# and are read-only afterwards, hence safe to share between threads.
 
 
 def make_list(lst) -> list:
@@ -28,6 +32,10 @@ def tab_container(tab_dicts: list) -> dcc.Tabs:
      Input:
         gui_input.main_frame_dicts from pemfc_gui.input
     """
+    # Rebuilding the layout must not duplicate the tracked IDs
+    ID_LIST.clear()
+    CONTAINER_LIST.clear()
+    INITIAL_VALUES.clear()
 
     tabs = dcc.Tabs(
         [dcc.Tab(html.Div(frame(tabdict)),
@@ -40,9 +48,89 @@ def tab_container(tab_dicts: list) -> dcc.Tabs:
         id='tabs', parent_className='some_container', value="tab1",
         className='custom-tabs flex-container'
     )
+    INITIAL_VALUES.update(initial_values(tabs))
     return tabs
 
 
+def initial_values(tabs: dcc.Tabs) -> dict:
+    """
+    Initial values {id: value} of all input components of a layout built
+    by tab_container (form values before any user input)
+    """
+    return {component.id['id']: getattr(component, 'value', None)
+            for component in tabs._traverse()
+            if isinstance(getattr(component, 'id', None), dict)
+            and component.id.get('type') in ('input', 'multiinput')}
+
+
+# Inputs with specifier (key) are enabled only while the dropdown with
+# specifier value[0] of the same component (e.g. anode or cathode channel)
+# shows value[1]
+ENABLE_RULES = {
+    'disable_basewidth': ('dropdown_activate_basewidth', 'trapezoidal')}
+
+
+def _layout_items(dicts: list):
+    """
+    All frame and widget dicts of the layout settings in layout order
+    """
+    for item in dicts:
+        yield item
+        for key in ('sub_frame_dicts', 'widget_dicts'):
+            yield from _layout_items(item.get(key, []))
+
+
+def _widget_ids(widget: dict) -> list:
+    return id_val_gui_to_dash(
+        widget.get('label', ''), widget.get('sim_name'),
+        widget.get('value'), widget.get('number'), widget['type'])[1]
+
+
+def form_rules(tab_dicts: list) -> dict:
+    """
+    Rules for showing and enabling form elements, compiled from the layout
+    settings (parameters_layout.json) for the clientside callbacks in
+    assets/form_rules.js:
+        'visibility': {container id: [dropdown id, option]}, the container
+            is shown only while the option is selected. Containers
+            (specifier 'visibility') are paired in layout order with the
+            options of all 'dropdown_activate' dropdowns.
+        'enable': {input id: [dropdown id, value]}, see ENABLE_RULES
+    """
+    options = []
+    containers = []
+    specified = {}
+    for item in _layout_items(tab_dicts):
+        spec = item.get('specifier')
+        if not spec:
+            continue
+        if 'type' not in item:  # frame
+            if spec == 'visibility':
+                containers.append(item['title'])
+            continue
+        ids = _widget_ids(item)
+        if spec == 'dropdown_activate':
+            options.extend([ids[0], value] for value in item['value'])
+        elif spec == 'visibility':
+            containers.append(ids[0])
+        specified.setdefault(spec, []).extend(ids)
+
+    enable = {}
+    for spec, (dropdown_spec, value) in ENABLE_RULES.items():
+        dropdowns = specified.get(dropdown_spec, [])
+        for num, input_id in enumerate(specified.get(spec, [])):
+            # Dropdown of the same component, otherwise by position
+            component = input_id.rsplit('-', 1)[0]
+            match = [d for d in dropdowns
+                     if d.rsplit('-', 1)[0] == component]
+            if match:
+                enable[input_id] = [match[0], value]
+            elif num < len(dropdowns):
+                enable[input_id] = [dropdowns[num], value]
+
+    return {'visibility': dict(zip(containers, options)), 'enable': enable}
+
+
 def val_container(ids, types='output'):
     row_break = html.Div(className='row-break')
     div_per_row = int(len(ids) / 2)
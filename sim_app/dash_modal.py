@@ -15,6 +15,10 @@ def create_modal(main_id='modal', title_id='modal-title', body_id='modal-body'):
         id=main_id, is_open=False, size="lg"))
 
 
+def make_list(value) -> list:
+    return value if isinstance(value, list) else [value] if value else []
+
+
 def modal_process(error_type, error=''):
     if isinstance(error, list):
         ids_str = ', '.join([str(index) for index in error])
@@ -62,6 +66,12 @@ def modal_process(error_type, error=''):
                   html.Div('Please review the JSON file again or try '
                            'using another file!', style=space)],
               },
+         'study-rejected':
+             {'title': 'Study not started!',
+              'body': [html.Div(msg) for msg in make_list(error)] + [
+                  html.Div(style=space),
+                  html.Div('Please reduce the study size or wait until the '
+                           'running study is finished.', style=space)]},
          'wrong-file':
              {'title': 'Error! Wrong File!',
               'body': [
@@ -8,37 +8,42 @@ import pandas as pd
 import pickle
 import re
 import copy
-import sys
 import json
+import uuid
 from glom import glom
 import dash
 from dash_extensions.enrich import Output, Input, State, ALL, html, dcc, \
-    ServersideOutput, ctx
+    ServersideOutput
 from dash import dash_table as dt
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
+from dash import ClientsideFunction
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 # import plotly.express as px
 
 from sim_app.dash_functions import create_settings
+from . import config
 from . import dash_functions as df, dash_layout as dl, dash_modal as dm
-from sim_app.dash_app import app
+from . import surrogate
+from . import api
+from . import plot_functions as pf
+from sim_app.dash_app import app, caching_backend, client_address, \
+    result_warehouse
 
 import data_transfer
 
-from sim_app.study_functions import prepare_initial_curve_computation, \
-    prepare_curve_refinement_calculation
-from tqdm import tqdm
+from sim_app.study_functions import CURRENT_DENSITY, plan_study, \
+    admission_errors, StudySlot, sensitivities, run_study
 from decimal import Decimal
 
-tqdm.pandas()
-
 # from pandarallel import pandarallel
 # pandarallel.initialize()
 # from multiprocesspandas import applyparallel
 
 server = app.server
+# JSON API for programmatic study submission
+server.register_blueprint(api.blueprint)
 
 app._favicon = 'logo-zbt.ico'
 app.title = 'PEMFC Model'
@@ -57,8 +62,16 @@ timer_progress = dcc.Interval(id='timer_progress',
                               interval=15000)
 
 app.layout = dbc.Container([
-    dcc.Store(id="base_settings_data"),
+    # Session-scoped key for all transient server-side state
+    dcc.Store(id="session_id"),
+    # Server-side form state: changed input fields and their acknowledgement
+    dcc.Store(id="form_delta"),
+    dcc.Store(id="form_ack"),
+    # Show/hide and enable rules of the input form (clientside callbacks)
+    dcc.Store(id="form_rules", data=dl.form_rules(parameters_layout)),
     dcc.Store(id="input_data"),
+    # Planning stage of the study (see cbf_study_plan)
+    dcc.Store(id="study_plan_store"),
     dcc.Store(id="df_input_data"),
     dbc.Spinner(dcc.Store(id='result_data_store'), fullscreen=True,
                 spinner_class_name='loading_spinner',
@@ -182,6 +195,15 @@ app.layout = dbc.Container([
                     comma. Column "Example" shows example input and is not used 
                     for calculation. 
                     Only numeric parameter implemented yet.
+                    
+                    Variation Type "Range" takes lower and upper limit 
+                    (e.g. "0.4, 0.6"). Latin Hypercube, Sobol and Halton 
+                    studies sample the given number of runs from all 
+                    ranges, percentual deviations and values.
+                    Sensitivity studies simulate the first and last value 
+                    of each parameter (e.g. +/- percent) in one batch and 
+                    rank the normalized sensitivities in a tornado chart 
+                    (polarization curves are not calculated).
                             
                     The table can be exported, modified in Excel & uploaded. 
                     Reload GUI to restore table functionality after upload. 
@@ -213,9 +235,25 @@ app.layout = dbc.Container([
                         options=[{'label': 'Single Variation',
                                   'value': 'single'},
                                  {'label': 'Full Factorial',
-                                  'value': 'full'}],
+                                  'value': 'full'},
+                                 {'label': 'Sensitivity',
+                                  'value': 'sensitivity'}] +
+                                [{'label': label, 'value': mode}
+                                 for mode, label
+                                 in df.SAMPLING_MODES.items()],
                         value='single',
                         inline=True)),
+                html.Div(
+                    [dbc.Label('Runs (sampling):', className='sm-label'),
+                     dbc.Input(id='study_n_samples', type='number',
+                               min=1, step=1, value=32,
+                               className='val_input'),
+                     dbc.Label('Seed:', className='sm-label'),
+                     dbc.Input(id='study_seed', type='number', step=1,
+                               value=0, className='val_input')],
+                    className='r_flex g-0'),
+                # Planned runs and estimated duration
+                html.Div(id='study_plan_info'),
                 html.Div([
                     html.Div([
                         html.Button('Run Study', id='btn_study',
@@ -284,6 +322,15 @@ app.layout = dbc.Container([
                 id='div_curve_graph',
                 className='pretty_container',
                 style={'overflow': 'auto'}),
+            html.Div(
+                [html.Div('Study Preview (Surrogate Model)', className='title'),
+                 html.Div(id='study_preview_info'),
+                 dt.DataTable(id='study_preview_table',
+                              page_size=10,
+                              style_table={'overflowX': 'auto'})],
+                id='div_study_preview',
+                className='pretty_container',
+                style={'overflow': 'auto'}),
             html.Div(
                 [html.Div('Global Results (for Study only first dataset shown)',
                           className='title'),
@@ -293,6 +340,28 @@ app.layout = dbc.Container([
                 id='div_global_table',
                 className='pretty_container',
                 style={'overflow': 'auto'}),
+            html.Div([
+                html.Div('Study Results', className='title'),
+                html.Div(
+                    [html.Div(
+                        dcc.Dropdown(
+                            id='dropdown_study_y',
+                            placeholder='Select Global Quantity',
+                            className='dropdown_input')),
+                        html.Div(
+                            dcc.Dropdown(
+                                id='dropdown_study_x',
+                                placeholder='Select Parameter',
+                                className='dropdown_input'))],
+                    style={'display': 'flex',
+                           'flex-direction': 'row',
+                           'flex-wrap': 'wrap',
+                           'justify-content': 'left'}),
+                dbc.Spinner(dcc.Graph(id='study_graph'),
+                            spinner_class_name='loading_spinner',
+                            fullscreen_class_name='loading_spinner_bg')],
+                id='study_container',
+                className='graph pretty_container'),
             html.Div([
                 html.Div('Heatmap', className='title'),
                 html.Div(
@@ -421,18 +490,18 @@ app.layout = dbc.Container([
     Output('pbar', 'label'),
     Output('pbar', 'color'),
     Input('timer_progress', 'n_intervals'),
+    State('session_id', 'data'),
     prevent_initial_call=True)
-def cbf_progress_bar(*args) -> (float, str):
+def cbf_progress_bar(n_intervals, session_id) -> (float, str):
     """
     # https://towardsdatascience.com/long-callbacks-in-dash-web-apps-72fd8de25937
+    Progress is written session-scoped to the caching backend by
+    df.ProgressReporter, so it is visible to all workers.
     """
 
     try:
-        with open('progress.txt', 'r') as file:
-            str_raw = file.read()
-        last_line = list(filter(None, str_raw.split('\n')))[-1]
-        percent = float(last_line.split('%')[0])
-    except:
+        percent = df.ProgressReporter.read(caching_backend, session_id)
+    except Exception:
         percent = 0
     finally:
         text = f'{percent:.0f}%'
@@ -446,9 +515,9 @@ def cbf_progress_bar(*args) -> (float, str):
 @app.callback(
     Output({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
     Output({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
-    Output("base_settings_data", "data"),
-    Output('df_input_store', 'data'),
+    ServersideOutput('df_input_store', 'data'),
     Output("study_table", "children"),
+    Output("session_id", "data"),
     Input("initial_dummy", "children"),
     [State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
      State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
@@ -460,28 +529,10 @@ def cbf_initialization(dummy, value_list: list, multivalue_list: list,
     """
     Initialization
     """
-    # Read pemfc default settings.json file
+    # Default simulation settings (parsed once per process, shared by all
+    # sessions, see df.base_settings)
     # --------------------------------------
-    try:
-        # Initially get default simulation settings structure from
-        # settings.json file in pemfc core module
-        # sim_base_dir = os.path.dirname(pemfc.__file__)
-        sim_base_dir = '.'
-        with open(os.path.join(sim_base_dir, 'settings', 'settings.json')) \
-                as file:
-            base_settings = json.load(file)
-    except Exception as E:
-        print(repr(E))
-    base_settings = df.store_data(base_settings)
-
-    try:
-        # Initially get default simulation input values from local
-        # settings.json file
-        with open(os.path.join('settings', 'settings.json')) as file:
-            input_settings = json.load(file)
-    except Exception as E:
-        print(repr(E))
-    gui_label_value_dict, _ = df.settings_to_dash_gui(input_settings)
+    gui_label_value_dict, _ = df.settings_to_dash_gui(df.base_settings())
 
     # Update initial data input with "input_settings"
     # --------------------------------------
@@ -502,7 +553,6 @@ def cbf_initialization(dummy, value_list: list, multivalue_list: list,
     df_input = df.process_inputs(new_value_list, new_multivalue_list,
                                  id_list, multivalue_id_list,
                                  dtype=pd.DataFrame)
-    df_input_store = df.store_data(df_input)
 
     # Initialize study data table
     # -------------------------------------
@@ -540,7 +590,7 @@ def cbf_initialization(dummy, value_list: list, multivalue_list: list,
             'Variation Type': {
                 'options': [
                     {'label': i, 'value': i}
-                    for i in ["Values", "Percent (+/-)"]
+                    for i in ["Values", "Percent (+/-)", "Range"]
                 ]},
         },
         filter_action="native",
@@ -551,8 +601,11 @@ def cbf_initialization(dummy, value_list: list, multivalue_list: list,
         style_table={'height': '300px', 'overflowY': 'auto'}
     )
 
+    # Random session key, used for all transient server-side state
+    session_id = uuid.uuid4().hex
+
     return new_value_list, new_multivalue_list, \
-           base_settings, df_input_store, table
+           df_input, table, session_id
 
 
 @app.callback(
@@ -614,24 +667,22 @@ def cbf_load_settings(contents, filename, value, multival, ids, ids_multival,
 @app.callback(
     [Output("savefile-json", "data")],
     Input('save-button', "n_clicks"),
-    [State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'id'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'id')],
+    State('form_delta', 'data'),
+    State('session_id', 'data'),
     prevent_initial_call=True,
 )
-def cbf_save_settings(n_clicks, val1, val2, ids, ids2):
+def cbf_save_settings(n_clicks, form_delta, session_id):
     """
 
     @param n_clicks:
-    @param val1:
-    @param val2:
-    @param ids:
-    @param ids2:
+    @param form_delta: form changes not yet merged into the form state
+    @param session_id:
     @return:
     """
     save_complete = True
 
+    val1, val2, ids, ids2 = df.FormState(
+        caching_backend, session_id).inputs(form_delta)
     dict_data = df.process_inputs(val1, val2, ids, ids2)  # values first
 
     if not save_complete:  # ... save only GUI inputs
@@ -664,34 +715,61 @@ def cbf_save_settings(n_clicks, val1, val2, ids, ids2):
         # code portion of run_simulation()
         # ------------------------
 
-        with open(os.path.join('settings', 'settings.json')) \
-                as file:
-            settings = json.load(file)
-        settings, _ = data_transfer.dict_transfer(input_data, settings)
+        settings, _ = data_transfer.dict_transfer(
+            input_data, df.thaw(df.base_settings()))
 
         return dict(content=json.dumps(settings, indent=2),
                     filename='settings.json')
 
 
+# Form changes are collected clientside (assets/form_state.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='form_state', function_name='delta'),
+    Output('form_delta', 'data'),
+    Input({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
+    Input({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
+    Input('form_ack', 'data'),
+    State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'id'),
+    State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'id'))
+
+
+@app.callback(
+    Output('form_ack', 'data'),
+    Input('form_delta', 'data'),
+    Input('session_id', 'data'),
+    prevent_initial_call=True)
+def cbf_form_state(form_delta, session_id):
+    """
+    Merge changed form fields into the session's form state
+    """
+    if form_delta is None or session_id is None:
+        raise PreventUpdate
+    version = df.FormState(caching_backend, session_id).merge(form_delta)
+    # Lost form state: the browser sends the complete form again.
+    # Otherwise only the stored version is acknowledged.
+    if version is None:
+        return {'version': form_delta['version'], 'resync': True}
+    return {'version': version, 'resync': False}
+
+
 @app.callback(
-    Output('df_result_data_store', 'data'),
-    Output('df_input_store', 'data'),
+    ServersideOutput('df_result_data_store', 'data'),
+    ServersideOutput('df_input_store', 'data'),
     Output("spinner_run_single", 'children'),
     Input("run_button", "n_clicks"),
-    [State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'id'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'id'),
-     State("base_settings_data", "data")],
+    State('form_delta', 'data'),
+    State('session_id', 'data'),
     prevent_initial_call=True)
-def cbf_run_single_cal(n_click, inputs, inputs2, ids, ids2, settings):
+def cbf_run_single_cal(n_click, form_delta, session_id):
     """
     Changelog:
 
     """
+    settings = df.base_settings()
     try:
-        # Read pemfc settings.json from store
-        settings = df.read_data(settings)
+        # Form inputs from the server-side form state
+        inputs, inputs2, ids, ids2 = df.FormState(
+            caching_backend, session_id).inputs(form_delta)
 
         # Read data from input fields and save input in dict/dataframe
         # (one row "nominal")
@@ -704,13 +782,17 @@ def cbf_run_single_cal(n_click, inputs, inputs2, ids, ids2, settings):
         df_input = create_settings(df_input, settings)
 
         # Run simulation
-        df_result, _ = df.run_simulation(df_input)
-
-        # Save results
-        df_result_store = df.store_data(df_result)
-        df_input_store = df.store_data(df_input_raw)
-
-        return df_result_store, df_input_store, ""
+        progress = df.ProgressReporter(caching_backend, session_id)
+        df_result, _ = df.run_simulation(
+            df_input, progress=progress, result_stores=warehouse_stores(),
+            timings=df.RunTimings(caching_backend))
+        surrogate.record_results(caching_backend, settings, df_result,
+                                 df_input_raw.columns)
+        if result_warehouse is not None:
+            result_warehouse.index_parameters(df_result,
+                                              df_input_raw.columns)
+
+        return df_result, df_input_raw, ""
 
     except Exception as E:
         modal_title, modal_body = \
@@ -729,33 +811,41 @@ def cbf_update_studytable(contents, filename):
     return data.to_dict('records'), [{"name": i, "id": i} for i in data.columns]
 
 
+def warehouse_stores() -> list:
+    return [] if result_warehouse is None else [result_warehouse]
+
+
 @app.callback(
-    Output('df_result_data_store', 'data'),
-    Output('df_input_store', 'data'),
+    ServersideOutput('df_result_data_store', 'data'),
+    ServersideOutput('df_input_store', 'data'),
     Output('spinner_study', 'children'),
+    Output('modal-title', 'children'),
+    Output('modal-body', 'children'),
+    Output('modal', 'is_open'),
     Input("btn_study", "n_clicks"),
-    [State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'value'),
-     State({'type': 'input', 'id': ALL, 'specifier': ALL}, 'id'),
-     State({'type': 'multiinput', 'id': ALL, 'specifier': ALL}, 'id')],
-    State("base_settings_data", "data"),
+    State('form_delta', 'data'),
     State("study_data_table", "data"),
     State("check_calc_curve", "value"),
     State("check_study_type", "value"),
+    State("study_n_samples", "value"),
+    State("study_seed", "value"),
+    State('session_id', 'data'),
     prevent_initial_call=True)
-def cbf_run_study(btn, inputs, inputs2, ids, ids2, settings, tabledata,
-                  check_calc_curve, check_study_type):
+def cbf_run_study(btn, form_delta, tabledata,
+                  check_calc_curve, check_study_type, n_samples, seed,
+                  session_id):
     """
     #ToDO Documentation
 
     Arguments
     ----------
-    settings
     tabledata
     check_calc_curve:    Checkbox, if complete
     check_study_type:
+    n_samples, seed:     Run budget and seed of sampling studies
     """
     variation_mode = "dash_table"
+    settings = df.base_settings()
 
     # Calculation of polarization curve for each dataset?
     if isinstance(check_calc_curve, list):
@@ -765,20 +855,33 @@ def cbf_run_study(btn, inputs, inputs2, ids, ids2, settings, tabledata,
             curve_calculation = False
     else:
         curve_calculation = False
-    n_refinements = 15
 
     mode = check_study_type
+    if mode == 'sensitivity':
+        # Sensitivities at the operating point only
+        curve_calculation = False
+
+    # Planning stage: reject studies exceeding the limits of config
+    timings = df.RunTimings(caching_backend)
+    plan = plan_study(tabledata, mode, n_samples, curve_calculation, timings)
+    errors = admission_errors(plan)
+    if errors:
+        modal_title, modal_body = dm.modal_process('study-rejected', errors)
+        return dash.no_update, dash.no_update, "", modal_title, modal_body, \
+            True
 
     # Progress bar init
-    std_err_backup = sys.stderr
-    file_prog = open('progress.txt', 'w')
-    sys.stderr = file_prog
+    progress = df.ProgressReporter(caching_backend, session_id)
 
-    # Read pemfc settings.json from store
-    settings = df.read_data(settings)
+    # Incremental re-execution: runs with unchanged settings are taken from
+    # the previous study of this session
+    session_results = df.SessionResultStore(caching_backend, session_id)
+    result_stores = [session_results]
 
     # Read data from input fields and save input in dict (legacy)
     # / pd.DataDrame (one row with index "nominal")
+    inputs, inputs2, ids, ids2 = df.FormState(
+        caching_backend, session_id).inputs(form_delta)
     df_input = df.process_inputs(
         inputs, inputs2, ids, ids2, dtype=pd.DataFrame)
     df_input_backup = df_input.copy()
@@ -786,65 +889,170 @@ def cbf_run_study(btn, inputs, inputs2, ids, ids2, settings, tabledata,
     # Create multiple parameter sets
     if variation_mode == "dash_table":
         data = df.variation_parameter(
-            df_input, keep_nominal=False, mode=mode, table_input=tabledata)
+            df_input, keep_nominal=False, mode=mode, table_input=tabledata,
+            n_samples=n_samples, seed=seed)
     else:
         raise NotImplementedError
-    varpars = list(data["variation_parameter"].unique())
 
-    if not curve_calculation:
-        # Create complete setting dict & append it in additional column
-        # "settings" to df_input
-        data = create_settings(data, settings, input_cols=df_input.columns)
-        # Run Simulation
-        results, success = df.run_simulation(data)
-        results = df.store_data(results)
-
-    else:  # ... calculate pol. curve for each parameter set
-        result_data = pd.DataFrame(columns=data.columns)
-
-        # grouped_data = data.groupby(varpars, sort=False)
-        # for _, group in grouped_data:
-        for i in range(0, len(data)):
-            # Ensure DataFrame with double bracket
-            # https://stackoverflow.com/questions/20383647/pandas-selecting-by-label-sometimes-return-series-sometimes-returns-dataframe
-            # df_input_single = df_input.loc[[:], :]
-
-            # max_i = find_max_current_density(data.iloc[[i]], df_input, settings)
-            max_i = 10000 # dummy value
-            # # Reset solver settings
-            # df_input = df_input_backup.copy()
+    # Checkpoint: completed runs are logged durably, a restarted study
+    # with the same design continues where it stopped
+    checkpoint = df.StudyCheckpoint(df.StudyCheckpoint.study_id(
+        settings, data, curve_calculation=curve_calculation))
+    result_stores.append(checkpoint)
+    # Runs of all sessions
+    result_stores += warehouse_stores()
+
+    # Run study, counts against the running studies of this user
+    with StudySlot(caching_backend, client_address()) as slot:
+        if not slot.acquired:
+            mark_study_done(session_id, btn)
+            modal_title, modal_body = dm.modal_process('study-rejected',
+                                                       [StudySlot.BUSY])
+            return dash.no_update, dash.no_update, "", modal_title, \
+                modal_body, True
+        results = run_study(data, df_input, settings,
+                            curve_calculation, progress=progress,
+                            result_stores=result_stores, timings=timings,
+                            max_workers=config.SIMULATION_MAX_WORKERS)
+    checkpoint.complete()
+    surrogate.record_results(caching_backend, settings, results,
+                             df_input.columns)
+    if result_warehouse is not None:
+        result_warehouse.index_parameters(results, df_input.columns)
+
+    session_results.save()
+    mark_study_done(session_id, btn)
+
+    return results, df_input_backup, ".", dash.no_update, dash.no_update, \
+        dash.no_update
+
+
+def study_done_key(session_id):
+    return f'study-done-{session_id}'
+
+
+def mark_study_done(session_id, btn):
+    """
+    Record the click of the last completed study, a preview computed for it
+    is not shown anymore (see cbf_study_preview)
+    """
+    caching_backend.set(study_done_key(session_id), btn,
+                        timeout=config.FORM_STATE_TIMEOUT)
 
-            success = False
-            while (not success) and (max_i > 5000):
-                # Prepare & calculate initial points
-                df_results = prepare_initial_curve_computation(
-                    input_df=data.iloc[[i]], i_limits=[1, max_i],
-                    settings=settings, input_cols=df_input.columns)
-                df_results, success = df.run_simulation(df_results)
-                max_i -= 2000
 
-            if not success:
-                continue
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f'{seconds:.0f} s'
+    elif seconds < 3600:
+        return f'{seconds / 60:.0f} min'
+    return f'{seconds / 3600:.1f} h'
 
-                # First refinement steps
-            for _ in range(n_refinements):
-                df_refine = prepare_curve_refinement_calculation(
-                    input_df=df_input, data_df=df_results, settings=settings)
-                df_refine, success = df.run_simulation(
-                    df_refine, return_unsuccessful=False)
-                df_results = pd.concat(
-                    [df_results, df_refine], ignore_index=True)
 
-            result_data = pd.concat([result_data, df_results], ignore_index=True)
+@app.callback(
+    Output('study_plan_info', 'children'),
+    Output('btn_study', 'disabled'),
+    Output('study_plan_store', 'data'),
+    Input('study_data_table', 'data'),
+    Input('check_study_type', 'value'),
+    Input('check_calc_curve', 'value'),
+    Input('study_n_samples', 'value'),
+    prevent_initial_call=True)
+def cbf_study_plan(tabledata, mode, check_calc_curve, n_samples):
+    """
+    Number of runs and estimated duration of the study, shown before it is
+    started. Studies exceeding the limits cannot be started. The plan is
+    stored with its admission result (None for an invalid table).
+    """
+    curve_calculation = isinstance(check_calc_curve, list) \
+        and "calc_curve" in check_calc_curve and mode != 'sensitivity'
+    try:
+        plan = plan_study(tabledata, mode, n_samples, curve_calculation,
+                          df.RunTimings(caching_backend))
+    except (ValueError, SyntaxError):
+        return html.Div('Invalid entry in study table.',
+                        style={'color': 'red'}), True, None
+    if plan['duration'] is None:
+        duration = 'unknown (no recorded runs yet)'
+    else:
+        duration = format_duration(plan['duration'])
+    info = [html.Div(f"Planned: {plan['sets']} parameter sets, up to "
+                     f"{plan['runs']} simulation runs, estimated duration: "
+                     f"{duration}")]
+    errors = admission_errors(plan)
+    info += [html.Div(error, style={'color': 'red'}) for error in errors]
+    return info, bool(errors), dict(plan, admitted=not errors)
 
-        results = df.store_data(result_data)
 
-    df_input_store = df.store_data(df_input_backup)
+@app.callback(
+    Output('study_preview_table', 'columns'),
+    Output('study_preview_table', 'data'),
+    Output('study_preview_info', 'children'),
+    Input("btn_study", "n_clicks"),
+    State('form_delta', 'data'),
+    State("study_data_table", "data"),
+    State("check_study_type", "value"),
+    State("study_n_samples", "value"),
+    State("study_seed", "value"),
+    State('study_plan_store', 'data'),
+    State('session_id', 'data'),
+    prevent_initial_call=True)
+def cbf_study_preview(btn, form_delta, tabledata,
+                      check_study_type, n_samples, seed, plan, session_id):
+    """
+    Instant preview of the study's global results, predicted by a surrogate
+    model fitted on all recorded runs with the same base settings.
+    Runs in parallel to cbf_run_study and is shown until its results arrive.
+    Only admitted studies (see cbf_study_plan) are previewed.
+    """
+    if not plan or not plan['admitted']:
+        return [], [], ''
+    inputs, inputs2, ids, ids2 = df.FormState(
+        caching_backend, session_id).inputs(form_delta)
+    df_input = df.process_inputs(
+        inputs, inputs2, ids, ids2, dtype=pd.DataFrame)
+    try:
+        data = df.variation_parameter(
+            df_input, keep_nominal=False, mode=check_study_type,
+            table_input=tabledata, n_samples=n_samples, seed=seed)
+    except (ValueError, SyntaxError, TypeError):
+        return [], [], 'Invalid entry in study table.'
+
+    prediction = surrogate.predict_study(
+        caching_backend, df.base_settings(), data, df_input.columns)
+    done = caching_backend.get(study_done_key(session_id))
+    if done is not None and done >= btn:
+        # Results of this study arrived already, the preview was cleared
+        raise PreventUpdate
+    if prediction is None:
+        return [], [], 'Not enough recorded results for a preview.'
+    mean, std, units = prediction
+
+    # Varied input columns (sensitivity studies also mark the "nominal" run)
+    varpars = list(dict.fromkeys(
+        par for pars in data["variation_parameter"].unique()
+        for par in pars.split(',') if par in data.columns))
+    column_names = varpars + \
+        [f"{k} / {units.get(k, '-')}" for k in mean.columns]
+    columns = [{'name': col, 'id': col} for col in column_names]
+    rows = []
+    for idx in data.index:
+        row = {par: str(data.loc[idx, par]) for par in varpars}
+        row.update({f"{k} / {units.get(k, '-')}":
+                    f"{mean.loc[idx, k]:.3e} ± {std.loc[idx, k]:.1e}"
+                    for k in mean.columns})
+        rows.append(row)
+    return columns, rows, 'Surrogate model prediction (mean ± std), ' \
+                          'shown until simulation results arrive.'
 
-    file_prog.close()
-    sys.stderr = std_err_backup
 
-    return results, df_input_store, "."
+@app.callback(
+    Output('study_preview_table', 'columns'),
+    Output('study_preview_table', 'data'),
+    Output('study_preview_info', 'children'),
+    Input('df_result_data_store', 'data'),
+    prevent_initial_call=True)
+def cbf_clear_study_preview(*args):
+    return [], [], ''
 
 
 @app.callback(
@@ -852,25 +1060,29 @@ def cbf_run_study(btn, inputs, inputs2, ids, ids2, settings, tabledata,
     Input("btn_save_res", "n_clicks"),
     State('df_result_data_store', 'data'),
     prevent_initial_call=True)
-def cbf_save_results(inp, state):
-    # State-Store access returns None, I don't know why (FKL)
-    data = ctx.states["df_result_data_store.data"]
-    with open('results.pickle', 'wb') as handle:
-        pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-    return dcc.send_file("results.pickle")
+def cbf_save_results(inp, results):
+    if results is None:
+        raise PreventUpdate
+    # Send from memory, a shared file in the working directory would be
+    # overwritten by concurrent sessions
+    return dcc.send_bytes(
+        pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL),
+        "results.pickle")
 
 
 @app.callback(
-    Output('df_result_data_store', 'data'),
+    ServersideOutput('df_result_data_store', 'data'),
     Input("load_res", "contents"),
     prevent_initial_call=True)
 def cbf_load_results(content):
     # https://dash.plotly.com/dash-core-components/upload
     content_type, content_string = content.split(',')
     decoded = base64.b64decode(content_string)
-    b = pickle.load(io.BytesIO(decoded))
-    return b
+    results = pickle.load(io.BytesIO(decoded))
+    if isinstance(results, str):
+        # Files saved before results were stored server side
+        results = df.read_data(results)
+    return results
 
 
 @app.callback(
@@ -880,22 +1092,21 @@ def cbf_load_results(content):
     Input('df_result_data_store', 'data'),
     prevent_initial_call=True
 )
-def global_outputs_table(*args):
+def global_outputs_table(results):
     """
     ToDo: Add additional input.
     If storage triggered callback, use first result row,
     if dropdown triggered callback, select this row.
     """
+    if results is None:
+        raise PreventUpdate
 
-    # Read results
-    results = df.read_data(ctx.inputs["df_result_data_store.data"])
-
-    result_set = results.iloc[0]
+    global_table, global_units = df.global_results(results.iloc[[0]])
+    result_set = global_table.iloc[0]
 
-    global_result_dict = result_set["global_data"]
-    names = list(global_result_dict.keys())
-    values = [f"{v['value']:.3e}" for k, v in global_result_dict.items()]
-    units = [v['units'] for k, v in global_result_dict.items()]
+    names = list(result_set.index)
+    values = [f"{v:.3e}" for v in result_set.values]
+    units = [global_units.get(k) for k in names]
 
     column_names = ['Quantity', 'Value', 'Units']
     columns = [{'deletable': True, 'renamable': True,
@@ -908,6 +1119,78 @@ def global_outputs_table(*args):
     return columns, datas, 'csv',
 
 
+@app.callback(
+    [Output('dropdown_study_y', 'options'),
+     Output('dropdown_study_y', 'value'),
+     Output('dropdown_study_x', 'options'),
+     Output('dropdown_study_x', 'value')],
+    Input('df_result_data_store', 'data'),
+    prevent_initial_call=True
+)
+def cbf_study_dropdowns(results):
+    """
+    Global quantities and varied parameters of the current study
+    """
+    if results is None:
+        raise PreventUpdate
+    if "variation_parameter" not in results.columns:
+        # Single calculation
+        return [], None, [], None
+
+    global_table, _ = df.global_results(results)
+    quantities = [{'label': key, 'value': key}
+                  for key in global_table.columns]
+    parameters = pf.study_parameters(results,
+                                     extra_columns=[CURRENT_DENSITY])
+    options = [{'label': key, 'value': key} for key in parameters]
+    if len(parameters) > 1:
+        options.append({'label': 'All parameters (pairwise)',
+                        'value': pf.PAIRWISE})
+    y_value = quantities[0]['value'] if quantities else None
+    x_value = parameters[0] if parameters else None
+
+    if df.SENSITIVITY_STEP in results.columns:
+        # Per cell sensitivities of local fields (cells x channel values)
+        nominal = results.loc[results[df.SENSITIVITY_STEP] == 0, :]
+        local_data = nominal["local_data"].iloc[0] or {}
+        quantities += [{'label': f'{key} (per cell)',
+                        'value': pf.LOCAL_PREFIX + key}
+                       for key in local_data if 'xkey' in local_data[key]]
+        options.insert(0, {'label': 'Sensitivities (tornado chart)',
+                           'value': pf.TORNADO})
+        x_value = pf.TORNADO
+    return quantities, y_value, options, x_value
+
+
+@app.callback(
+    Output('study_graph', 'figure'),
+    Input('dropdown_study_y', 'value'),
+    Input('dropdown_study_x', 'value'),
+    State('df_result_data_store', 'data'),
+    prevent_initial_call=True
+)
+def cbf_study_graph(quantity, parameter, results):
+    """
+    Global quantity versus varied parameter over all runs of the study,
+    or pairwise scatter plot of all varied parameters.
+    Sensitivity studies: tornado chart of a global quantity or per cell
+    sensitivities of a local field.
+    """
+    if quantity is None or parameter is None or results is None:
+        raise PreventUpdate
+    if quantity.startswith(pf.LOCAL_PREFIX):
+        field = quantity[len(pf.LOCAL_PREFIX):]
+        sensitivity, _, _ = sensitivities(results, local_field=field)
+        return pf.cell_sensitivity_figure(sensitivity, field)
+    if parameter == pf.TORNADO:
+        return pf.tornado_figure(*sensitivities(results), quantity)
+    parameters = pf.study_parameters(results,
+                                     extra_columns=[CURRENT_DENSITY])
+    if parameter == pf.PAIRWISE:
+        return pf.pairwise_figure(results, quantity, parameters)
+    return pf.sweep_figure(results, quantity, parameter, parameters)
+
+
 @app.callback(
     [Output('dropdown_heatmap', 'options'),
      Output('dropdown_heatmap', 'value')],
@@ -920,9 +1203,8 @@ def get_dropdown_options_heatmap(results):
     If storage triggered callback, use first result row,
     if dropdown triggered callback, select this row.
     """
-
-    # Read results
-    results = df.read_data(ctx.inputs["df_result_data_store.data"])
+    if results is None:
+        raise PreventUpdate
 
     result_set = results.iloc[0]
 
@@ -944,9 +1226,8 @@ def get_dropdown_options_line_graph(results):
     If storage triggered callback, use first result row,
     if dropdown triggered callback, select this row.
     """
-
-    # Read results
-    results = df.read_data(ctx.inputs["df_result_data_store.data"])
+    if results is None:
+        raise PreventUpdate
 
     result_set = results.iloc[0]
 
@@ -966,9 +1247,6 @@ def get_dropdown_options_heatmap_2(dropdown_key, results):
     if dropdown_key is None or results is None:
         raise PreventUpdate
     else:
-        # Read results
-        results = df.read_data(ctx.inputs["df_result_data_store.data"])
-
         result_set = results.iloc[0]
         local_data = result_set["local_data"]
         if 'value' in local_data[dropdown_key]:
@@ -992,9 +1270,6 @@ def get_dropdown_options_line_graph_2(dropdown_key, results):
     if dropdown_key is None or results is None:
         raise PreventUpdate
     else:
-        # Read results
-        results = df.read_data(ctx.inputs["df_result_data_store.data"])
-
         result_set = results.iloc[0]
 
         local_data = result_set["local_data"]
@@ -1012,15 +1287,20 @@ def get_dropdown_options_line_graph_2(dropdown_key, results):
     [Input('dropdown_heatmap', 'value'),
      Input('dropdown_heatmap_2', 'value')],
     Input('df_result_data_store', 'data'),
+    Input('heatmap_graph', 'relayoutData'),
     prevent_initial_call=True
 )
-def update_heatmap_graph(dropdown_key, dropdown_key_2, results):
+def update_heatmap_graph(dropdown_key, dropdown_key_2, results,
+                         relayout_data):
+    """
+    Small data is shown as 3D surface, large data as 2D heatmap, decimated
+    to the graph resolution on the server. Zooming into the heatmap
+    re-renders the visible window at full resolution.
+    """
+    ctx_triggered = dash.callback_context.triggered[0]['prop_id']
     if dropdown_key is None or results is None:
         raise PreventUpdate
     else:
-        # Read results
-        results = df.read_data(ctx.inputs["df_result_data_store.data"])
-
         result_set = results.iloc[0]
 
         local_data = result_set["local_data"]
@@ -1041,13 +1321,29 @@ def update_heatmap_graph(dropdown_key, dropdown_key_2, results):
         if yvalues.ndim > 1:
             yvalues = yvalues[0]
 
-        n_y = len(yvalues)
         n_x = xvalues.shape[-1]
         n_z = yvalues.shape[-1]
+        # Cell index of every row
+        cells = np.arange(len(yvalues))
 
         if n_x == n_z + 1:
             xvalues = df.interpolate_1d(xvalues)
 
+        # Rendering mode by data size
+        zvalues = np.asarray(zvalues, dtype=float)
+        surface = zvalues.size <= pf.MAX_SURFACE_SIZE
+        x_range, y_range = None, None
+        if 'heatmap_graph.relayoutData' in ctx_triggered:
+            zoom = pf.zoom_ranges(relayout_data)
+            if surface or zoom is None:
+                # Camera movement or other layout change
+                raise PreventUpdate
+            x_range, y_range = zoom
+        if not surface:
+            zvalues, xvalues, yvalues, cells = pf.heatmap_window(
+                zvalues, xvalues, yvalues, x_range, y_range)
+        n_y = len(yvalues)
+
         if dropdown_key_2 is None:
             z_title = dropdown_key + ' / ' + local_data[dropdown_key]['units']
         else:
@@ -1061,8 +1357,8 @@ def update_heatmap_graph(dropdown_key, dropdown_key_2, results):
 
         base_axis_dict = \
             {'tickfont': font_props['medium'],
-             'titlefont': font_props['large'],
-             'title': x_key + ' / ' + local_data[x_key]['units'],
+             'title': {'text': x_key + ' / ' + local_data[x_key]['units'],
+                       'font': font_props['large']},
              'tickmode': 'array', 'showgrid': True}
 
         tick_division_dict = \
@@ -1097,56 +1393,84 @@ def update_heatmap_graph(dropdown_key, dropdown_key_2, results):
         # y_tick_labels[-1] = str(n_y - 1)
 
         x_axis_dict = copy.deepcopy(base_axis_dict)
-        x_axis_dict['title'] = x_key + ' / ' + local_data[x_key]['units']
-        x_axis_dict['tickvals'] = local_data[x_key]['value']
-        x_axis_dict['ticktext'] = \
-            granular_tick_division(local_data[x_key]['value'])
+        x_axis_dict['title']['text'] = \
+            x_key + ' / ' + local_data[x_key]['units']
+        x_ticks = local_data[x_key]['value']
+        if len(x_ticks) <= pf.MAX_TICK_LABELS:
+            x_axis_dict['tickvals'] = x_ticks
+            x_axis_dict['ticktext'] = granular_tick_division(x_ticks)
+        else:
+            # No per-tick arrays for large data
+            x_axis_dict['tickmode'] = 'auto'
 
         y_axis_dict = copy.deepcopy(base_axis_dict)
-        y_axis_dict['title'] = y_key + ' / ' + local_data[y_key]['units']
-        y_axis_dict['tickvals'] = yvalues
-        y_axis_dict['ticktext'] = granular_tick_division(range(n_y))
+        y_axis_dict['title']['text'] = \
+            y_key + ' / ' + local_data[y_key]['units']
+        if n_y <= pf.MAX_TICK_LABELS:
+            y_axis_dict['tickvals'] = yvalues
+            y_axis_dict['ticktext'] = granular_tick_division(
+                [int(round(cell)) for cell in cells])
+        else:
+            y_axis_dict['tickmode'] = 'auto'
 
         z_axis_dict = copy.deepcopy(base_axis_dict)
-        z_axis_dict['title'] = z_title
+        z_axis_dict['title']['text'] = z_title
         # z_axis_dict['tickvals'] = zvalues
 
-        layout = go.Layout(
-            font=font_props['large'],
-            # title='Local Results in Heat Map',
-            titlefont=font_props['large'],
-            xaxis=x_axis_dict,
-            yaxis=y_axis_dict,
-            margin={'l': 75, 'r': 20, 't': 10, 'b': 20},
-            height=height
-        )
-        scene = dict(
-            xaxis=x_axis_dict,
-            yaxis=y_axis_dict,
-            zaxis=z_axis_dict)
-
-        heatmap = \
-            go.Surface(z=zvalues, x=xvalues, y=yvalues,  # xgap=1, ygap=1,
-                       colorbar={
-                           'tickfont': font_props['large'],
-                           'title': {
-                               'text': z_title,
-                               'font': {'size': font_props['large']['size']},
-                               'side': 'right'},
-                           # 'height': height - 300
-                           'lenmode': 'fraction',
-                           'len': 0.75
-                       })
-
-        fig = go.Figure(data=heatmap, layout=layout)
-        fig.update_layout(scene=scene)
+        colorbar = {
+            'tickfont': font_props['large'],
+            'title': {
+                'text': z_title,
+                'font': {'size': font_props['large']['size']},
+                'side': 'right'},
+            # 'height': height - 300
+            'lenmode': 'fraction',
+            'len': 0.75
+        }
+
+        if surface:
+            layout = go.Layout(
+                font=font_props['large'],
+                # title='Local Results in Heat Map',
+                xaxis=x_axis_dict,
+                yaxis=y_axis_dict,
+                margin={'l': 75, 'r': 20, 't': 10, 'b': 20},
+                height=height
+            )
+            scene = dict(
+                xaxis=x_axis_dict,
+                yaxis=y_axis_dict,
+                zaxis=z_axis_dict)
+
+            heatmap = \
+                go.Surface(z=zvalues, x=xvalues, y=yvalues,  # xgap=1, ygap=1,
+                           colorbar=colorbar)
+
+            fig = go.Figure(data=heatmap, layout=layout)
+            fig.update_layout(scene=scene)
+        else:
+            # Keep the zoomed window, new data covers exactly this range
+            if x_range is not None:
+                x_axis_dict['range'] = x_range
+            if y_range is not None:
+                y_axis_dict['range'] = y_range
+            layout = go.Layout(
+                font=font_props['large'],
+                xaxis=x_axis_dict,
+                yaxis=y_axis_dict,
+                margin={'l': 75, 'r': 20, 't': 10, 'b': 20},
+                height=height
+            )
+            heatmap = go.Heatmap(z=zvalues, x=xvalues, y=yvalues,
+                                 colorbar=colorbar)
+            fig = go.Figure(data=heatmap, layout=layout)
 
     return fig
 
 
 @app.callback(
     [Output('line_graph', 'figure'),
-     Output('cells_data', 'data'),
+     ServersideOutput('cells_data', 'data'),
      Output('data_checklist', 'options'),
      Output('data_checklist', 'value')],
     [Input('dropdown_line', 'value'),
@@ -1154,19 +1478,23 @@ def update_heatmap_graph(dropdown_key, dropdown_key_2, results):
      Input('data_checklist', 'value'),
      Input('select_all_button', 'n_clicks'),
      Input('clear_all_button', 'n_clicks'),
-     Input('line_graph', 'restyleData')],
+     Input('line_graph', 'restyleData'),
+     Input('line_graph', 'relayoutData')],
     Input('df_result_data_store', 'data'),
     prevent_initial_call=True
 )
 def update_line_graph(drop1, drop2, checklist, select_all_clicks,
-                      clear_all_clicks, restyle_data, results):
+                      clear_all_clicks, restyle_data, relayout_data,
+                      results):
+    """
+    WebGL lines, each downsampled (LTTB) to at most
+    pf.MAX_LINE_POINTS points. Zooming re-renders the visible x window, in
+    full detail if it fits.
+    """
     ctx_triggered = dash.callback_context.triggered[0]['prop_id']
     if drop1 is None or results is None:
         raise PreventUpdate
     else:
-        # Read results
-        results = df.read_data(ctx.inputs["df_result_data_store.data"])
-
         result_set = results.iloc[0]
 
         local_data = result_set["local_data"]
@@ -1192,16 +1520,28 @@ def update_line_graph(drop1, drop2, checklist, select_all_clicks,
         else:
             y_scale = 'linear'
 
+        # Zoomed x window (kept for changes of the cell selection)
+        x_range, y_range = None, None
+        if 'line_graph.relayoutData' in ctx_triggered:
+            if pf.zoom_ranges(relayout_data) is None:
+                raise PreventUpdate
+        if 'dropdown_line' not in ctx_triggered \
+                and 'df_result_data_store' not in ctx_triggered:
+            x_range, y_range = pf.zoom_ranges(relayout_data) or (None, None)
+
         layout = go.Layout(
             font={'color': 'black', 'family': 'Arial'},
             # title='Local Results in Heat Map',
-            titlefont={'size': 11, 'color': 'black'},
-            xaxis={'tickfont': {'size': 11}, 'titlefont': {'size': 14},
-                   'title': x_title},
-            yaxis={'tickfont': {'size': 11}, 'titlefont': {'size': 14},
-                   'title': y_title},
+            xaxis={'tickfont': {'size': 11},
+                   'title': {'text': x_title, 'font': {'size': 14}}},
+            yaxis={'tickfont': {'size': 11},
+                   'title': {'text': y_title, 'font': {'size': 14}}},
             margin={'l': 100, 'r': 20, 't': 20, 'b': 20},
             yaxis_type=y_scale)
+        if x_range is not None:
+            layout.xaxis.range = x_range
+        if y_range is not None:
+            layout.yaxis.range = y_range
 
         fig.update_layout(layout)
 
@@ -1224,31 +1564,44 @@ def update_line_graph(drop1, drop2, checklist, select_all_clicks,
             xvalues = xvalues[0]
 
         if yvalues.ndim == 1:
-            yvalues = [yvalues]
+            yvalues = yvalues[np.newaxis, :]
+        if x_range is not None:
+            x_window = pf.window(xvalues, x_range)
+            xvalues = xvalues[x_window]
+            yvalues = yvalues[:, x_window]
+        n_out = max(min(pf.MAX_LINE_POINTS,
+                        pf.MAX_TOTAL_LINE_POINTS // len(yvalues)), 3)
+        mode = 'lines+markers' if len(xvalues) <= n_out else 'lines'
         cells = {}
         for num, yval in enumerate(yvalues):
-            fig.add_trace(go.Scatter(x=xvalues, y=yval,
-                                     mode='lines+markers',
-                                     name='Cell {}'.format(num)))
-            cells[num] = {'name': 'Cell {}'.format(num), 'data': yval}
+            x_line, y_line = pf.lttb(xvalues, yval, n_out)
+            fig.add_trace(go.Scattergl(x=x_line, y=y_line,
+                                       mode=mode,
+                                       name='Cell {}'.format(num)))
+            cells[num] = {'name': 'Cell {}'.format(num)}
+        n_cells = len(cells)
+        # Reference to the shown data only, the values are in the figure
+        cells_data = {'variable': drop1, 'variable_2': drop2,
+                      'cells': [cells[k]['name'] for k in cells]}
 
         options = [{'label': cells[k]['name'], 'value': cells[k]['name']}
                    for k in cells]
-        value = ['Cell {}'.format(str(i)) for i in range(n_y)]
+        value = ['Cell {}'.format(str(i)) for i in range(n_cells)]
 
         if checklist is None:
-            return fig, cells, options, value
+            return fig, cells_data, options, value
         else:
             if 'clear_all_button.n_clicks' in ctx_triggered:
                 fig.for_each_trace(
                     lambda trace: trace.update(visible='legendonly'))
-                return fig, cells, options, []
-            elif 'data_checklist.value' in ctx_triggered:
+                return fig, cells_data, options, []
+            elif 'data_checklist.value' in ctx_triggered \
+                    or 'line_graph.relayoutData' in ctx_triggered:
                 fig.for_each_trace(
                     lambda trace: trace.update(
                         visible=True) if trace.name in checklist
                     else trace.update(visible='legendonly'))
-                return fig, cells, options, checklist
+                return fig, cells_data, options, checklist
             elif 'line_graph.restyleData' in ctx_triggered:
                 read = restyle_data[0]['visible']
                 if len(read) == 1:
@@ -1260,30 +1613,29 @@ def update_line_graph(drop1, drop2, checklist, select_all_clicks,
                             checklist.remove(cell_name)
                     value = [val for val in value if val in checklist]
                 else:
-                    value = [value[i] for i in range(n_y)
+                    value = [value[i] for i in range(n_cells)
                              if read[i] is True]
                 fig.for_each_trace(
                     lambda trace: trace.update(
                         visible=True) if trace.name in value
                     else trace.update(visible='legendonly'))
                 # fig.plotly_restyle(restyle_data[0])
-                return fig, cells, options, value
+                return fig, cells_data, options, value
             else:
-                return fig, cells, options, value
+                return fig, cells_data, options, value
 
 
-@app.callback(
+# Form rules run clientside (assets/form_rules.js), without round trip
+app.clientside_callback(
+    ClientsideFunction(namespace='form', function_name='disabled'),
     Output({'type': ALL, 'id': ALL, 'specifier': 'disable_basewidth'},
            'disabled'),
     Input({'type': ALL, 'id': ALL, 'specifier': 'dropdown_activate_basewidth'},
-          'value'))
-def disabled_callback(value):
-    for num, val in enumerate(value):
-        if val == "trapezoidal":
-            value[num] = False
-        else:
-            value[num] = True
-    return value
+          'value'),
+    State({'type': ALL, 'id': ALL, 'specifier': 'dropdown_activate_basewidth'},
+          'id'),
+    State({'type': ALL, 'id': ALL, 'specifier': 'disable_basewidth'}, 'id'),
+    State('form_rules', 'data'))
 
 
 # @app.callback(
@@ -1337,36 +1689,16 @@ def disabled_callback(value):
 #     return list_state
 
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='form', function_name='visibility'),
     Output({'type': 'container', 'id': ALL, 'specifier': 'visibility'},
            'style'),
     Input({'type': 'input', 'id': ALL, 'specifier': 'dropdown_activate'},
           'value'),
     State({'type': 'input', 'id': ALL, 'specifier': 'dropdown_activate'},
-          'options')
-)
-def visibility(inputs, options):
-    list_options = []
-    for opt in options:
-        list_options.extend([inside['value'] for inside in opt])
-        # [[opt1, opt2],[opt3, opt4, opt5]] turns into
-        # [opt1, opt2, opt3, opt4, opt5]
-
-    for inp in inputs:
-        #  Eliminate/replace chosen value with 'chose' for later
-        list_options = \
-            list(map(lambda item: item.replace(inp, 'chosen'),
-                     list_options))
-
-    for num, lst in enumerate(list_options):
-        if lst == 'chosen':
-            # style = None / CSS revert to initial; {display:initial}
-            list_options[num] = None
-        else:
-            # CSS for hiding div
-            list_options[num] = {'display': 'none'}
-
-    return list_options
+          'id'),
+    State({'type': 'container', 'id': ALL, 'specifier': 'visibility'}, 'id'),
+    State('form_rules', 'data'))
 
 
 if __name__ == "__main__":
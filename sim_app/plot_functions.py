@@ -0,0 +1,360 @@
+"""
+Plot functions for large result sets.
+
+Figures are aggregated or decimated on the server, so the amount of data
+sent to the browser does not grow with the number of study runs. Large
+traces use WebGL (Scattergl, Splom).
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from sim_app import dash_functions as df
+
+# Maximum number of markers per trace sent to the browser
+MAX_POINTS = 5000
+# Number of x intervals of aggregated sweep plots
+N_BINS = 500
+# Dropdown value of the pairwise scatter plot (all varied parameters)
+PAIRWISE = '__pairwise__'
+
+LAYOUT = dict(
+    font={'color': 'black', 'family': 'Arial'},
+    margin={'l': 100, 'r': 20, 't': 20, 'b': 20})
+
+
+def study_parameters(results: pd.DataFrame, extra_columns=()) -> list:
+    """
+    Names of the varied study parameters, which are numeric (list
+    parameters are split into one feature per element, see
+    df.numeric_features). 'extra_columns' are added if they vary, e.g. the
+    current density of polarization curves.
+    """
+    columns = list(dict.fromkeys(
+        par for pars in results["variation_parameter"].dropna().unique()
+        for par in str(pars).split(',') if par in results.columns))
+    columns += [col for col in extra_columns
+                if col in results.columns and col not in columns]
+    features = df.numeric_features(results.loc[:, columns])
+    return [name for name in features.columns
+            if features[name].nunique() > 1]
+
+
+def _study_data(results: pd.DataFrame, parameters: list) \
+        -> (pd.DataFrame, dict):
+    """
+    Numeric parameter features and flat global results of all successful
+    runs
+    """
+    results = results.loc[results["successful_run"].astype(bool), :]
+    columns = [col for col in results.columns if col in parameters
+               or any(par.startswith(f'{col}_') for par in parameters)]
+    features = df.numeric_features(results.loc[:, columns])
+    global_table, units = df.global_results(results)
+    data = features.loc[:, [par for par in parameters
+                            if par in features.columns]].join(global_table)
+    data["variation_parameter"] = results["variation_parameter"]
+    return data, units
+
+
+def aggregate(x, y, n_bins=N_BINS) -> pd.DataFrame:
+    """
+    Minimum, mean and maximum of y per value of x. If x has more than
+    n_bins unique values, x is divided into n_bins equal intervals
+    (represented by their centers).
+    """
+    data = pd.DataFrame({'x': np.asarray(x, dtype=float),
+                         'y': np.asarray(y, dtype=float)}).dropna()
+    if data['x'].nunique() > n_bins:
+        edges = np.linspace(data['x'].min(), data['x'].max(), n_bins + 1)
+        centers = (edges[:-1] + edges[1:]) * .5
+        idx = np.clip(np.digitize(data['x'], edges) - 1, 0, n_bins - 1)
+        data['x'] = centers[idx]
+    return data.groupby('x')['y'].agg(['min', 'mean', 'max', 'count'])
+
+
+def sweep_figure(results: pd.DataFrame, quantity: str, parameter: str,
+                 parameters: list) -> go.Figure:
+    """
+    Global 'quantity' versus the varied 'parameter'. In single variation
+    studies only runs varying this parameter are shown.
+    Up to MAX_POINTS runs are plotted as markers, larger studies as
+    min/max band and mean line per parameter value.
+    """
+    data, units = _study_data(results, parameters)
+    column = parameter if parameter in results.columns \
+        else parameter.rsplit('_', 1)[0]
+    varied = data["variation_parameter"].apply(
+        lambda pars: column in str(pars).split(',')).astype(bool)
+    if varied.any():
+        data = data.loc[varied, :]
+    data = data.loc[:, [parameter, quantity]].dropna()
+    stats = aggregate(data[parameter], data[quantity])
+
+    fig = go.Figure()
+    if len(data) <= MAX_POINTS:
+        fig.add_trace(go.Scattergl(
+            x=data[parameter], y=data[quantity], mode='markers',
+            marker={'size': 6}, name='Runs'))
+    else:
+        fig.add_trace(go.Scattergl(
+            x=stats.index, y=stats['max'], mode='lines',
+            line={'width': 0}, showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scattergl(
+            x=stats.index, y=stats['min'], mode='lines',
+            line={'width': 0}, fill='tonexty', name='Min - Max'))
+    fig.add_trace(go.Scattergl(
+        x=stats.index, y=stats['mean'], mode='lines', name='Mean',
+        customdata=stats['count'],
+        hovertemplate='%{x}: %{y:.4g} (%{customdata} runs)'))
+
+    fig.update_layout(
+        xaxis={'tickfont': {'size': 11},
+               'title': {'text': parameter, 'font': {'size': 14}}},
+        yaxis={'tickfont': {'size': 11},
+               'title': {'text': f"{quantity} / {units.get(quantity, '-')}",
+                         'font': {'size': 14}}},
+        **LAYOUT)
+    return fig
+
+
+def pairwise_figure(results: pd.DataFrame, quantity: str,
+                    parameters: list) -> go.Figure:
+    """
+    Pairwise scatter plot (WebGL scatter matrix) of all varied parameters
+    and the global 'quantity', e.g. for full factorial studies.
+    Studies with more than MAX_POINTS runs are shown by a random sample.
+    """
+    data, units = _study_data(results, parameters)
+    dimensions = [par for par in parameters if par in data.columns]
+    data = data.loc[:, dimensions + [quantity]].dropna()
+    if len(data) > MAX_POINTS:
+        data = data.sample(MAX_POINTS, random_state=0)
+
+    label = f"{quantity} / {units.get(quantity, '-')}"
+    fig = go.Figure(go.Splom(
+        dimensions=[{'label': par, 'values': data[par]}
+                    for par in dimensions]
+        + [{'label': label, 'values': data[quantity]}],
+        marker={'size': 4, 'color': data[quantity],
+                'colorscale': 'Jet', 'showscale': True},
+        diagonal_visible=False, showupperhalf=False))
+    fig.update_layout(height=max(400, 150 * (len(dimensions) + 1)),
+                      **LAYOUT)
+    return fig
+
+
+# Heatmaps of local results
+# --------------------------------------
+# Largest surface plot (number of values), larger data is shown as
+# 2D heatmap
+MAX_SURFACE_SIZE = 20000
+# Resolution (rows, columns) of 2D heatmaps sent to the browser, a few
+# pixels per value at the size of the graph
+HEATMAP_RESOLUTION = (120, 300)
+# Axes with more values get automatic ticks instead of tick label arrays
+MAX_TICK_LABELS = 50
+
+
+def zoom_ranges(relayout_data) -> (list, list):
+    """
+    Visible x and y range from relayoutData of a 2D graph, None for an
+    axis showing its full range. Returns None, if relayout_data is no
+    zoom event.
+    """
+    if not relayout_data:
+        return None
+    ranges = []
+    for axis in ('xaxis', 'yaxis'):
+        if f'{axis}.range[0]' in relayout_data:
+            ranges.append(sorted([relayout_data[f'{axis}.range[0]'],
+                                  relayout_data[f'{axis}.range[1]']]))
+        elif f'{axis}.range' in relayout_data:
+            ranges.append(sorted(relayout_data[f'{axis}.range']))
+        else:
+            ranges.append(None)
+    autorange = any(key.endswith('autorange') for key in relayout_data)
+    if ranges == [None, None] and not autorange:
+        return None
+    return ranges
+
+
+def window(values, value_range=None) -> slice:
+    """
+    Index slice of 'values' (ascending) covering 'value_range' plus one
+    value on each side
+    """
+    if value_range is None:
+        return slice(None)
+    values = np.asarray(values, dtype=float)
+    inside = np.nonzero((values >= value_range[0])
+                        & (values <= value_range[1]))[0]
+    if not len(inside):
+        # Zoomed in between two values
+        center = np.searchsorted(values, np.mean(value_range))
+        return slice(max(center - 1, 0), center + 1)
+    return slice(max(inside[0] - 1, 0), inside[-1] + 2)
+
+
+def _block_starts(n, n_blocks):
+    return np.unique(np.linspace(0, n, min(n, n_blocks) + 1)[:-1]
+                     .astype(int))
+
+
+def block_means(values, n_blocks) -> np.ndarray:
+    """
+    Means of 'values' in at most n_blocks consecutive blocks (the blocks of
+    decimate_2d)
+    """
+    values = np.asarray(values, dtype=float)
+    starts = _block_starts(len(values), n_blocks)
+    return np.add.reduceat(values, starts) \
+        / np.diff(np.append(starts, len(values)))
+
+
+def decimate_2d(z, x, y, resolution=HEATMAP_RESOLUTION) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Reduce z (len(y) rows, len(x) columns) to at most 'resolution' blocks.
+    Every block is represented by its most extreme value (block minimum or
+    maximum, whichever deviates more from the block mean), so local peaks
+    stay visible; x and y are the mean coordinates of the blocks.
+    """
+    z = np.asarray(z, dtype=float)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    rows = _block_starts(z.shape[0], resolution[0])
+    cols = _block_starts(z.shape[1], resolution[1])
+    if len(rows) == z.shape[0] and len(cols) == z.shape[1]:
+        return z, x, y
+
+    def reduce(ufunc, array):
+        return ufunc.reduceat(ufunc.reduceat(array, rows, axis=0),
+                              cols, axis=1)
+
+    finite = np.isfinite(z)
+    count = reduce(np.add, finite.astype(float))
+    with np.errstate(invalid='ignore'):
+        mean = reduce(np.add, np.where(finite, z, 0.)) / count
+    z_max = reduce(np.fmax, z)
+    z_min = reduce(np.fmin, z)
+    z_red = np.where(z_max - mean >= mean - z_min, z_max, z_min)
+
+    return z_red, block_means(x, resolution[1]), block_means(y, resolution[0])
+
+
+def heatmap_window(z, x, y, x_range=None, y_range=None,
+                   resolution=HEATMAP_RESOLUTION) \
+        -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """
+    Visible window (see window) of z (len(y) rows, len(x) columns),
+    decimated to 'resolution' (see decimate_2d). Returns z, x, y and the
+    row indices of the full data (mean index of decimated rows), e.g. for
+    the tick labels of the rows.
+    """
+    z = np.asarray(z, dtype=float)
+    x_window = window(x, x_range)
+    y_window = window(y, y_range)
+    rows = np.arange(z.shape[0])[y_window]
+    z, x, y = decimate_2d(z[y_window, x_window], np.asarray(x)[x_window],
+                          np.asarray(y)[y_window], resolution=resolution)
+    return z, x, y, block_means(rows, resolution[0])
+
+
+# Line graphs of local results
+# --------------------------------------
+# Maximum number of points per line and for all lines of a graph together
+MAX_LINE_POINTS = 1000
+MAX_TOTAL_LINE_POINTS = 100000
+
+
+def lttb(x, y, n_out=MAX_LINE_POINTS) -> (np.ndarray, np.ndarray):
+    """
+    Largest-Triangle-Three-Buckets downsampling (Steinarsson, 2013) of a
+    line to n_out points. Keeps first and last point and from every bucket
+    the point spanning the largest triangle with its neighbours, which
+    preserves the visual shape including local extremes.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return x, y
+    # n_out - 2 buckets for the inner points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            following = slice(edges[i + 1], edges[i + 2])
+        else:
+            following = slice(n - 1, n)
+        with warnings.catch_warnings():
+            # All-NaN bucket: no point is preferred
+            warnings.simplefilter('ignore', RuntimeWarning)
+            x_avg = np.nanmean(x[following])
+            y_avg = np.nanmean(y[following])
+        area = np.abs((x[a] - x_avg) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (y_avg - y[a]))
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.)))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+# Sensitivity studies
+# --------------------------------------
+# Dropdown value of the tornado chart and prefix of local fields (per cell
+# sensitivities) in the study plot dropdowns
+TORNADO = '__tornado__'
+LOCAL_PREFIX = 'local: '
+
+
+def tornado_figure(sensitivity: pd.DataFrame, lower: pd.DataFrame,
+                   upper: pd.DataFrame, quantity: str) -> go.Figure:
+    """
+    Relative change of 'quantity' at the lower and upper value of every
+    parameter (see study_functions.sensitivities), ranked by the absolute
+    normalized sensitivity, largest on top
+    """
+    order = sensitivity[quantity].abs().sort_values(
+        na_position='first').index
+    fig = go.Figure()
+    for name, change in (('Lower value', lower), ('Upper value', upper)):
+        fig.add_trace(go.Bar(
+            y=order, x=change.loc[order, quantity] * 100, orientation='h',
+            name=name, customdata=sensitivity.loc[order, quantity],
+            hovertemplate='%{y}: %{x:.3g} % '
+                          '(normalized sensitivity %{customdata:.3g})'))
+    fig.update_layout(
+        barmode='overlay', height=max(400, 30 * len(order) + 100),
+        xaxis={'tickfont': {'size': 11},
+               'title': {'text': f'Change of {quantity} / %',
+                         'font': {'size': 14}}},
+        yaxis={'tickfont': {'size': 11}, 'automargin': True},
+        **LAYOUT)
+    return fig
+
+
+def cell_sensitivity_figure(sensitivity: pd.DataFrame, field: str) \
+        -> go.Figure:
+    """
+    Normalized sensitivities of the per cell mean of a local field
+    (one row per parameter, one column per cell)
+    """
+    fig = go.Figure(go.Heatmap(
+        z=sensitivity.to_numpy(), x=list(sensitivity.columns),
+        y=list(sensitivity.index), colorscale='RdBu', zmid=0,
+        colorbar={'title': {'text': 'Normalized<br>sensitivity'}},
+        hovertemplate='%{y}, %{x}: %{z:.3g}<extra></extra>'))
+    fig.update_layout(
+        height=max(400, 30 * len(sensitivity) + 100),
+        xaxis={'tickfont': {'size': 11},
+               'title': {'text': f'{field} (mean per cell)',
+                         'font': {'size': 14}}},
+        yaxis={'tickfont': {'size': 11}, 'automargin': True},
+        **LAYOUT)
+    return fig
@@ -0,0 +1,211 @@
+"""
+Persistent results warehouse shared by all sessions (SQLite, no external
+service).
+
+Every successful run is stored once by its settings hash:
+- table "runs": one row per run, global quantities as float columns
+  ("global: <quantity>", added when a new quantity appears), global and
+  local result data as pickled blob
+- table "parameters": input parameter values per run, indexed by
+  parameter name and value for queries over parameter ranges
+- table "quantities": units of the global quantities
+
+Used as result store in run_simulation (see
+dash_functions.SessionResultStore), so runs simulated by anyone before are
+not simulated again.
+"""
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from sim_app.dash_functions import GLOBAL_PREFIX, global_column, \
+    numeric_features
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    settings_hash TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    result BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS parameters (
+    settings_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value,
+    PRIMARY KEY (settings_hash, name));
+CREATE INDEX IF NOT EXISTS parameters_name_value
+    ON parameters (name, value);
+CREATE TABLE IF NOT EXISTS quantities (
+    name TEXT PRIMARY KEY,
+    units TEXT);
+"""
+# Maximum number of host parameters of a single sqlite statement
+MAX_VARIABLES = 900
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ResultWarehouse:
+    """
+    :param path: sqlite database file, shared by all worker processes
+    :param timeout: seconds to wait for locks of concurrent writers
+    """
+
+    def __init__(self, path, timeout=30.):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self.connection() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.executescript(SCHEMA)
+
+    def __getstate__(self):
+        # Connections are opened per thread (and process)
+        return {'path': self.path, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread (sqlite connections must not be
+        shared between threads), use as context manager for transactions
+        """
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=self.timeout)
+            self._local.connection = con
+        return con
+
+    def _global_columns(self, con) -> set:
+        return {row[1] for row in con.execute('PRAGMA table_info(runs)')
+                if row[1].startswith(GLOBAL_PREFIX)}
+
+    # Result store interface (run_simulation)
+    # --------------------------------------
+    def lookup(self, hashes) -> dict:
+        hashes = list(hashes)
+        found = {}
+        con = self.connection()
+        for i in range(0, len(hashes), MAX_VARIABLES):
+            chunk = hashes[i:i + MAX_VARIABLES]
+            rows = con.execute(
+                f'SELECT settings_hash, result FROM runs WHERE settings_hash '
+                f'IN ({",".join("?" * len(chunk))})', chunk)
+            for settings_hash, result in rows:
+                global_data, local_data = pickle.loads(result)
+                found[settings_hash] = (global_data, local_data, None)
+        return found
+
+    def record(self, results: dict):
+        """
+        Store results {settings hash: (global_data, local_data, ...)},
+        runs already stored are kept
+        """
+        if not results:
+            return
+        rows = []
+        units = {}
+        for settings_hash, result in results.items():
+            global_values = result[0][0] if result[0] else {}
+            units.update({k: v.get('units') for k, v in global_values.items()})
+            rows.append((settings_hash,
+                         {global_column(k): v.get('value')
+                          for k, v in global_values.items()},
+                         pickle.dumps((result[0], result[1]))))
+        with self.connection() as con:
+            # Write lock before reading the columns, other processes might
+            # add the same quantity
+            con.execute('BEGIN IMMEDIATE')
+            existing = self._global_columns(con)
+            for name in units:
+                if global_column(name) not in existing:
+                    con.execute(f'ALTER TABLE runs ADD COLUMN '
+                                f'{_quote(global_column(name))} REAL')
+                    existing.add(global_column(name))
+            con.executemany(
+                'INSERT OR IGNORE INTO quantities (name, units) VALUES (?, ?)',
+                units.items())
+            now = time.time()
+            for settings_hash, values, blob in rows:
+                columns = ['settings_hash', 'created', 'result'] + list(values)
+                con.execute(
+                    f'INSERT OR IGNORE INTO runs '
+                    f'({",".join(_quote(c) for c in columns)}) '
+                    f'VALUES ({",".join("?" * len(columns))})',
+                    [settings_hash, now, blob]
+                    + [_float(v) for v in values.values()])
+
+    # Parameter index and queries
+    # --------------------------------------
+    def index_parameters(self, results: pd.DataFrame, input_cols):
+        """
+        Store the input parameter values of the successful runs of a result
+        table (columns "settings_hash" and 'input_cols'). Numeric lists are
+        split into one parameter per element (see df.numeric_features),
+        other values are stored as json.
+        """
+        results = results.loc[results["successful_run"].astype(bool), :]
+        if results.empty:
+            return
+        inputs = results.loc[:, list(input_cols)]
+        features = numeric_features(inputs)
+        other = [name for name in inputs.columns
+                 if name not in features.columns
+                 and f'{name}_0' not in features.columns]
+        rows = []
+        for pos, settings_hash in enumerate(results["settings_hash"]):
+            rows += [(settings_hash, name, float(features[name].iloc[pos]))
+                     for name in features.columns]
+            rows += [(settings_hash, name,
+                      json.dumps(inputs[name].iloc[pos], default=str))
+                     for name in other]
+        with self.connection() as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO parameters (settings_hash, name, '
+                'value) VALUES (?, ?, ?)', rows)
+
+    def query(self, ranges: dict = None) -> (pd.DataFrame, dict):
+        """
+        Parameters and global results of all stored runs with parameters
+        inside 'ranges' {parameter name: (lower, upper)}.
+        Returns a table (index settings hash, one column per parameter and
+        per global quantity, see df.global_column) and the units.
+        """
+        ranges = ranges or {}
+        condition = ' AND '.join(
+            'settings_hash IN (SELECT settings_hash FROM parameters '
+            'WHERE name = ? AND value BETWEEN ? AND ?)' for _ in ranges)
+        args = [arg for name, (lower, upper) in ranges.items()
+                for arg in (name, lower, upper)]
+        con = self.connection()
+        columns = sorted(self._global_columns(con))
+        table = pd.read_sql_query(
+            f'SELECT {",".join(_quote(c) for c in ["settings_hash"] + columns)}'
+            f' FROM runs' + (f' WHERE {condition}' if condition else ''),
+            con, params=args, index_col='settings_hash')
+        if not table.empty:
+            hashes = table.index.to_list()
+            parameters = pd.concat([pd.read_sql_query(
+                f'SELECT settings_hash, name, value FROM parameters WHERE '
+                f'settings_hash IN ({",".join("?" * len(chunk))})',
+                con, params=chunk)
+                for chunk in (hashes[i:i + MAX_VARIABLES]
+                              for i in range(0, len(hashes), MAX_VARIABLES))])
+            parameters = parameters.pivot(
+                index='settings_hash', columns='name', values='value')
+            table = parameters.join(table, how='right')
+        units = dict(con.execute('SELECT name, units FROM quantities'))
+        return table, units
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
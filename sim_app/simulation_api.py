@@ -1,8 +1,33 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def run_external_simulation(settings):
+from sim_app import config
+
+# Native batch backend: callable(settings_list, initial_states) yielding
+# (position, result) tuples as the runs complete, like
+# run_external_simulation_batch. Backends which can amortize setup costs or
+# vectorize across cases register themselves here; if None, the runs are
+# single calls of run_external_simulation.
+batch_backend = None
+
+_pool = None
+_pool_size = None
+_pool_lock = threading.Lock()
+
+
+def run_external_simulation(settings, initial_state=None):
     """
     Dummy simulation call to external simulation api returning random data,
     however in a compatible format
+
+    settings: complete settings dict (a copy per run, see
+        dash_functions.transfer_settings)
+    initial_state: optional converged solver state of a similar case
+        (e.g. the neighbouring point of a polarization curve) used as
+        initial guess; backends return their converged state as
+        additional_data['solver_state']
     """
     global_results = \
         [{'Stack Voltage': {'value': 4.09, 'units': 'V'},
@@ -20,5 +45,97 @@ def run_external_simulation(settings):
                        [24532.59, 23422.90, 23175.77, 22490.50, 21413.87],
                        [24634.67, 23344.17, 23145.89, 22505.89, 21440.97]],
              'units': 'A/m²', 'xkey': 'Channel Location'}}]
-    additional_data = None
+    additional_data = \
+        {'solver_state': local_data[0]['Current Density']['value']}
     return global_results, local_data, additional_data
+
+
+def _run_single(settings, initial_state=None):
+    try:
+        return run_external_simulation(settings, initial_state=initial_state)
+    except Exception as E:
+        return repr(E)
+
+
+def process_pool(max_workers=None) -> ProcessPoolExecutor:
+    """
+    Long-lived pool of local simulation processes, shared by all batches
+    and threads of this process (created on first use, replaced if another
+    size is requested). Processes are started by a fork server (spawned on
+    Windows), as forking the threaded server workers could deadlock on
+    locks held by other threads.
+
+    max_workers: number of processes (None: all cores)
+    """
+    global _pool, _pool_size
+    max_workers = max_workers or os.cpu_count() or 1
+    with _pool_lock:
+        # Replaced as well if a process died (broken pool)
+        if _pool is None or _pool_size != max_workers \
+                or getattr(_pool, '_broken', False):
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            method = 'forkserver' \
+                if 'forkserver' in multiprocessing.get_all_start_methods() \
+                else 'spawn'
+            _pool = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context(method))
+            _pool_size = max_workers
+        return _pool
+
+
+def _run_native_batch(settings_list, initial_states):
+    """
+    Runs of batch_backend; if it fails, the runs without result fail with
+    its exception
+    """
+    pending = set(range(len(settings_list)))
+    try:
+        for pos, result in batch_backend(settings_list, initial_states):
+            pending.discard(pos)
+            yield pos, result
+    except Exception as E:
+        for pos in sorted(pending):
+            yield pos, repr(E)
+
+
+def run_external_simulation_batch(settings_list, initial_states=None,
+                                  max_workers=1):
+    """
+    Batch call to external simulation api.
+    Takes a list or iterator of settings dicts and yields tuples
+    (position, result) as the runs complete, result being the return value
+    of run_external_simulation or the repr of the raised exception.
+    initial_states: optional list of solver states (or None) per settings,
+    passed to run_external_simulation as initial guess.
+
+    The runs are passed to the native batch_backend, if one is registered.
+    Otherwise, if config.SIMULATION_API_URL is set, all runs are submitted
+    concurrently to the remote simulation service. By default it falls back
+    to single calls of run_external_simulation, sequentially or in
+    max_workers processes (see process_pool).
+    """
+    settings_list = list(settings_list)
+    if initial_states is None:
+        initial_states = [None] * len(settings_list)
+    if batch_backend is not None:
+        yield from _run_native_batch(settings_list, initial_states)
+    elif config.SIMULATION_API_URL:
+        from sim_app.simulation_client import run_remote_simulation_batch
+        yield from run_remote_simulation_batch(
+            settings_list, config.SIMULATION_API_URL,
+            initial_states=initial_states,
+            max_connections=config.SIMULATION_API_MAX_CONNECTIONS,
+            timeout=config.SIMULATION_API_TIMEOUT,
+            retries=config.SIMULATION_API_RETRIES)
+    elif max_workers is None or max_workers > 1:
+        executor = process_pool(max_workers)
+        futures = {executor.submit(_run_single, settings, state): pos
+                   for pos, (settings, state)
+                   in enumerate(zip(settings_list, initial_states))}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    else:
+        for pos, (settings, state) in \
+                enumerate(zip(settings_list, initial_states)):
+            yield pos, _run_single(settings, state)
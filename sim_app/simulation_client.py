@@ -0,0 +1,157 @@
+"""
+Asyncio client for remote simulation services.
+
+The solver is expected to accept HTTP POST requests with the json body
+{"settings": settings} (plus "initial_state" for warm starts) and to
+answer with
+{"global_data": [...], "local_data": [...], "additional_data": ...},
+i.e. the json version of the tuple returned by
+simulation_api.run_external_simulation.
+
+Connections are kept alive in a pool and reused for subsequent requests;
+a semaphore bounds the number of requests in flight, so a batch of several
+hundred runs keeps the solver cluster busy without flooding it.
+"""
+import asyncio
+import json
+import queue
+import random
+import threading
+
+import aiohttp
+
+# HTTP status codes worth retrying (overload or temporary unavailability)
+RETRY_STATUS = {429, 502, 503, 504}
+
+
+class RemoteSimulationError(Exception):
+    pass
+
+
+class AsyncSimulationClient:
+    """
+    :param url: Endpoint of the remote simulation service
+    :param max_connections: Size of the keep-alive connection pool
+    :param max_concurrency: Maximum number of requests in flight,
+        defaults to max_connections
+    :param timeout: Timeout of a single call in seconds
+    :param retries: Number of retries after failed calls
+    :param backoff: Base delay in seconds of the exponential backoff
+    """
+
+    def __init__(self, url, max_connections=32, max_concurrency=None,
+                 timeout=600., retries=3, backoff=0.5):
+        self.url = url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency or max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                         keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              json_serialize=json.dumps)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    async def _post(self, settings, initial_state=None):
+        body = {'settings': settings}
+        if initial_state is not None:
+            body['initial_state'] = initial_state
+        async with self._session.post(self.url, json=body,
+                                      timeout=self.timeout) as response:
+            if response.status in RETRY_STATUS:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history,
+                    status=response.status, message=response.reason)
+            if response.status != 200:
+                raise RemoteSimulationError(
+                    f'Simulation service returned {response.status}: '
+                    f'{await response.text()}')
+            data = await response.json()
+        return data['global_data'], data['local_data'], \
+            data.get('additional_data')
+
+    async def simulate(self, settings, initial_state=None):
+        """
+        Single simulation call with retries and exponential backoff,
+        returns the result tuple of run_external_simulation
+        """
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._post(settings, initial_state)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt == self.retries:
+                        raise
+                delay = self.backoff * 2 ** attempt
+                await asyncio.sleep(delay * (0.5 + random.random()))
+
+    async def simulate_many(self, settings_list, initial_states=None):
+        """
+        Submit all settings at once and yield (position, result) as the
+        calls complete. Failed calls yield the repr of the exception, as
+        simulation_api.run_external_simulation_batch does.
+        """
+        async def run(pos, settings, initial_state):
+            try:
+                return pos, await self.simulate(settings, initial_state)
+            except Exception as E:
+                return pos, repr(E)
+
+        settings_list = list(settings_list)
+        if initial_states is None:
+            initial_states = [None] * len(settings_list)
+        tasks = [asyncio.ensure_future(run(pos, settings, state))
+                 for pos, (settings, state)
+                 in enumerate(zip(settings_list, initial_states))]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_DONE = object()
+
+
+def run_remote_simulation_batch(settings_list, url, initial_states=None,
+                                **kwargs):
+    """
+    Synchronous generator around AsyncSimulationClient.simulate_many for the
+    (synchronous) Dash callbacks. The event loop runs in a separate thread,
+    results are yielded as (position, result) while they arrive.
+    """
+    results = queue.Queue()
+
+    async def main():
+        async with AsyncSimulationClient(url, **kwargs) as client:
+            async for item in client.simulate_many(settings_list,
+                                                   initial_states):
+                results.put(item)
+
+    def worker():
+        try:
+            asyncio.run(main())
+        except BaseException as E:
+            results.put(E)
+        finally:
+            results.put(_DONE)
+
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = results.get()
+        if item is _DONE:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
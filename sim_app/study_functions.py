@@ -1,9 +1,193 @@
+import pickle
+import threading
+from functools import partial
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-import data_transfer
 
-from sim_app.main import create_settings
-# from main import create_settings
+from sim_app import config
+from sim_app import dash_functions as df
+from sim_app import simulation_api as sim_api
+from sim_app.dash_functions import create_settings, fingerprint, thaw, \
+    transfer_settings
+
+CURRENT_DENSITY = "simulation-current_density"
+# Global result used for the refinement of polarization curves
+STACK_VOLTAGE = "Stack Voltage"
+# Polarization curves: bisection for the maximum current density
+# (probes per round, rounds) and number of refinement steps
+N_PROBES = 4
+N_ROUNDS = 3
+N_REFINEMENTS = 15
+
+
+class SolutionCache:
+    """
+    Memory-bounded LRU cache of converged solver states along polarization
+    curves, used as initial guess (warm start) for neighbouring points.
+    Entries are keyed by curve key and current density, the size of a state
+    is estimated by its pickled size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._states = OrderedDict()  # (curve_key, i) -> (state, size)
+        self._lock = threading.Lock()
+
+    def put(self, curve_key, current_density, state):
+        if state is None:
+            return
+        size = len(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        key = (curve_key, float(current_density))
+        with self._lock:
+            if key in self._states:
+                self.size -= self._states.pop(key)[1]
+            self._states[key] = (state, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size) = self._states.popitem(last=False)
+                self.size -= old_size
+
+    def nearest(self, curve_key, current_density):
+        """
+        Converged state of the same curve at the closest current density,
+        None if no state of this curve is cached
+        """
+        with self._lock:
+            candidates = [key for key in self._states if key[0] == curve_key]
+            if not candidates:
+                return None
+            key = min(candidates,
+                      key=lambda k: abs(k[1] - float(current_density)))
+            self._states.move_to_end(key)
+            return self._states[key][0]
+
+
+solution_cache = SolutionCache(config.SOLUTION_CACHE_SIZE)
+
+
+def curve_key(row: pd.Series) -> str:
+    """
+    Identifies a polarization curve: fingerprint of all inputs except the
+    current density
+    """
+    return df.fingerprint(
+        {k: v for k, v in row.items() if k != CURRENT_DENSITY})
+
+
+def curve_input_cols(input_cols) -> list:
+    """
+    Input columns of polarization curve points: the current density is
+    part of the settings also if it is no input of the form
+    """
+    input_cols = list(input_cols)
+    if CURRENT_DENSITY not in input_cols:
+        input_cols.append(CURRENT_DENSITY)
+    return input_cols
+
+
+def runs_per_set(curve_calculation: bool,
+                 n_refinements=N_REFINEMENTS) -> int:
+    """
+    Maximum number of simulation runs per parameter set: one, or for a
+    polarization curve all bisection probes, 3 initial points and 2 new
+    points per refinement step
+    """
+    if not curve_calculation:
+        return 1
+    return N_PROBES * N_ROUNDS + 3 + 2 * n_refinements
+
+
+def plan_study(table_input, mode, n_samples=None, curve_calculation=False,
+               timings=None) -> dict:
+    """
+    Planning stage of a study: number of parameter sets, maximum number of
+    simulation runs and estimated duration in seconds (None without
+    recorded run timings)
+    """
+    n_sets = df.count_parameter_sets(table_input, mode, n_samples)
+    n_runs = n_sets * runs_per_set(curve_calculation)
+    per_run = timings.per_run() if timings is not None else None
+    duration = n_runs * per_run if per_run is not None else None
+    return {'sets': n_sets, 'runs': n_runs, 'duration': duration}
+
+
+def admission_errors(plan: dict) -> list:
+    """
+    Violations of the study limits in config (empty, if the study may
+    start). The number of running studies per user is limited by StudySlot.
+    """
+    errors = []
+    if plan['sets'] == 0:
+        errors.append('No parameter is varied in the study table.')
+    if plan['runs'] > config.STUDY_MAX_RUNS:
+        errors.append(f"{plan['runs']} runs exceed the limit of "
+                      f"{config.STUDY_MAX_RUNS} runs per study.")
+    if plan['duration'] is not None \
+            and plan['duration'] > config.STUDY_MAX_DURATION:
+        errors.append(f"Estimated duration {plan['duration'] / 60:.0f} min "
+                      f"exceeds the limit of "
+                      f"{config.STUDY_MAX_DURATION / 60:.0f} min.")
+    return errors
+
+
+class StudySlot:
+    """
+    One of the STUDY_MAX_CONCURRENT slots for running studies of a user
+    (all sessions and tabs of a client address). A slot is a backend key
+    taken with the atomic add of the backend (SETNX on redis, under the
+    index lock of the file system store), so concurrent requests of all
+    workers and threads cannot exceed the limit. 'acquired' is False if all
+    slots are taken. Released on exit also if the study fails, expires
+    after twice the maximum study duration in case the process dies.
+    """
+    BUSY = 'Another study of yours is still running.'
+
+    def __init__(self, backend, user_id):
+        self.backend = backend
+        self.keys = [f'studies-running-{user_id}-{n}'
+                     for n in range(config.STUDY_MAX_CONCURRENT)]
+        self.key = None
+
+    @property
+    def acquired(self) -> bool:
+        return self.key is not None
+
+    def __enter__(self):
+        for key in self.keys:
+            if self.backend.add(key, True,
+                                timeout=2 * config.STUDY_MAX_DURATION):
+                self.key = key
+                break
+        return self
+
+    def __exit__(self, *exc):
+        if self.key is not None:
+            self.backend.delete(self.key)
+            self.key = None
+
+
+def run_curve_simulation(data_df: pd.DataFrame, return_unsuccessful=True,
+                         progress=None, result_stores=(), timings=None) \
+        -> (pd.DataFrame, bool):
+    """
+    Run points of polarization curves (as df.run_simulation), each
+    warm-started from the converged state of the nearest already simulated
+    point of the same curve.
+    """
+    initial_states = [solution_cache.nearest(key, i) for key, i
+                      in zip(data_df["curve_key"], data_df[CURRENT_DENSITY])]
+    data_df, success = df.run_simulation(
+        data_df, return_unsuccessful=return_unsuccessful, progress=progress,
+        initial_states=initial_states, result_stores=result_stores,
+        timings=timings)
+    for key, i, state in zip(data_df["curve_key"], data_df[CURRENT_DENSITY],
+                             data_df["solver_state"]):
+        solution_cache.put(key, i, state)
+    return data_df.drop(columns="solver_state"), success
 
 
 def prepare_initial_curve_computation(input_df: pd.DataFrame, i_limits: list, settings,
@@ -13,23 +197,116 @@ def prepare_initial_curve_computation(input_df: pd.DataFrame, i_limits: list, se
     input_df has to have only one row!
     @return:
     """
+    # Create initial input sets
+    i_calc = np.linspace(i_limits[0], i_limits[1], 3)
+    return prepare_curve_points(input_df, i_calc, settings,
+                                input_cols=input_cols)
 
+
+def prepare_curve_points(input_df: pd.DataFrame, i_calc, settings,
+                         input_cols=None) -> pd.DataFrame:
+    """
+    Points of a polarization-curve at current densities 'i_calc'
+    input_df has to have only one row!
+    """
     data_df = pd.DataFrame(columns=input_df.columns)
 
-    # Create initial input sets
-    i_calc = np.linspace(i_limits[0], i_limits[1], 3)
     for i in i_calc:
         data_df.loc[i, :] = input_df.iloc[0, :]  # .loc["nominal", :]
-        data_df.loc[i, "simulation-current_density"] = float(i)
+        data_df.loc[i, CURRENT_DENSITY] = float(i)
 
+    key_row = input_df.iloc[0] if input_cols is None \
+        else input_df.iloc[0][list(input_cols)]
+    if input_cols is not None:
+        input_cols = curve_input_cols(input_cols)
     data_df = create_settings(data_df, settings, input_cols=input_cols)
 
+    data_df.loc[:, "curve_key"] = curve_key(key_row)
     data_df.loc[:, "u_pred"] = None
     data_df.loc[:, "u_pred_diff"] = None
 
     return data_df
 
 
+def find_max_current_density(input_df: pd.DataFrame, settings,
+                             input_cols=None, i_limits=(1, 10000),
+                             n_probes=N_PROBES, n_rounds=N_ROUNDS,
+                             progress=None, result_stores=(),
+                             timings=None) -> (float, pd.DataFrame):
+    """
+    Multi-point bisection for the maximum feasible current density of the
+    single parameter set in input_df (one row!).
+    The first round probes n_probes current densities between i_limits,
+    every further round n_probes points between the highest feasible and
+    the lowest infeasible probe so far. All probes of a round are simulated
+    as one batch.
+    Returns the highest feasible current density (None, if the lower limit
+    fails already) and all successful probes, which can be reused as curve
+    points (see run_initial_curve_computation).
+    """
+    probes = []
+    lower, upper = None, None
+    i_probe = np.linspace(i_limits[0], i_limits[1], n_probes)
+    for _ in range(n_rounds):
+        df_probe = prepare_curve_points(input_df, i_probe, settings,
+                                        input_cols=input_cols)
+        df_probe, _ = run_curve_simulation(
+            df_probe, progress=progress, result_stores=result_stores,
+            timings=timings)
+        ok = df_probe["successful_run"].astype(bool)
+        probes.append(df_probe.loc[ok, :])
+
+        i_ok = df_probe.loc[ok, CURRENT_DENSITY].astype(float)
+        i_failed = df_probe.loc[~ok, CURRENT_DENSITY].astype(float)
+        if len(i_failed):
+            upper = i_failed.min() if upper is None \
+                else min(upper, i_failed.min())
+        if upper is not None:
+            i_ok = i_ok[i_ok < upper]
+        if len(i_ok):
+            lower = i_ok.max() if lower is None else max(lower, i_ok.max())
+        if lower is None or upper is None:
+            # Lower limit infeasible or upper limit feasible: done
+            break
+        i_probe = np.linspace(lower, upper, n_probes + 2)[1:-1]
+
+    probes = pd.concat(probes, ignore_index=True)
+    return lower, probes
+
+
+def run_initial_curve_computation(
+        input_df: pd.DataFrame, i_limits: list, settings, input_cols=None,
+        probes: pd.DataFrame = None, progress=None, result_stores=(),
+        timings=None) -> (pd.DataFrame, bool):
+    """
+    Prepare and run the initial points of a polarization curve (see
+    prepare_initial_curve_computation). Points already simulated as probes
+    of find_max_current_density are taken from 'probes'.
+    """
+    data_df = prepare_initial_curve_computation(
+        input_df, i_limits, settings, input_cols=input_cols)
+    if probes is None or probes.empty:
+        return run_curve_simulation(data_df, progress=progress,
+                                    result_stores=result_stores,
+                                    timings=timings)
+
+    i_probes = probes[CURRENT_DENSITY].astype(float).to_numpy()
+    known = data_df[CURRENT_DENSITY].apply(
+        lambda i: np.isclose(i_probes, i).any()).astype(bool)
+    computed, success = run_curve_simulation(
+        data_df.loc[~known, :], progress=progress,
+        result_stores=result_stores, timings=timings)
+    reused = pd.concat(
+        [probes.loc[np.isclose(i_probes, i), :].iloc[[0]]
+         for i in data_df.loc[known, CURRENT_DENSITY].astype(float)],
+        ignore_index=True)
+    reused.loc[:, "u_pred"] = None
+    reused.loc[:, "u_pred_diff"] = None
+    data_df = pd.concat([computed, reused], ignore_index=True)
+    data_df.sort_values(CURRENT_DENSITY, ignore_index=True, inplace=True)
+    return data_df, success
+
+
 def prepare_curve_refinement_calculation(
         data_df: pd.DataFrame, input_df: pd.DataFrame, settings):
     """
@@ -40,57 +317,209 @@ def prepare_curve_refinement_calculation(
     """
 
     n = data_df.shape[0]
-    new_data_df = pd.DataFrame(columns=data_df.columns)
     data_df.sort_values(
-        "simulation-current_density", ignore_index=True, inplace=True)
+        CURRENT_DENSITY, ignore_index=True, inplace=True)
+    global_table, _ = df.global_results(data_df)
+    u_calc = global_table[STACK_VOLTAGE].to_numpy()
 
     # First refinement,
     # set prediction = calculation & prediction different to zero
     if n == 3:
-        data_df["u_pred"] = \
-            data_df["global_data"].apply(lambda x: x["Stack Voltage"]["value"])
-        data_df["u_pred_diff"] = 0
-        refine = data_df
+        data_df["u_pred"] = u_calc
+        data_df["u_pred_diff"] = 0.
+        refine = slice(0, 3)
 
     else:  # refinement no. 2 onwards....
 
         # Calculate difference between calculations and prior predictions
-        data_df["u_pred_diff"] = \
-            abs(data_df["global_data"].apply(
-                lambda x: x["Stack Voltage"]["value"]) - data_df["u_pred"])
-        data_df["u_pred_diff"]= pd.to_numeric(data_df["u_pred_diff"])
+        u_pred = pd.to_numeric(data_df["u_pred"]).to_numpy(dtype=float)
+        data_df["u_pred_diff"] = np.abs(u_calc - u_pred)
         # Location of largest deviation
-        idxmax = data_df["u_pred_diff"].idxmax()
+        idxmax = int(data_df["u_pred_diff"].idxmax())
         # "reset" predictions, as refinement will be performed now
-        data_df.loc[idxmax, "u_pred"] = \
-            data_df.loc[idxmax, "global_data"]["Stack Voltage"]["value"]
+        data_df.loc[idxmax, "u_pred"] = u_calc[idxmax]
 
-        refine = data_df.iloc[idxmax - 1: idxmax + 2]
+        refine = slice(max(idxmax - 1, 0), idxmax + 2)
 
-    # DataFrame 'refine' has 3 rows. Two additional will be added inbetween:
+    # 'refine' covers 3 rows. Two additional will be added inbetween:
+    i_calc = data_df[CURRENT_DENSITY].to_numpy(dtype=float)[refine]
+    u_refine = u_calc[refine]
+    i_new = (i_calc[:-1] + i_calc[1:]) / 2
 
-    i_calc = refine["simulation-current_density"].to_list()
-    u_calc = refine["global_data"].apply(
-        lambda x: x["Stack Voltage"]["value"]).to_list()
-
-    for idx in range(len(i_calc) - 1):
-        i_new = (i_calc[idx] + i_calc[idx + 1]) / 2
-        u_pred = (u_calc[idx] + u_calc[idx + 1]) / 2
-
-        # duplicate random(here first) row and adjust current density)
-        new_data_df.loc[i_new, :] = data_df.iloc[0, :]
-        new_data_df.loc[i_new, "simulation-current_density"] = i_new
-        new_data_df.loc[i_new, "u_pred"] = u_pred
+    # duplicate random(here first) row and adjust current density)
+    new_data_df = data_df.iloc[[0] * len(i_new)].copy()
+    new_data_df.index = i_new
+    new_data_df[CURRENT_DENSITY] = i_new
+    new_data_df["u_pred"] = (u_refine[:-1] + u_refine[1:]) / 2
 
     # Create settings out of (only) input columns
-    new_data_df_red = new_data_df.loc[:, input_df.columns]
+    new_data_df_red = new_data_df.loc[:, curve_input_cols(input_df.columns)]
     # For legacy: Create "input_data"-dict,
     # as required for data_transfer.gui_to_sim_transfer()
     new_data_df['input_data'] = new_data_df_red.apply(
         lambda row: {i: {'sim_name': i.split('-'), 'value': v}
                      for i, v in zip(row.index, row.values)}, axis=1)
 
+    settings = thaw(settings)
+    settings_key = fingerprint(settings)
     new_data_df['settings'] = new_data_df['input_data'].apply(
-        lambda x: data_transfer.dict_transfer(x, settings)[0])
+        lambda x: transfer_settings(x, settings, settings_key))
 
     return new_data_df
+
+
+def run_curve(input_df: pd.DataFrame, df_input: pd.DataFrame, settings,
+              progress=None, result_stores=(), timings=None) -> pd.DataFrame:
+    """
+    Polarization curve of the single parameter set in input_df (one row!):
+    bisection for the current density limit, initial points and
+    N_REFINEMENTS refinement steps. Returns None, if no curve could be
+    calculated.
+    """
+    # Parallel bisection for the current density limit; successful
+    # probes are reused as curve points
+    max_i, df_probes = find_max_current_density(
+        input_df, settings, input_cols=df_input.columns,
+        i_limits=[1, 10000], progress=progress,
+        result_stores=result_stores, timings=timings)
+    if max_i is None:
+        return None
+
+    # Prepare & calculate initial points
+    df_results, success = run_initial_curve_computation(
+        input_df=input_df, i_limits=[1, max_i],
+        settings=settings, input_cols=df_input.columns,
+        probes=df_probes, progress=progress,
+        result_stores=result_stores, timings=timings)
+    if not success:
+        return None
+
+    # Refinement steps
+    for _ in range(N_REFINEMENTS):
+        df_refine = prepare_curve_refinement_calculation(
+            input_df=df_input, data_df=df_results, settings=settings)
+        df_refine, success = run_curve_simulation(
+            df_refine, return_unsuccessful=False, progress=progress,
+            result_stores=result_stores, timings=timings)
+        df_results = pd.concat([df_results, df_refine], ignore_index=True)
+    return df_results
+
+
+def run_study(data: pd.DataFrame, df_input: pd.DataFrame, settings,
+              curve_calculation=False, progress=None, result_stores=(),
+              timings=None, max_workers=1, parallel_curves=False) \
+        -> pd.DataFrame:
+    """
+    Simulate all parameter sets in 'data' (see df.variation_parameter),
+    optionally a polarization curve for each set.
+    Returns the result table.
+
+    max_workers: number of local simulation processes (None: all cores)
+    parallel_curves: calculate the curves of different parameter sets in
+        max_workers processes; result_stores must be picklable and
+        progress and timings are not reported
+    """
+    if not curve_calculation:
+        # Create complete setting dict & append it in additional column
+        # "settings" to df_input
+        data = create_settings(data, settings, input_cols=df_input.columns)
+        results, success = df.run_simulation(
+            data, progress=progress, result_stores=result_stores,
+            max_workers=max_workers, timings=timings)
+        return results
+
+    # ... calculate pol. curve for each parameter set
+    # Ensure DataFrame with double bracket
+    # https://stackoverflow.com/questions/20383647/pandas-selecting-by-label-sometimes-return-series-sometimes-returns-dataframe
+    sets = [data.iloc[[i]] for i in range(len(data))]
+    if parallel_curves and (max_workers is None or max_workers > 1):
+        curves = list(sim_api.process_pool(max_workers).map(partial(
+            run_curve, df_input=df_input, settings=settings,
+            result_stores=result_stores), sets))
+    else:
+        curves = [run_curve(input_df, df_input, settings, progress=progress,
+                            result_stores=result_stores, timings=timings)
+                  for input_df in sets]
+    return pd.concat([pd.DataFrame(columns=data.columns)]
+                     + [curve for curve in curves if curve is not None],
+                     ignore_index=True)
+
+
+# Sensitivity studies
+# --------------------------------------
+def _mean_value(value) -> float:
+    """
+    Scalar value of a parameter (mean of list parameters), NaN if not
+    numeric
+    """
+    try:
+        return float(np.mean(np.asarray(value, dtype=float)))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _cell_means(local_data, field, n_cells) -> np.ndarray:
+    """
+    Per cell mean of a local field (cells x channel values)
+    """
+    try:
+        values = np.asarray(local_data[field]['value'], dtype=float)
+        values = values.reshape(len(values), -1).mean(axis=1)
+    except (TypeError, KeyError, ValueError):
+        return np.full(n_cells, np.nan)
+    if len(values) != n_cells:
+        return np.full(n_cells, np.nan)
+    return values
+
+
+def sensitivities(results: pd.DataFrame, local_field=None) \
+        -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    """
+    Normalized sensitivities (dy / y0) / (dx / x0) from the central
+    differences of a sensitivity study (df.variation_parameter, mode
+    "sensitivity"), one row per parameter and one column per global
+    quantity, or per cell of 'local_field' (mean over the channel).
+    Also returns the relative changes (y - y0) / y0 at the lower and at the
+    upper value of each parameter.
+    """
+    step = results[df.SENSITIVITY_STEP].astype(float).to_numpy()
+    ok = results["successful_run"].astype(bool).to_numpy()
+    nominal = np.flatnonzero(step == 0)[0]
+    if local_field is None:
+        y, _ = df.global_results(results)
+        columns = list(y.columns)
+        y = y.to_numpy(dtype=float)
+    else:
+        n_cells = len(np.asarray(
+            results["local_data"].iloc[nominal][local_field]['value']))
+        columns = [f'Cell {i}' for i in range(n_cells)]
+        y = np.stack([_cell_means(local_data, local_field, n_cells)
+                      for local_data in results["local_data"]])
+    y = np.where(ok[:, None], y, np.nan)
+
+    lower = np.flatnonzero(step == -1)
+    upper = np.flatnonzero(step == 1)
+    parameters = results["variation_parameter"].iloc[lower].to_list()
+    # Upper run of each parameter in the order of the lower runs
+    position = {par: pos for par, pos in zip(
+        results["variation_parameter"].iloc[upper], upper)}
+    upper = np.asarray([position[par] for par in parameters], dtype=int)
+
+    x0 = np.asarray([_mean_value(results[par].iloc[nominal])
+                     for par in parameters])
+    x_lower = np.asarray([_mean_value(results[par].iloc[pos])
+                          for par, pos in zip(parameters, lower)])
+    x_upper = np.asarray([_mean_value(results[par].iloc[pos])
+                          for par, pos in zip(parameters, upper)])
+    y0 = y[nominal]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx = (x_upper - x_lower) / x0
+        rel_lower = (y[lower] - y0) / y0
+        rel_upper = (y[upper] - y0) / y0
+        sensitivity = (rel_upper - rel_lower) / dx[:, None]
+
+    def table(values):
+        return pd.DataFrame(np.where(np.isfinite(values), values, np.nan),
+                            index=parameters, columns=columns)
+
+    return table(sensitivity), table(rel_lower), table(rel_upper)
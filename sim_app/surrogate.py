@@ -0,0 +1,164 @@
+"""
+Surrogate model preview for parameter studies.
+
+All successful runs are recorded in a result history per base settings
+(stored in the caching backend). Before a study is simulated, a Gaussian
+process regressor is fitted on this history and predicts the global results
+of every run of the new design including an uncertainty estimate.
+"""
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+from scipy.spatial.distance import cdist
+
+from sim_app.dash_functions import fingerprint, global_results, \
+    numeric_features
+
+# Maximum number of recorded runs per base settings (fit cost is O(n³))
+MAX_HISTORY = 1000
+# Minimum number of recorded runs for a prediction
+MIN_HISTORY = 3
+# Candidate kernel length scales relative to sqrt(number of features)
+LENGTH_SCALES = (0.1, 0.3, 1., 3., 10.)
+
+
+def history_key(settings):
+    return f'surrogate-{fingerprint(settings)}'
+
+
+class GaussianProcess:
+    """
+    Gaussian process regression with squared exponential kernel on
+    standardized in- and outputs. The length scale is chosen from
+    LENGTH_SCALES by maximum marginal likelihood.
+    """
+
+    def __init__(self, noise=1e-6):
+        self.noise = noise
+
+    def fit(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.x_mean = x.mean(axis=0)
+        self.x_std = np.where(x.std(axis=0) > 0, x.std(axis=0), 1.)
+        self.y_mean = y.mean(axis=0)
+        # Constant outputs are predicted exactly (zero uncertainty)
+        self.y_spread = y.std(axis=0)
+        self.y_std = np.where(self.y_spread > 0, self.y_spread, 1.)
+        self.x = (x - self.x_mean) / self.x_std
+        ys = (y - self.y_mean) / self.y_std
+        d2 = cdist(self.x, self.x, 'sqeuclidean')
+        n = len(self.x)
+
+        best = None
+        for scale in LENGTH_SCALES:
+            length = scale * np.sqrt(self.x.shape[1])
+            k = np.exp(-0.5 * d2 / length ** 2)
+            try:
+                cho = cho_factor(k + self.noise * np.eye(n), lower=True)
+            except LinAlgError:
+                continue
+            alpha = cho_solve(cho, ys)
+            log_likelihood = -0.5 * np.sum(ys * alpha) \
+                - ys.shape[1] * np.sum(np.log(np.diag(cho[0])))
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length, cho, alpha)
+        if best is None:
+            raise LinAlgError('Kernel matrix is not positive definite')
+        _, self.length, self.cho, self.alpha = best
+        return self
+
+    def predict(self, x) -> (np.ndarray, np.ndarray):
+        """
+        Returns mean and standard deviation, both of shape
+        (n_samples, n_outputs)
+        """
+        xs = (np.asarray(x, dtype=float) - self.x_mean) / self.x_std
+        k = np.exp(-0.5 * cdist(xs, self.x, 'sqeuclidean') / self.length ** 2)
+        mean = k @ self.alpha * self.y_std + self.y_mean
+        var = 1. - np.sum(k * cho_solve(self.cho, k.T).T, axis=1)
+        std = np.sqrt(np.clip(var, 0., None))[:, None] * self.y_spread
+        return mean, std
+
+
+def record_results(backend, settings, results: pd.DataFrame, input_cols):
+    """
+    Append successful runs of 'results' to the result history of the base
+    'settings'. Runs are recorded once per settings hash (runs taken from
+    result stores are part of every study repeating them), the latest
+    record is kept.
+    """
+    results = results.loc[results["successful_run"].astype(bool), :]
+    if results.empty:
+        return
+    outputs, units = global_results(results)
+    history = backend.get(history_key(settings))
+    if history is None:
+        history = {'inputs': pd.DataFrame(), 'outputs': pd.DataFrame(),
+                   'units': {}}
+    # Settings hash per recorded run (None in older histories)
+    hashes = history.get('hashes', [None] * len(history['inputs']))
+    if "settings_hash" in results:
+        new_hashes = results["settings_hash"].to_list()
+    else:
+        new_hashes = [None] * len(results)
+    hashes = pd.Series(list(hashes) + new_hashes, dtype=object)
+    unique = (hashes.isna() | ~hashes.duplicated(keep='last')).to_numpy()
+    inputs = pd.concat([history['inputs'], results.loc[:, list(input_cols)]],
+                       ignore_index=True)
+    outputs = pd.concat([history['outputs'], outputs], ignore_index=True)
+    history['inputs'] = \
+        inputs.loc[unique].iloc[-MAX_HISTORY:].reset_index(drop=True)
+    history['outputs'] = \
+        outputs.loc[unique].iloc[-MAX_HISTORY:].reset_index(drop=True)
+    history['hashes'] = hashes[unique].iloc[-MAX_HISTORY:].to_list()
+    history['units'].update(units)
+    # No expiry, history is only limited by MAX_HISTORY
+    backend.set(history_key(settings), history, timeout=0)
+
+
+def predict_study(backend, settings, design: pd.DataFrame, input_cols) \
+        -> (pd.DataFrame, pd.DataFrame, dict):
+    """
+    Predict global results of all runs in 'design' from the result history.
+    Returns tables of mean and standard deviation (one column per global
+    quantity) and the units, or None if the history is insufficient.
+    """
+    history = backend.get(history_key(settings))
+    if history is None or len(history['inputs']) < MIN_HISTORY:
+        return None
+    design_inputs = design.loc[:, list(input_cols)]
+    hist_inputs = history['inputs'].reindex(columns=list(input_cols))
+
+    # Non-numeric inputs are not modelled: use only recorded runs
+    # which match the design in those
+    x_design = numeric_features(design_inputs)
+    for name in design_inputs.columns:
+        if name in x_design.columns or f'{name}_0' in x_design.columns:
+            continue
+        value = design_inputs[name].iloc[0]
+        hist_inputs = hist_inputs.loc[
+            hist_inputs[name].apply(lambda v: v == value).astype(bool), :]
+    x_hist = numeric_features(hist_inputs).reindex(columns=x_design.columns)
+    y_hist = history['outputs'].loc[x_hist.index, :]
+    valid = x_hist.notna().all(axis=1) & y_hist.notna().any(axis=1)
+    x_hist = x_hist.loc[valid, :]
+    y_hist = y_hist.loc[valid, :].dropna(axis=1)
+    if len(x_hist) < MIN_HISTORY or y_hist.empty:
+        return None
+
+    # Features without variation carry no information
+    varying = (x_hist.nunique() > 1) | (x_design.nunique() > 1)
+    if not varying.any():
+        return None
+    x_hist = x_hist.loc[:, varying]
+    x_design = x_design.loc[:, varying]
+
+    try:
+        model = GaussianProcess().fit(x_hist.values, y_hist.values)
+    except LinAlgError:
+        return None
+    mean, std = model.predict(x_design.values)
+    mean = pd.DataFrame(mean, index=design.index, columns=y_hist.columns)
+    std = pd.DataFrame(std, index=design.index, columns=y_hist.columns)
+    return mean, std, history['units']
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Server-side state of the tests in a temporary directory (config is read
+# when sim_app is imported); settings files are found relative to the root
+_tmp = tempfile.mkdtemp(prefix='sim_app_tests_')
+os.environ.setdefault('CACHE_DIR', os.path.join(_tmp, 'file_system_store'))
+os.environ.setdefault('WAREHOUSE_PATH', os.path.join(_tmp, 'results.sqlite'))
+os.environ.setdefault('CHECKPOINT_DIR', os.path.join(_tmp, 'checkpoints'))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
@@ -0,0 +1,21 @@
+"""
+WSGI entry point of the load test (tests/test_load.py): the app with a
+simulation stand-in blocking LOAD_TEST_SIMULATION_TIME seconds per run,
+like a call of an external solver.
+"""
+import os
+import time
+
+from sim_app import simulation_api
+from sim_app.main import app
+
+_run_external_simulation = simulation_api.run_external_simulation
+
+
+def run_external_simulation(settings, initial_state=None):
+    time.sleep(float(os.environ.get('LOAD_TEST_SIMULATION_TIME', 0.2)))
+    return _run_external_simulation(settings, initial_state=initial_state)
+
+
+simulation_api.run_external_simulation = run_external_simulation
+server = app.server
@@ -0,0 +1,107 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sim_app import api, config
+from sim_app import main
+from sim_app.study_functions import StudySlot
+
+TOKEN = 'test-token'
+TABLE = [{'Parameter': 'cell-length', 'Variation Type': 'Values',
+          'Values': '0.4, 0.5'}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, 'API_TOKEN', TOKEN)
+    client = main.server.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {TOKEN}'
+    return client
+
+
+def wait_for(client, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        record = client.get(f'/api/v1/jobs/{job_id}').get_json()
+        if record['status'] in ('finished', 'failed'):
+            return record
+        time.sleep(0.1)
+    raise TimeoutError(job_id)
+
+
+def test_token_required(monkeypatch):
+    client = main.server.test_client()
+    monkeypatch.setattr(config, 'API_TOKEN', '')
+    response = client.post('/api/v1/jobs', json={'study': {'table': TABLE}})
+    assert response.status_code == 401
+    monkeypatch.setattr(config, 'API_TOKEN', TOKEN)
+    response = client.get('/api/v1/jobs/x',
+                          headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('body', [
+    [],
+    {'study': []},
+    {'study': {'table': ['cell-length']}},
+    {'study': {'table': TABLE}, 'settings': []},
+    {'study': {'table': TABLE}, 'settings': {}},
+    {'study': {'table': TABLE, 'mode': 'lhs', 'samples': 'ten'}},
+    {'study': {'table': TABLE, 'seed': 1.5}},
+    {'jobs': [{'study': {'table': TABLE}}, {'study': 'full'}]},
+])
+def test_invalid_jobs(client, body):
+    response = client.post('/api/v1/jobs', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_job_results(client):
+    response = client.post('/api/v1/jobs', json={'study': {'table': TABLE}})
+    assert response.status_code == 202
+    record = wait_for(client, response.get_json()['id'])
+    assert record['status'] == 'finished'
+    page = client.get(f"/api/v1/jobs/{record['id']}/results").get_json()
+    assert page['total'] == 2
+    assert page['data']['cell-length'] == [0.4, 0.5]
+
+
+def test_stale_job_fails(client, monkeypatch):
+    job_id = 'stale-job'
+    api.update_job(job_id, status='running', created=time.time() - 100,
+                   heartbeat=time.time() - 100)
+    monkeypatch.setattr(config, 'API_JOB_STALE_AFTER', 50)
+    record = client.get(f'/api/v1/jobs/{job_id}').get_json()
+    assert record['status'] == 'failed'
+    assert 'stalled' in record['error']
+
+
+def test_jobs_wait_for_study_slot(client, monkeypatch):
+    monkeypatch.setattr(config, 'STUDY_MAX_CONCURRENT', 1)
+    monkeypatch.setattr(config, 'API_SLOT_RETRY', 0.1)
+    client.environ_base['REMOTE_ADDR'] = '10.0.0.4'
+    with StudySlot(api.caching_backend, '10.0.0.4'):
+        response = client.post('/api/v1/jobs',
+                               json={'study': {'table': TABLE}})
+        job_id = response.get_json()['id']
+        time.sleep(0.5)
+        assert client.get(f'/api/v1/jobs/{job_id}').get_json()['status'] \
+            == 'queued'
+    assert wait_for(client, job_id)['status'] == 'finished'
+
+
+def test_missing_values_are_null(client):
+    job_id = 'missing-values'
+    table = pd.DataFrame({'cell-length': [0.4, np.nan],
+                          'variation_parameter': ['cell-length', np.nan],
+                          'global: Stack Voltage': [np.nan, 1.]})
+    api.caching_backend.set(api.result_key(job_id), table)
+    api.update_job(job_id, status='finished', created=time.time())
+    response = client.get(f'/api/v1/jobs/{job_id}/results')
+    assert b'NaN' not in response.data
+    assert response.get_json()['data'] == {
+        'cell-length': [0.4, None],
+        'variation_parameter': ['cell-length', None],
+        'global: Stack Voltage': [None, 1.]}
@@ -0,0 +1,62 @@
+import os
+
+from sim_app import cache_store
+from sim_app.cache_store import BoundedFileSystemStore
+
+
+def index_mtime(store):
+    return os.stat(store._file_path(store.INDEX_FILE)).st_mtime_ns
+
+
+def test_reads_do_not_rewrite_index(tmp_path):
+    store = BoundedFileSystemStore(str(tmp_path), size_limit=10 ** 6)
+    store.set('a', [1, 2])
+    mtime = index_mtime(store)
+    assert store.get('a') == [1, 2] and store.has('a')
+    assert store.get('b') is None
+    assert index_mtime(store) == mtime
+
+
+def test_lru_eviction_follows_reads(tmp_path):
+    value = b'x' * 1000
+    store = BoundedFileSystemStore(str(tmp_path), size_limit=2500)
+    store.set('a', value)
+    store.set('b', value)
+    store.get('a')
+    store.set('c', value)
+    assert store.get('a') == value and store.get('c') == value
+    assert store.get('b') is None
+
+
+def test_expiry(tmp_path, monkeypatch):
+    store = BoundedFileSystemStore(str(tmp_path), default_timeout=10)
+    store.set('a', 1)
+    store.set('b', 2, timeout=0)
+    now = cache_store.time.time()
+    monkeypatch.setattr(cache_store.time, 'time', lambda: now + 20)
+    assert store.get('a') is None and not store.has('a')
+    assert store.get('a', ignore_expired=True) == 1
+    assert store.get('b') == 2
+    store.set('c', 3)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [store.INDEX_FILE, store.LOCK_FILE, store._file_name('b'),
+         store._file_name('c')])
+
+
+def test_eviction_by_other_worker_during_set(tmp_path, monkeypatch):
+    # Budget for one entry: the other worker evicts the previous version of
+    # 'a' while it is being rewritten, the new version has to survive
+    value = b'x' * 1000
+    store = BoundedFileSystemStore(str(tmp_path), size_limit=1500)
+    other = BoundedFileSystemStore(str(tmp_path), size_limit=1500)
+    store.set('a', value)
+    locked_index = store._locked_index
+
+    def interleaved():
+        other.set('b', value)
+        return locked_index()
+
+    monkeypatch.setattr(store, '_locked_index', interleaved)
+    store.set('a', value + b'y')
+    assert store.get('a') == value + b'y'
+    assert other.get('b') is None
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sim_app import cli
+from sim_app import dash_functions as df
+
+SETTINGS = 'settings/settings.json'
+STUDY_TABLE = [{'Parameter': 'stack-cell_number', 'Example': None,
+                'Variation Type': 'Values', 'Values': '8, 10, 12'},
+               {'Parameter': 'cell-length', 'Example': None,
+                'Variation Type': 'Values', 'Values': '0.4, 0.6'}]
+
+
+@pytest.fixture
+def study_table(tmp_path):
+    path = str(tmp_path / 'study.csv')
+    pd.DataFrame(STUDY_TABLE).to_csv(path, index=False)
+    return path
+
+
+def test_csv_output(tmp_path, study_table, capsys):
+    output = str(tmp_path / 'results.csv')
+    cli.main([SETTINGS, study_table, '-o', output, '--workers', '1'])
+    printed = capsys.readouterr().out
+    assert '5 parameter sets, mode single' in printed
+    assert f'5 of 5 runs successful, results written to {output}' in printed
+
+    table = pd.read_csv(output)
+    assert len(table) == 5
+    # Integer inputs are exported as integers
+    assert table['stack-cell_number'].dtype.kind == 'i'
+    assert table['stack-cell_number'].astype(str).isin(
+        ['8', '10', '12']).all()
+    assert sorted(table['cell-length'].unique()) == [0.4, 0.5, 0.6]
+    assert table['successful_run'].all()
+    voltage = df.global_column('Stack Voltage')
+    assert table[voltage].notna().all()
+    with open(str(tmp_path / 'results_units.json')) as file:
+        assert 'Stack Voltage' in json.load(file)
+    # Completed studies leave no checkpoint log behind
+    assert not list((tmp_path / 'checkpoints').glob('*'))
+
+
+def test_npz_output(tmp_path, study_table):
+    output = str(tmp_path / 'results.npz')
+    cli.main([SETTINGS, study_table, '-o', output, '--mode', 'full',
+              '--workers', '1'])
+    with np.load(output) as arrays:
+        assert arrays['stack-cell_number'].dtype.kind == 'i'
+        assert sorted(arrays['stack-cell_number']) == [8, 8, 10, 10, 12, 12]
+        assert arrays[df.global_column('Stack Voltage')].dtype == float
+        assert arrays['variation_parameter'].dtype.kind == 'U'
+
+
+@pytest.mark.parametrize('args', [['-o', 'results.xlsx'],
+                                  ['--mode', 'lhs']])
+def test_invalid_arguments(study_table, args):
+    with pytest.raises(SystemExit) as error:
+        cli.main([SETTINGS, study_table] + args)
+    assert error.value.code != 0
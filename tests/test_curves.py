@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from sim_app import dash_functions as df
+# Builds the layout (see dash_functions.nominal_inputs)
+from sim_app import main  # noqa: F401
+from sim_app import simulation_api as sim_api
+from sim_app import study_functions as sf
+from sim_app.study_functions import CURRENT_DENSITY
+
+LIMIT = 6543.
+
+
+class FailingSolver:
+    """
+    Simulation stand-in which fails above the current density 'limit',
+    records the current densities of all calls
+    """
+
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.calls = []
+        self.simulate = sim_api.run_external_simulation
+
+    def __call__(self, settings, initial_state=None):
+        current_density = settings['simulation']['current_density']
+        self.calls.append(current_density)
+        if current_density > self.limit:
+            raise RuntimeError('Solver did not converge')
+        return self.simulate(settings, initial_state=initial_state)
+
+
+@pytest.fixture
+def solver(monkeypatch):
+    solver = FailingSolver()
+    monkeypatch.setattr(sim_api, 'run_external_simulation', solver)
+    return solver
+
+
+@pytest.fixture
+def nominal():
+    settings = df.base_settings()
+    return df.nominal_inputs(settings), settings
+
+
+def test_bisection_converges_below_limit(solver, nominal):
+    df_input, settings = nominal
+    max_i, probes = sf.find_max_current_density(
+        df_input, settings, input_cols=df_input.columns,
+        i_limits=(1, 10000))
+    # Bracket shrinks by n_probes + 1 per round after the first one
+    width = (10000 - 1) / (sf.N_PROBES - 1) / (sf.N_PROBES + 1) ** 2
+    assert LIMIT - width <= max_i <= LIMIT
+    assert len(solver.calls) == sf.N_PROBES * sf.N_ROUNDS
+    assert probes["successful_run"].all()
+    assert (probes[CURRENT_DENSITY] <= LIMIT).all()
+    assert max_i == probes[CURRENT_DENSITY].max()
+
+
+def test_bisection_stops_at_feasible_upper_limit(solver, nominal):
+    df_input, settings = nominal
+    max_i, probes = sf.find_max_current_density(
+        df_input, settings, input_cols=df_input.columns,
+        i_limits=(1, 5000))
+    assert max_i == 5000
+    assert len(solver.calls) == sf.N_PROBES
+
+
+def test_bisection_infeasible_lower_limit(solver, nominal):
+    df_input, settings = nominal
+    solver.limit = 0.
+    max_i, probes = sf.find_max_current_density(
+        df_input, settings, input_cols=df_input.columns)
+    assert max_i is None and probes.empty
+    assert len(solver.calls) == sf.N_PROBES
+
+
+def test_probes_reused_as_curve_points(solver, nominal):
+    df_input, settings = nominal
+    max_i, probes = sf.find_max_current_density(
+        df_input, settings, input_cols=df_input.columns,
+        i_limits=(1, 10000))
+    solver.calls.clear()
+    curve, success = sf.run_initial_curve_computation(
+        df_input, [1, max_i], settings, input_cols=df_input.columns,
+        probes=probes)
+    assert success
+    assert curve[CURRENT_DENSITY].astype(float).tolist() == \
+        pytest.approx([1, (1 + max_i) / 2, max_i])
+    # Only the middle point is no probe
+    assert solver.calls == pytest.approx([(1 + max_i) / 2])
+    assert np.isclose(
+        probes[CURRENT_DENSITY].astype(float), max_i).any()
+
+
+def test_curve_study(solver, nominal):
+    df_input, settings = nominal
+    data = df.variation_parameter(
+        df_input, [{'Parameter': 'cell-length', 'Variation Type': 'Values',
+                    'Values': '0.4, 0.5'}], mode='full')
+    results = sf.run_study(data, df_input, settings, curve_calculation=True)
+    assert len(solver.calls) <= 2 * sf.runs_per_set(True)
+    for _, curve in results.groupby("curve_key"):
+        current_density = curve[CURRENT_DENSITY].astype(float)
+        # Initial points and one or two new points per refinement step
+        assert 3 + sf.N_REFINEMENTS <= len(curve) <= 3 + 2 * sf.N_REFINEMENTS
+        assert current_density.is_unique
+        assert current_density.max() <= LIMIT
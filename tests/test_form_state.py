@@ -0,0 +1,53 @@
+import random
+import threading
+
+from sim_app import dash_functions as df
+from sim_app import main
+from sim_app.cache_store import BoundedFileSystemStore
+
+
+def delta(version, full=False, **changes):
+    return {'version': version, 'full': full, 'changes': changes}
+
+
+def test_out_of_order_deltas(tmp_path):
+    form = df.FormState(BoundedFileSystemStore(str(tmp_path)), 'session')
+    assert form.merge(delta(1, True, a=1, b=1)) == 1
+    # Delta 3 includes the unacknowledged changes of delta 2
+    assert form.merge(delta(3, a=2, b=3)) == 3
+    assert form.merge(delta(2, a=2)) == 3
+    assert form.values() == {'a': 2, 'b': 3}
+
+
+def test_lost_record_needs_complete_form(tmp_path):
+    form = df.FormState(BoundedFileSystemStore(str(tmp_path)), 'session')
+    assert form.merge(delta(4, b=1)) is None
+    assert form.merge(delta(5, True, a=1, b=1)) == 5
+
+
+def test_ack_of_stale_delta():
+    session_id = 'ack-session'
+    assert main.cbf_form_state(delta(2, True, a=2), session_id) == \
+        {'version': 2, 'resync': False}
+    assert main.cbf_form_state(delta(1, True, a=1), session_id) == \
+        {'version': 2, 'resync': False}
+
+
+def test_concurrent_merges(tmp_path):
+    # One store per thread, like workers sharing the directory
+    versions = list(range(1, 17))
+    random.Random(0).shuffle(versions)
+    barrier = threading.Barrier(len(versions))
+
+    def merge(version):
+        form = df.FormState(BoundedFileSystemStore(str(tmp_path)), 'session')
+        barrier.wait()
+        form.merge(delta(version, True, a=version))
+
+    threads = [threading.Thread(target=merge, args=(v,)) for v in versions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    form = df.FormState(BoundedFileSystemStore(str(tmp_path)), 'session')
+    assert form.values() == {'a': 16}
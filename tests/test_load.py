@@ -0,0 +1,145 @@
+"""
+Load test: concurrent single calculations (one page session each) against
+gunicorn with 1 and with WORKERS worker processes of one thread. All
+transient state is session-scoped in the shared caching backend, so the
+throughput has to scale (nearly) linearly with the number of workers.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sim_app import dash_layout as dl
+from sim_app import main
+
+pytest.importorskip('gunicorn')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = 4
+N_REQUESTS = 24
+SIMULATION_TIME = 0.4
+# Minimum speedup with WORKERS workers (linear: WORKERS)
+MIN_SPEEDUP = 0.7 * WORKERS
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def parse_outputs(output_key):
+    """
+    [{'id': ..., 'property': ...}] of a (multi-)output callback key
+    """
+    outputs = []
+    for item in output_key.strip('.').split('...'):
+        component_id, prop = item.rsplit('.', 1)
+        if component_id.startswith('{'):
+            component_id = json.loads(component_id)
+        outputs.append({'id': component_id, 'property': prop})
+    return outputs
+
+
+def single_calculation_request():
+    """
+    Request factory of cbf_run_single_cal with the complete form of a new
+    session (distinct cell length per request, so every run is simulated)
+    """
+    main.app._setup_server()
+    output_key = next(key for key in main.app.callback_map
+                      if 'spinner_run_single' in key)
+    callback = main.app.callback_map[output_key]
+    ids = [i for i in dl.ID_LIST if i['type'] == 'input']
+    ids_multi = [i for i in dl.ID_LIST if i['type'] == 'multiinput']
+    values, multivalues, df_input, _, _ = main.cbf_initialization(
+        None, [None] * len(ids), [None] * len(ids_multi), ids, ids_multi)
+    form = {i['id']: v for i, v in zip(ids + ids_multi, values + multivalues)}
+    length = df_input.loc['nominal', 'cell-length']
+
+    def request(n):
+        changes = dict(form, **{'cell-length': length * (1. + 1e-3 * n)})
+        states = {'form_delta': {'version': 1, 'full': True,
+                                 'changes': changes},
+                  'session_id': uuid.uuid4().hex}
+        body = {'output': output_key,
+                'outputs': parse_outputs(output_key),
+                'inputs': [{'id': 'run_button', 'property': 'n_clicks',
+                            'value': 1}],
+                'state': [dict(state, value=states[state['id']])
+                          for state in callback['state']],
+                'changedPropIds': ['run_button.n_clicks']}
+        return json.dumps(body).encode('utf-8')
+    return request
+
+
+def start_server(workers, directory):
+    port = free_port()
+    env = dict(os.environ,
+               CACHE_DIR=os.path.join(directory, 'file_system_store'),
+               CHECKPOINT_DIR=os.path.join(directory, 'checkpoints'),
+               WAREHOUSE_PATH='', SIMULATION_MAX_WORKERS='1',
+               LOAD_TEST_SIMULATION_TIME=str(SIMULATION_TIME),
+               PYTHONPATH=os.pathsep.join(
+                   [ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', '1', '--timeout', '0',
+         'tests.load_app:server'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/_dash-layout', timeout=5)
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def throughput(url, request, n_requests, concurrency):
+    """
+    Completed requests per second
+    """
+    def post(n):
+        req = urllib.request.Request(
+            url + '/_dash-update-component', data=request(n),
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=120) as response:
+            assert response.status == 200
+            assert 'df_result_data_store' in response.read().decode()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Warm up every worker
+        list(executor.map(post, range(concurrency)))
+        start = time.perf_counter()
+        list(executor.map(post, range(concurrency,
+                                      concurrency + n_requests)))
+        return n_requests / (time.perf_counter() - start)
+
+
+def test_throughput_scales_with_workers():
+    request = single_calculation_request()
+    rates = {}
+    for workers in (1, WORKERS):
+        with tempfile.TemporaryDirectory() as directory:
+            process, url = start_server(workers, directory)
+            try:
+                rates[workers] = throughput(url, request, N_REQUESTS,
+                                            concurrency=2 * WORKERS)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    assert rates[WORKERS] >= MIN_SPEEDUP * rates[1], \
+        f'requests/s per number of workers: {rates}'
@@ -0,0 +1,77 @@
+import numpy as np
+
+from sim_app import plot_functions as pf
+
+
+def test_window():
+    values = np.arange(10.)
+    assert pf.window(values) == slice(None)
+    # One value beyond the range on each side
+    assert values[pf.window(values, [3., 5.])].tolist() == [2, 3, 4, 5, 6]
+    assert values[pf.window(values, [-1., 1.5])].tolist() == [0, 1, 2]
+    # Zoomed in between two values
+    assert values[pf.window(values, [4.2, 4.6])].tolist() == [4, 5]
+
+
+def test_decimate_2d_keeps_peaks():
+    z = np.zeros((400, 1000))
+    z[123, 456] = 5.
+    z[300, 10] = -7.
+    z[50, 50] = np.nan
+    x, y = np.arange(1000.), np.arange(400.)
+    z_red, x_red, y_red = pf.decimate_2d(z, x, y, resolution=(40, 100))
+    assert z_red.shape == (40, 100)
+    assert (len(x_red), len(y_red)) == (100, 40)
+    assert z_red.max() == 5. and z_red.min() == -7.
+    assert np.isfinite(z_red).all()
+    assert x_red[0] == np.mean(x[:10]) and y_red[-1] == np.mean(y[-10:])
+
+
+def test_decimate_2d_small_data_unchanged():
+    z = np.arange(12.).reshape(3, 4)
+    z_red, x_red, y_red = pf.decimate_2d(z, np.arange(4.), np.arange(3.))
+    assert (z_red == z).all() and len(x_red) == 4 and len(y_red) == 3
+
+
+def test_heatmap_window_row_indices():
+    # Rows at positions 10 * cell index
+    z = np.tile(np.arange(30.)[:, None], (1, 2000))
+    x, y = np.arange(2000.), 10. * np.arange(30.)
+    z_red, x_red, y_red, rows = pf.heatmap_window(
+        z, x, y, x_range=[0., 99.], y_range=[50., 120.])
+    assert rows.tolist() == [4, 5, 6, 7, 8, 9, 10, 11, 12, 13]
+    assert (y_red == 10. * rows).all()
+    assert (z_red[:, 0] == rows).all()
+    assert len(x_red) == 101
+
+    # Decimated rows: mean cell index of the block
+    z_red, x_red, y_red, rows = pf.heatmap_window(z, x, y,
+                                                  resolution=(10, 100))
+    assert len(rows) == len(y_red) == 10
+    assert rows[0] == 1. and (y_red == 10. * rows).all()
+
+
+def test_lttb_keeps_shape_and_extremes():
+    x = np.linspace(0., 10., 100000)
+    y = np.sin(x)
+    y[31415] = 5.
+    y[77777] = -4.
+    x_out, y_out = pf.lttb(x, y, 500)
+    assert len(x_out) == len(y_out) == 500
+    assert (x_out[0], x_out[-1]) == (x[0], x[-1])
+    assert (np.diff(x_out) > 0).all()
+    assert y_out.max() == 5. and y_out.min() == -4.
+    # Points are taken from the line, not interpolated
+    assert np.isin(y_out, y).all()
+    assert np.allclose(np.sin(x_out[np.abs(y_out) < 1.1]),
+                       y_out[np.abs(y_out) < 1.1])
+
+
+def test_lttb_short_lines_and_nan():
+    x, y = np.arange(10.), np.arange(10.) ** 2
+    x_out, y_out = pf.lttb(x, y, 20)
+    assert (x_out == x).all() and (y_out == y).all()
+    y = np.sin(np.arange(5000.))
+    y[100:200] = np.nan
+    x_out, y_out = pf.lttb(np.arange(5000.), y, 100)
+    assert len(x_out) == 100 and np.isfinite(y_out).sum() >= 98
@@ -0,0 +1,77 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+from sim_app import dash_functions as df
+from sim_app import main  # noqa: F401, builds the layout of nominal_inputs
+from sim_app import simulation_api as sim_api
+from sim_app.result_warehouse import ResultWarehouse
+from sim_app.study_functions import run_study
+
+
+def result(**values):
+    global_data = {name: {'value': value, 'units': 'V'}
+                   for name, value in values.items()}
+    return [global_data], [{'local': list(values)}], None
+
+
+def test_record_and_lookup(tmp_path):
+    warehouse = ResultWarehouse(str(tmp_path / 'warehouse.sqlite'))
+    warehouse.record({'a': result(voltage=1.), 'b': result(voltage=2.)})
+    # Runs already stored are kept, new quantities get their own column
+    warehouse.record({'a': result(voltage=5.),
+                      'c': result(voltage=3., power=4.)})
+    found = warehouse.lookup(['a', 'c', 'missing'])
+    assert set(found) == {'a', 'c'}
+    assert found['a'] == (result(voltage=1.)[0], result(voltage=1.)[1], None)
+    assert found['c'][0][0]['power']['value'] == 4.
+    table, units = warehouse.query()
+    assert units == {'voltage': 'V', 'power': 'V'}
+    assert table.loc['b', df.global_column('voltage')] == 2.
+    assert pd.isna(table.loc['b', df.global_column('power')])
+
+
+def test_lookup_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr('sim_app.result_warehouse.MAX_VARIABLES', 2)
+    warehouse = ResultWarehouse(str(tmp_path / 'warehouse.sqlite'))
+    warehouse.record({str(i): result(voltage=float(i)) for i in range(5)})
+    found = warehouse.lookup(str(i) for i in range(6))
+    assert sorted(found) == [str(i) for i in range(5)]
+
+
+def test_shared_by_processes(tmp_path):
+    path = str(tmp_path / 'warehouse.sqlite')
+    warehouse = pickle.loads(pickle.dumps(ResultWarehouse(path)))
+    warehouse.record({'a': result(voltage=1.)})
+    assert set(ResultWarehouse(path).lookup(['a'])) == {'a'}
+
+
+def test_study_runs_are_not_simulated_again(tmp_path, monkeypatch):
+    settings = df.base_settings()
+    df_input = df.nominal_inputs(settings)
+    table = [{'Parameter': 'cell-length', 'Variation Type': 'Values',
+              'Values': '0.4, 0.5, 0.6'}]
+    data = df.variation_parameter(df_input, table, mode='single')
+    simulate = sim_api.run_external_simulation
+    calls = []
+    monkeypatch.setattr(sim_api, 'run_external_simulation',
+                        lambda settings, initial_state=None:
+                        calls.append(settings) or simulate(settings))
+    path = str(tmp_path / 'warehouse.sqlite')
+    warehouse = ResultWarehouse(path)
+    results = run_study(data.copy(), df_input, settings,
+                        result_stores=[warehouse])
+    warehouse.index_parameters(results, df_input.columns)
+    assert len(calls) == 3
+
+    again = run_study(data.copy(), df_input, settings,
+                      result_stores=[ResultWarehouse(path)])
+    assert len(calls) == 3
+    voltage = df.global_column('Stack Voltage')
+    assert again[voltage].to_list() == results[voltage].to_list()
+
+    table, units = warehouse.query({'cell-length': (0.45, 0.65)})
+    assert sorted(table['cell-length']) == pytest.approx([0.5, 0.6])
+    assert units['Stack Voltage'] == results.attrs['global_units'][
+        'Stack Voltage']
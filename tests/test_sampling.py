@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from sim_app import dash_functions as df
+from sim_app import main  # noqa: F401, builds the layout of nominal_inputs
+
+TABLE = [{'Parameter': 'cell-length', 'Variation Type': 'Range',
+          'Values': '0.4, 0.6'},
+         {'Parameter': 'stack-cell_number', 'Variation Type': 'Percent (+/-)',
+          'Values': '50'},
+         {'Parameter': 'anode-channel-width', 'Variation Type': 'Values',
+          'Values': '0.001, 0.002, 0.003'}]
+
+
+@pytest.fixture(scope='module')
+def df_input():
+    return df.nominal_inputs(df.base_settings())
+
+
+@pytest.mark.parametrize('mode', sorted(df.SAMPLING_MODES))
+def test_sample_design_in_unit_cube(mode):
+    sample = df.sample_design(mode, 3, 20, seed=1)
+    assert sample.shape == (20, 3)
+    assert ((sample >= 0.) & (sample < 1.)).all()
+    assert np.array_equal(sample, df.sample_design(mode, 3, 20, seed=1))
+    assert not np.array_equal(sample, df.sample_design(mode, 3, 20, seed=2))
+
+
+def test_unknown_sampling_mode():
+    with pytest.raises(NotImplementedError):
+        df.sample_design('grid', 2, 4)
+
+
+def test_scale_sample_bounds_and_types():
+    u = np.array([0., 0.25, 0.5, 0.999])
+    assert df._scale_sample(u, [1., 3.], 'Range', 2.) == \
+        pytest.approx([1., 1.5, 2., 2.998])
+    integers = df._scale_sample(u, [5, 15], 'Percent (+/-)', 10)
+    assert integers == [5, 8, 10, 15]
+    assert all(isinstance(v, int) for v in integers)
+    # Vector parameters: one list per sample
+    vectors = df._scale_sample(u[[0, -1]], [[0., 10.], [1., 20.]], 'Range',
+                               [0.5, 15.])
+    assert vectors[0] == [0., 10.]
+    assert vectors[1] == pytest.approx([0.999, 19.99])
+    choices = df._scale_sample(u, ['a', 'b', 'c'], 'Values', 'a')
+    assert choices == ['a', 'a', 'b', 'c']
+
+
+@pytest.mark.parametrize('mode', sorted(df.SAMPLING_MODES))
+def test_sampled_study_within_bounds(df_input, mode):
+    data = df.variation_parameter(df_input, TABLE, mode=mode, n_samples=16,
+                                  seed=3)
+    assert len(data) == df.count_parameter_sets(TABLE, mode, 16) == 16
+    assert data['cell-length'].between(0.4, 0.6).all()
+    assert data['stack-cell_number'].between(5, 15).all()
+    assert all(isinstance(v, int) for v in data['stack-cell_number'])
+    assert set(data['anode-channel-width']) <= {0.001, 0.002, 0.003}
+    # Unvaried parameters stay nominal
+    nominal = df_input.loc['nominal', 'cathode-channel-width']
+    assert (data['cathode-channel-width'] == nominal).all()
+    again = df.variation_parameter(df_input, TABLE, mode=mode, n_samples=16,
+                                   seed=3)
+    assert data.equals(again)
+
+
+def test_sampled_study_needs_runs_and_range_limits(df_input):
+    with pytest.raises(ValueError):
+        df.variation_parameter(df_input, TABLE, mode='lhs', n_samples=None)
+    table = [{'Parameter': 'cell-length', 'Variation Type': 'Range',
+              'Values': '0.4, 0.5, 0.6'}]
+    with pytest.raises(ValueError):
+        df.variation_parameter(df_input, table, mode='lhs', n_samples=4)
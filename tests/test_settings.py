@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+from sim_app import dash_functions as df
+from sim_app import dash_layout as dl
+from sim_app import main
+
+INPUT_IDS = [i for i in dl.ID_LIST if i['type'] == 'input']
+MULTIINPUT_IDS = [i for i in dl.ID_LIST if i['type'] == 'multiinput']
+
+
+def test_initialization_fills_all_form_fields():
+    values, multivalues, df_input, table, session_id = \
+        main.cbf_initialization(
+            None, [None] * len(INPUT_IDS), [None] * len(MULTIINPUT_IDS),
+            INPUT_IDS, MULTIINPUT_IDS)
+    # One value per ALL output
+    assert len(values) == len(INPUT_IDS)
+    assert len(multivalues) == len(MULTIINPUT_IDS)
+    assert None not in multivalues
+    assert list(df_input.index) == ['nominal']
+
+
+def test_nominal_inputs_are_plain_values():
+    df_input = df.nominal_inputs(df.base_settings())
+    for value in df_input.loc['nominal']:
+        assert not isinstance(value, tuple)
+        if isinstance(value, list):
+            assert all(isinstance(v, (int, float, str)) for v in value)
+
+
+def test_base_settings_are_shared_and_immutable():
+    settings = df.base_settings()
+    assert df.base_settings() is settings
+    with pytest.raises(TypeError):
+        settings['stack'] = {}
+    mutable = df.thaw(settings)
+    mutable['stack'] = {}
+    assert df.base_settings()['stack'] != {}
+
+
+def first_list(data, path=()):
+    """
+    Path and value of the first list in nested settings
+    """
+    for key, value in data.items():
+        if isinstance(value, list):
+            return path + (key,), value
+        if isinstance(value, dict):
+            found = first_list(value, path + (key,))
+            if found:
+                return found
+    return None
+
+
+def test_transferred_settings_are_mutable_copies():
+    settings = df.base_settings()
+    df_input = df.nominal_inputs(settings)
+    data = df.create_settings(
+        pd.concat([df_input, df_input], ignore_index=True), settings)
+    first, second = data['settings']
+    assert type(first) is dict and first is not second
+    assert first == second
+    path, values = first_list(first)
+    first['cell']['length'] = 1
+    values.append('changed')
+
+    again = df.create_settings(df_input, settings)['settings'].iloc[0]
+    assert again == second and again['cell']['length'] != 1
+    entry = again
+    for key in path:
+        entry = entry[key]
+    assert 'changed' not in entry
+    assert all(isinstance(x, df.FrozenDict)
+               for x in df.settings_transfers._entries.values())
+
+
+def test_settings_memo_is_bounded(monkeypatch):
+    calls = []
+    monkeypatch.setattr(df.data_transfer, 'dict_transfer',
+                        lambda input_data, settings:
+                        calls.append(input_data) or (dict(input_data), None))
+    memo = df.SettingsTransferMemo(2)
+    settings = {'cell': {'length': 0.5}}
+    for n in (1, 2, 1, 3, 1, 2):
+        assert memo.transfer({'n': n}, settings) == {'n': n}
+    # 2 was least recently used when 3 was added
+    assert calls == [{'n': 1}, {'n': 2}, {'n': 3}, {'n': 2}]
+    assert len(memo._entries) == 2
+    memo.transfer({'n': 1}, {'cell': {'length': 0.6}})
+    assert len(calls) == 5
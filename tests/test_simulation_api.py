@@ -0,0 +1,49 @@
+from sim_app import simulation_api as sim_api
+
+
+def test_process_pool_is_shared_and_not_forked():
+    pool = sim_api.process_pool(2)
+    assert sim_api.process_pool(2) is pool
+    assert pool._mp_context.get_start_method() != 'fork'
+    items = dict(sim_api.run_external_simulation_batch(
+        [{'id': i} for i in range(4)], max_workers=2))
+    assert sorted(items) == [0, 1, 2, 3]
+    assert all(isinstance(result, tuple) for result in items.values())
+    assert sim_api.process_pool(2) is pool
+
+
+def test_native_batch_backend(monkeypatch):
+    calls = []
+
+    def batch_backend(settings_list, initial_states):
+        calls.append(len(settings_list))
+        for pos in reversed(range(len(settings_list))):
+            yield pos, ([{'id': {'value': settings_list[pos]['id']}}],
+                        [{}], None)
+
+    monkeypatch.setattr(sim_api, 'batch_backend', batch_backend)
+    monkeypatch.setattr(sim_api, 'run_external_simulation', None)
+    items = list(sim_api.run_external_simulation_batch(
+        [{'id': i} for i in range(3)]))
+    assert calls == [3]
+    assert [pos for pos, _ in items] == [2, 1, 0]
+    assert all(result[0][0]['id']['value'] == pos for pos, result in items)
+
+
+def test_failing_batch_backend(monkeypatch):
+    def batch_backend(settings_list, initial_states):
+        yield 1, ([{}], [{}], None)
+        raise RuntimeError('solver crashed')
+
+    monkeypatch.setattr(sim_api, 'batch_backend', batch_backend)
+    items = dict(sim_api.run_external_simulation_batch([{}, {}, {}]))
+    assert isinstance(items[1], tuple)
+    assert items[0] == items[2] == "RuntimeError('solver crashed')"
+
+
+def test_single_call_fallback(monkeypatch):
+    monkeypatch.setattr(sim_api, 'run_external_simulation',
+                        lambda settings, initial_state=None: settings['id'])
+    items = list(sim_api.run_external_simulation_batch(
+        [{'id': i} for i in range(3)]))
+    assert items == [(0, 0), (1, 1), (2, 2)]
@@ -0,0 +1,165 @@
+"""
+AsyncSimulationClient against a local stand-in simulation service
+"""
+import asyncio
+import collections
+import threading
+
+import pytest
+from aiohttp import web
+
+from sim_app.simulation_client import AsyncSimulationClient, \
+    run_remote_simulation_batch
+
+
+class StandInService:
+    """
+    Simulation service answering {"settings": {"id": n}} with the global
+    result {"id": n}. Per id, the first 'failures[n]' calls answer with
+    'failure_status' (or hang longer than the client timeout if it is
+    None), and answers are delayed by 'delays[n]' seconds.
+    """
+
+    def __init__(self):
+        self.failures = {}
+        self.failure_status = 503
+        self.delays = {}
+        self.calls = collections.Counter()
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    async def handle(self, request):
+        body = await request.json()
+        n = body['settings']['id']
+        self.calls[n] += 1
+        if self.calls[n] <= self.failures.get(n, 0):
+            if self.failure_status is None:
+                await asyncio.sleep(2)
+            return web.Response(status=self.failure_status, text='busy')
+        await asyncio.sleep(self.delays.get(n, 0))
+        return web.json_response({'global_data': [{'id': {'value': n}}],
+                                  'local_data': [{}],
+                                  'additional_data': None})
+
+    async def dispatch(self, request):
+        # Late binding, tests may replace handle
+        return await self.handle(request)
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post('/simulate', self.dispatch)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        self._loop.run_until_complete(site.start())
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/simulate'
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait(10)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(
+            self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+
+
+@pytest.fixture
+def service():
+    service = StandInService()
+    service.start()
+    yield service
+    service.stop()
+
+
+def simulate_many(url, settings_list, **kwargs):
+    async def main():
+        async with AsyncSimulationClient(url, **kwargs) as client:
+            return [item async for item in
+                    client.simulate_many(settings_list)]
+    return asyncio.run(main())
+
+
+def result_id(result):
+    return result[0][0]['id']['value']
+
+
+def test_results_by_input_position(service):
+    # Later inputs answer first
+    n = 20
+    service.delays = {i: 0.01 * (n - i) for i in range(n)}
+    items = simulate_many(service.url, [{'id': i} for i in range(n)],
+                          max_connections=n)
+    positions = [pos for pos, _ in items]
+    assert positions != sorted(positions)
+    assert sorted(positions) == list(range(n))
+    assert all(result_id(result) == pos for pos, result in items)
+
+
+def test_retry_on_server_errors(service):
+    service.failures = {0: 2, 3: 1}
+    items = dict(simulate_many(service.url, [{'id': i} for i in range(5)],
+                               retries=3, backoff=0.01))
+    assert [result_id(items[i]) for i in range(5)] == list(range(5))
+    assert service.calls[0] == 3 and service.calls[3] == 2
+    assert service.calls[1] == 1
+
+
+def test_retry_on_timeout(service):
+    service.failure_status = None
+    service.failures = {1: 1}
+    items = dict(simulate_many(service.url, [{'id': i} for i in range(3)],
+                               timeout=0.5, retries=2, backoff=0.01))
+    assert result_id(items[1]) == 1
+    assert service.calls[1] == 2
+
+
+def test_exhausted_retries_and_client_errors(service):
+    service.failures = {0: 10, 1: 1}
+    service.failure_status = 503
+    items = dict(simulate_many(service.url, [{'id': 0}, {'id': 2}],
+                               retries=2, backoff=0.01))
+    assert isinstance(items[0], str) and '503' in items[0]
+    assert result_id(items[1]) == 2
+    assert service.calls[0] == 3
+
+    # No retries of other errors
+    service.failure_status = 400
+    items = dict(simulate_many(service.url, [{'id': 1}], retries=2,
+                               backoff=0.01))
+    assert 'RemoteSimulationError' in items[0]
+    assert service.calls[1] == 1
+
+
+def test_concurrency_bound(service):
+    in_flight = []
+    handle = service.handle
+
+    async def counting_handle(request):
+        in_flight.append(1)
+        try:
+            assert len(in_flight) <= 4
+            return await handle(request)
+        finally:
+            in_flight.pop()
+
+    service.handle = counting_handle
+    service.delays = {i: 0.05 for i in range(16)}
+    items = simulate_many(service.url, [{'id': i} for i in range(16)],
+                          max_connections=4)
+    assert all(not isinstance(result, str) for _, result in items)
+
+
+def test_synchronous_batch(service):
+    service.delays = {0: 0.2}
+    items = list(run_remote_simulation_batch(
+        [{'id': i} for i in range(4)], service.url, backoff=0.01))
+    assert [pos for pos, _ in items][-1] == 0
+    assert all(result_id(result) == pos for pos, result in items)
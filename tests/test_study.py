@@ -0,0 +1,273 @@
+import os
+import pickle
+import threading
+
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+
+from sim_app import cache_store
+from sim_app import dash_functions as df
+from sim_app import dash_layout as dl
+from sim_app import main
+from sim_app import simulation_api as sim_api
+from sim_app.cache_store import BoundedFileSystemStore
+from sim_app.study_functions import StudySlot, run_study
+
+INPUT_IDS = [i for i in dl.ID_LIST if i['type'] == 'input']
+MULTIINPUT_IDS = [i for i in dl.ID_LIST if i['type'] == 'multiinput']
+
+
+def new_session(variations):
+    """
+    Initialized session with the form state of the page load and a study
+    table varying {parameter: (variation type, values)}
+    """
+    values, multivalues, df_input, table, session_id = \
+        main.cbf_initialization(
+            None, [None] * len(INPUT_IDS), [None] * len(MULTIINPUT_IDS),
+            INPUT_IDS, MULTIINPUT_IDS)
+    main.cbf_form_state(
+        {'version': 1, 'full': True,
+         'changes': {i['id']: v for i, v in zip(INPUT_IDS + MULTIINPUT_IDS,
+                                                values + multivalues)}},
+        session_id)
+    rows = table.data
+    for row in rows:
+        if row['Parameter'] in variations:
+            row['Variation Type'], row['Values'] = \
+                variations[row['Parameter']]
+    return rows, session_id
+
+
+ADMITTED = {'admitted': True}
+VARIATIONS = {'cell-length': ('Percent (+/-)', '10'),
+              'anode-channel-width': ('Values', '0.001, 0.002, 0.003')}
+
+
+def test_sensitivity_preview(monkeypatch):
+    def predict_study(backend, settings, design, input_cols):
+        mean = pd.DataFrame({'Stack Voltage': 1.}, index=design.index)
+        return mean, mean * 0.1, {'Stack Voltage': 'V'}
+
+    monkeypatch.setattr(main.surrogate, 'predict_study', predict_study)
+    table, session_id = new_session(VARIATIONS)
+    columns, rows, info = main.cbf_study_preview(
+        1, None, table, 'sensitivity', None, 0, ADMITTED, session_id)
+    names = [column['name'] for column in columns]
+    assert 'nominal' not in names
+    assert {'cell-length', 'anode-channel-width'} <= set(names)
+    assert len(rows) == 5
+
+
+def test_preview_of_admitted_studies_only(monkeypatch):
+    table, session_id = new_session(VARIATIONS)
+    assert main.cbf_study_preview(
+        1, None, table, 'full', None, 0, None, session_id) == ([], [], '')
+    assert main.cbf_study_preview(
+        1, None, table, 'full', None, 0, {'admitted': False},
+        session_id) == ([], [], '')
+    table[0].update({'Variation Type': 'Values', 'Values': '0.1, x'})
+    assert main.cbf_study_preview(
+        1, None, table, 'full', None, 0, ADMITTED, session_id)[2] == \
+        'Invalid entry in study table.'
+    assert main.cbf_study_preview(
+        1, None, table, 'lhs', None, 0, ADMITTED, session_id)[2] == \
+        'Invalid entry in study table.'
+
+
+def test_no_preview_after_results(monkeypatch):
+    table, session_id = new_session(VARIATIONS)
+    main.mark_study_done(session_id, 2)
+    for btn in (1, 2):
+        with pytest.raises(PreventUpdate):
+            main.cbf_study_preview(btn, None, table, 'full', None, 0,
+                                   ADMITTED, session_id)
+    assert main.cbf_study_preview(
+        3, None, table, 'full', None, 0, ADMITTED, session_id)[2]
+
+
+def test_surrogate_history_by_settings_hash(tmp_path):
+    backend = BoundedFileSystemStore(str(tmp_path))
+    settings = df.base_settings()
+    table, session_id = new_session(VARIATIONS)
+    results = main.cbf_run_study(
+        1, None, table, None, 'full', None, 0, session_id)[0]
+    columns = df.nominal_inputs(settings).columns
+    for _ in range(2):
+        main.surrogate.record_results(backend, settings, results, columns)
+    history = backend.get(main.surrogate.history_key(settings))
+    assert len(history['inputs']) == len(history['outputs']) == 6
+    assert sorted(history['hashes']) == sorted(results["settings_hash"])
+
+
+def test_study_with_parallel_workers(monkeypatch):
+    monkeypatch.setattr(main.config, 'SIMULATION_MAX_WORKERS', 2)
+    table, session_id = new_session(VARIATIONS)
+    results = main.cbf_run_study(
+        1, None, table, None, 'full', None, 0, session_id)[0]
+    assert len(results) == 6
+    assert results["successful_run"].all()
+
+
+def test_session_results_outlive_cache_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.config, 'STUDY_RESULTS_TIMEOUT', 3600)
+    backend = BoundedFileSystemStore(str(tmp_path), default_timeout=900)
+    results = df.SessionResultStore(backend, 'session')
+    results.record({'hash': ('result',)})
+    results.save()
+    now = cache_store.time.time()
+    monkeypatch.setattr(cache_store.time, 'time', lambda: now + 1800)
+    results = df.SessionResultStore(backend, 'session')
+    assert results.lookup(['hash', 'other']) == {'hash': ('result',)}
+    monkeypatch.setattr(cache_store.time, 'time', lambda: now + 4000)
+    assert df.SessionResultStore(backend, 'session').lookup(['hash']) == {}
+
+
+def test_study_slots_per_user(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.config, 'STUDY_MAX_CONCURRENT', 1)
+    backend = BoundedFileSystemStore(str(tmp_path))
+    with StudySlot(backend, '10.0.0.1') as slot:
+        assert slot.acquired
+        with StudySlot(backend, '10.0.0.1') as other_tab:
+            assert not other_tab.acquired
+        with StudySlot(backend, '10.0.0.2') as other_user:
+            assert other_user.acquired
+        assert not StudySlot(backend, '10.0.0.1').__enter__().acquired
+    with StudySlot(backend, '10.0.0.1') as slot:
+        assert slot.acquired
+
+
+def test_study_slots_are_atomic(tmp_path, monkeypatch):
+    # One store per thread, like worker processes sharing the directory
+    monkeypatch.setattr(main.config, 'STUDY_MAX_CONCURRENT', 2)
+    barrier = threading.Barrier(8)
+    acquired = []
+
+    def request():
+        backend = BoundedFileSystemStore(str(tmp_path))
+        barrier.wait()
+        acquired.append(StudySlot(backend, 'user').__enter__().acquired)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(acquired) == 2
+
+
+def test_running_study_of_user_rejects_study(monkeypatch):
+    monkeypatch.setattr(main.config, 'STUDY_MAX_CONCURRENT', 1)
+    table, session_id = new_session(VARIATIONS)
+    environ = {'REMOTE_ADDR': '10.0.0.3'}
+    with StudySlot(main.caching_backend, '10.0.0.3'):
+        with main.server.test_request_context(environ_base=environ):
+            outputs = main.cbf_run_study(
+                1, None, table, None, 'full', None, 0, session_id)
+    assert outputs[-1] is True
+    assert 'still running' in str(outputs[-2])
+    with main.server.test_request_context(environ_base=environ):
+        results = main.cbf_run_study(
+            1, None, table, None, 'full', None, 0, session_id)[0]
+    assert len(results) == 6
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_resume_from_checkpoint(tmp_path, monkeypatch):
+    settings = df.base_settings()
+    df_input = df.nominal_inputs(settings)
+    table = [{'Parameter': 'cell-length', 'Variation Type': 'Values',
+              'Values': '0.40, 0.41, 0.42, 0.43'}]
+    data = df.variation_parameter(df_input, table, mode='full')
+    study_id = df.StudyCheckpoint.study_id(settings, data)
+    simulate = sim_api.run_external_simulation
+    calls = []
+
+    def interrupted_after_two(settings, initial_state=None):
+        if len(calls) == 2:
+            raise Interrupted
+        calls.append(settings)
+        return simulate(settings, initial_state=initial_state)
+
+    monkeypatch.setattr(sim_api, 'run_external_simulation',
+                        interrupted_after_two)
+    checkpoint = df.StudyCheckpoint(study_id, directory=str(tmp_path))
+    with pytest.raises(Interrupted):
+        run_study(data.copy(), df_input, settings,
+                  result_stores=[checkpoint])
+    assert len(calls) == 2
+
+    monkeypatch.setattr(sim_api, 'run_external_simulation',
+                        lambda settings, initial_state=None:
+                        calls.append(settings) or simulate(settings))
+    checkpoint = df.StudyCheckpoint(study_id, directory=str(tmp_path))
+    results = run_study(data.copy(), df_input, settings,
+                        result_stores=[checkpoint])
+    checkpoint.complete()
+    assert len(calls) == 4
+    assert [row['cell']['length'] for row in calls] == \
+        [0.40, 0.41, 0.42, 0.43]
+    assert results["successful_run"].all() and len(results) == 4
+    assert os.listdir(tmp_path) == []
+
+
+def test_checkpoint_byte_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.config, 'CHECKPOINT_SIZE_LIMIT', 2500)
+    # Least recently written first, 'kept' is the log of the new study
+    for n, name in enumerate(['kept', 'older', 'old', 'new']):
+        path = tmp_path / f'{name}.log'
+        path.write_bytes(b'x' * 1000)
+        os.utime(path, (1e9 + n, 1e9 + n))
+    (tmp_path / 'other.txt').write_bytes(b'x' * 5000)
+    monkeypatch.setattr(main.config, 'CHECKPOINT_MAX_AGE', 1e12)
+    df.StudyCheckpoint.prune(str(tmp_path), keep=str(tmp_path / 'kept.log'))
+    assert sorted(os.listdir(tmp_path)) == ['kept.log', 'new.log',
+                                            'other.txt']
+
+
+def test_checkpoint_with_truncated_record(tmp_path):
+    checkpoint = df.StudyCheckpoint('study', directory=str(tmp_path))
+    checkpoint.record({'a': ([1], [2], None)})
+    checkpoint.record({'a': ([3], [4], None), 'b': ([5], [6], None)})
+    # Crash while writing the next record
+    with open(checkpoint.path, 'ab') as file:
+        file.write(pickle.dumps({'c': ([7], [8], None)})[:-3])
+    resumed = df.StudyCheckpoint('study', directory=str(tmp_path))
+    assert resumed.lookup(['a', 'b', 'c']) == {'a': ([1], [2], None),
+                                               'b': ([5], [6], None)}
+
+
+def test_fingerprint_of_equal_settings():
+    settings = df.base_settings()
+    assert df.fingerprint(settings) == df.fingerprint(df.thaw(settings))
+    reordered = dict(reversed(list(df.thaw(settings).items())))
+    assert df.fingerprint(reordered) == df.fingerprint(settings)
+    changed = df.thaw(settings)
+    changed['cell']['length'] += 1e-9
+    assert df.fingerprint(changed) != df.fingerprint(settings)
+
+
+def test_identical_parameter_sets_simulated_once(monkeypatch):
+    settings = df.base_settings()
+    df_input = df.nominal_inputs(settings)
+    # Nominal length 0.5 in the values, a repeated value, nominal run kept
+    # and a duplicate row
+    table = [{'Parameter': 'cell-length', 'Variation Type': 'Values',
+              'Values': '0.4, 0.5, 0.6, 0.4'}]
+    data = df.variation_parameter(df_input, table, keep_nominal=True,
+                                  mode='single')
+    data = pd.concat([data, data.iloc[[0]]], ignore_index=True)
+    simulate = sim_api.run_external_simulation
+    calls = []
+    monkeypatch.setattr(sim_api, 'run_external_simulation',
+                        lambda settings, initial_state=None:
+                        calls.append(settings) or simulate(settings))
+    results = run_study(data, df_input, settings)
+    assert len(results) == len(data) == 6
+    assert len(calls) == results["settings_hash"].nunique() == 3
+    assert results["successful_run"].all()
+    assert results["global: Stack Voltage"].notna().all()